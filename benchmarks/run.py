@@ -0,0 +1,131 @@
+'''
+Time the stages of db-check on synthetic DBs of increasing size.
+
+Each size is run in a fresh process, so the peak memory reported is that of
+the stages run so far on that size only. Results are saved as JSON, and can
+be compared against those of an earlier run (e.g., the last release) to
+catch regressions.
+
+    python benchmarks/run.py --sizes 10000,1000000 --output bench.json
+    python benchmarks/run.py --baseline bench.json
+'''
+
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import tempfile
+
+import click
+from tabulate import tabulate
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from synthetic import HEADER_FORMATS, synthetic_records, write_clstr  # noqa: E402
+from db_check.messages import error, info, success, warning  # noqa: E402
+
+
+def run_size(clstr, n, header, max_clusters, queue):
+    '''
+    Run the stages on one .clstr file, and put the recorded stages in the
+    queue. Meant to be run in its own process.
+    '''
+    from db_check.checklist import DBChecklist
+    from db_check.parsers import parse_categories, parse_clustering
+    from db_check.profiling import Profiler
+    from db_check.report import generate_report
+
+    profiler = Profiler()
+    with profiler.stage("parse_clustering"):
+        tab = parse_clustering(clstr)
+    with profiler.stage("parse_categories"):
+        tab = parse_categories(tab, **HEADER_FORMATS[header][1])
+    with profiler.stage("DBChecklist"):
+        checklist = DBChecklist(tab, author="benchmark", db_name=f"synthetic_{n}")
+        checklist.ticks()
+    with profiler.stage("generate_report"), open(os.devnull, 'wt') as devnull:
+        generate_report(checklist, stream=devnull, max_clusters=max_clusters,
+                        prefix=os.path.join(os.path.dirname(clstr), "report"))
+    queue.put(profiler.stages)
+
+
+def benchmark(n, header, max_clusters, seed):
+    '''
+    Generate a synthetic .clstr file with n records, and return the stages
+    run on it, with their throughput in records per second.
+    '''
+    with tempfile.TemporaryDirectory() as tmpdir:
+        clstr = os.path.join(tmpdir, "synthetic.clstr")
+        info(f"Generating {n} records...")
+        write_clstr(synthetic_records(n, header=header, seed=seed), clstr)
+        info(f"Running the stages on {n} records...")
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        process = ctx.Process(target=run_size,
+                              args=(clstr, n, header, max_clusters, queue))
+        process.start()
+        stages = queue.get()
+        process.join()
+    for stage in stages:
+        stage['records'] = n
+        stage['records_per_second'] = round(n / max(stage['wall_seconds'], 1e-9))
+    return stages
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Return the stages that took more than (1 + tolerance) times as long,
+    or used more than (1 + tolerance) times as much memory, as in the
+    baseline.
+    '''
+    previous = {(stage['records'], stage['stage']): stage for stage in baseline}
+    regressions = []
+    for stage in results:
+        before = previous.get((stage['records'], stage['stage']))
+        if before is None:
+            continue
+        for key in ('wall_seconds', 'peak_rss_mb'):
+            if before[key] and stage[key] > before[key] * (1 + tolerance):
+                regressions.append(
+                    f"{stage['stage']} on {stage['records']} records: {key} went from {before[key]:.2f} to {stage[key]:.2f}")
+    return regressions
+
+
+@click.command()
+@click.option("--sizes", default="10000,1000000,10000000", help="Comma separated numbers of records to run. (default: 10000,1000000,10000000)")
+@click.option("--header", default="mlst", type=click.Choice(list(HEADER_FORMATS)), help="Format of the sequence IDs. (default: mlst)")
+@click.option("--max-clusters-in-report", "max_clusters", default=1000, type=int, help="As for db-check. (default: 1000)")
+@click.option("--seed", default=0, type=int, help="Random seed. (default: 0)")
+@click.option("--output", default="benchmarks.json", help="Where to save the results. (default: benchmarks.json)")
+@click.option("--baseline", default=None, type=click.Path(exists=True), help="Results of an earlier run to compare against.")
+@click.option("--tolerance", default=0.2, type=float, help="Slow down (or growth in memory) relative to the baseline to flag as a regression. (default: 0.2)")
+def run_benchmarks(sizes, header, max_clusters, seed, output, baseline, tolerance):
+    '''
+    Benchmark db-check on synthetic DBs.
+    '''
+    results = []
+    for n in [int(size) for size in sizes.split(",")]:
+        results.extend(benchmark(n, header, max_clusters, seed))
+    columns = ['records', 'stage', 'wall_seconds', 'cpu_seconds',
+               'peak_rss_mb', 'records_per_second']
+    info(tabulate([[stage[col] for col in columns] for stage in results],
+                  headers=columns, floatfmt=".2f"))
+    with open(output, 'wt') as fh:
+        json.dump(results, fh, indent=2)
+    info(f"Saved results to {output}")
+    if baseline is None:
+        return
+    with open(baseline) as fh:
+        regressions = compare(results, json.load(fh), tolerance)
+    if regressions:
+        for regression in regressions:
+            warning(regression)
+        error(f"Found {len(regressions)} regressions.")
+        sys.exit(1)
+    success("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,111 @@
+'''
+Generate synthetic FASTA DBs, and the matching CD-HIT .clstr files, to
+benchmark db-check.
+
+Records are drawn one after the other. Each is either a new sequence
+(starting a new cluster as its centroid), an identical copy of an earlier
+centroid, or a sub-sequence of an earlier centroid. Some records reuse the
+ID of an earlier record, and some get a category other than that of their
+cluster.
+'''
+
+import numpy as np
+import pandas as pd
+
+# name: (seqid template, arguments to db_check.parsers.parse_categories)
+HEADER_FORMATS = {
+    'mlst': ("{category}_{i}", {'delimiter': '_', 'field': 0}),
+    'tilde': ("seq{i}~~{category}", {'regex': '.*~~(.*)'}),
+    'pipe': ("seq{i}|{category}", {'delimiter': '|', 'field': -1}),
+}
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def synthetic_records(n, min_length=400, max_length=600, duplicate_id_rate=0.01,
+                      identical_rate=0.05, containment_rate=0.05, n_categories=7,
+                      conflict_rate=0.01, header='mlst', seed=0):
+    '''
+    Draw n records, and return a pandas.DataFrame with the seqid, category,
+    cluster, whether it is the centroid, length, and offset in its
+    centroid of each, in the order they were drawn.
+    '''
+    rng = np.random.default_rng(seed)
+    draw = rng.random(n)
+    is_new = draw >= identical_rate + containment_rate
+    is_new[:1] = True
+    is_contained = ~is_new & (draw >= identical_rate)
+    n_new = np.cumsum(is_new)
+    # copies pick one of the clusters started before them
+    cluster = np.where(is_new, n_new - 1,
+                       (rng.random(n) * n_new).astype(np.int64))
+    centroid_length = rng.integers(min_length, max_length + 1, size=n_new[-1])
+    length = centroid_length[cluster]
+    sub_length = (length * rng.uniform(0.5, 1.0, size=n)).astype(np.int64)
+    length = np.where(is_contained, np.maximum(sub_length, 1), length)
+    offset = np.where(is_contained,
+                      (rng.random(n) * (centroid_length[cluster] - length + 1)).astype(np.int64), 0)
+    names = np.arange(n)
+    reuse = rng.random(n) < duplicate_id_rate
+    reuse[:1] = False
+    names = np.where(reuse, (rng.random(n) * names).astype(np.int64), names)
+    # follow chains of reused IDs back to the record that first used it
+    while True:
+        first = names[names]
+        if np.array_equal(first, names):
+            break
+        names = first
+    cluster_category = rng.integers(0, n_categories, size=n_new[-1])
+    category = np.where(~is_new & (rng.random(n) < conflict_rate),
+                        rng.integers(0, n_categories, size=n), cluster_category[cluster])
+    category_names = np.array([f"locus{c}" for c in range(n_categories)])
+    # a reused ID keeps the category it was first given
+    category = category[names]
+    template, _ = HEADER_FORMATS[header]
+    seqid = [template.format(i=i, category=c)
+             for i, c in zip(names.tolist(), category_names[category].tolist())]
+    return pd.DataFrame({'seqid': seqid,
+                         'category': category_names[category],
+                         'clusterid': cluster,
+                         'is_centroid': is_new,
+                         'length': length,
+                         'offset': offset})
+
+
+def write_clstr(records, filename, chunk_size=100000):
+    '''
+    Write the clustering of the records as CD-HIT would, with the
+    centroid first in each cluster.
+    '''
+    tab = records.sort_values('clusterid', kind='stable')
+    member = tab.groupby('clusterid').cumcount().to_numpy()
+    with open(filename, 'wt') as fh:
+        for start in range(0, tab.shape[0], chunk_size):
+            chunk = tab.iloc[start:start + chunk_size]
+            fh.writelines(
+                (f">Cluster {c}\n" if m == 0 else "") +
+                f"{m}\t{l}nt, >{s}... " +
+                ("*\n" if centroid else "at +/100.00%\n")
+                for c, m, l, s, centroid in zip(chunk.clusterid.tolist(),
+                                                member[start:start + chunk_size].tolist(),
+                                                chunk.length.tolist(),
+                                                chunk.seqid.tolist(),
+                                                chunk.is_centroid.tolist()))
+
+
+def write_fasta(records, filename, seed=0, width=60):
+    '''
+    Write the records as a FASTA DB. The centroids are random sequences,
+    and all other records are taken from them, so every centroid is held
+    in memory until the end.
+    '''
+    rng = np.random.default_rng(seed)
+    centroids = {}
+    with open(filename, 'wb') as fh:
+        for row in records.itertuples(index=False):
+            if row.is_centroid:
+                centroids[row.clusterid] = BASES[rng.integers(
+                    0, 4, size=row.length)].tobytes()
+            seq = centroids[row.clusterid][row.offset:row.offset + row.length]
+            lines = [seq[i:i + width] for i in range(0, len(seq), width)]
+            fh.write(b">%s\n%s\n" % (row.seqid.encode(), b"\n".join(lines)))
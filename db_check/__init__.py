@@ -1 +1,12 @@
 __VERSION__ = "0.1.5"
+
+# the Python API (see db_check.api), imported on first use so that the
+# command line does not pay for it
+API = ('check', 'check_many', 'CheckResult', 'Finding')
+
+
+def __getattr__(name):
+    if name in API:
+        from db_check import api
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
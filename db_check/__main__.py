@@ -1,17 +1,18 @@
 '''
 Main db_check access point
+
+Only what is needed to parse the command line is imported up front, so
+--help and --version are quick. The rest (pandas and all) is imported by
+the stage that needs it.
 '''
-import os
+import getpass
 import pathlib
 
 import click
 
 from db_check import __VERSION__ as version_string
-from db_check.clustering import *
-from db_check.parsers import *
-from db_check.checklist import DBChecklist
-from db_check.report import *
 from db_check.messages import error, info
+from db_check.profiling import Profiler
 
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
@@ -21,19 +22,18 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 def check_params(ctx):
     '''
     Check that if delimter is set that field is also set. 
-    Check that if regex is set, delimeter and field are not
+    Check that only one of delimiter and field, regex, or callback is set
     '''
-    opts = [ctx.params.get('delimiter', None) is None,
-            ctx.params.get('field', None) is None,
-            ctx.params.get('regex', None) is None]
-    if all(opts):
-        return
-    if opts[0] and opts[1] and not opts[2]:
-        return
-    if not opts[0] and not opts[1] and opts[2]:
+    params = ctx.params
+    delimiter = params.get('delimiter', None) is not None
+    field = params.get('field', None) is not None
+    modes = [delimiter or field,
+             params.get('regex', None) is not None,
+             params.get('callback', None) is not None]
+    if delimiter == field and sum(modes) <= 1:
         return
     error(
-        "ERROR: Delimiter and field must be specified OR regex OR None.")
+        "ERROR: Delimiter and field must be specified OR regex OR callback OR None.")
     ctx.exit()
 
 
@@ -45,8 +45,15 @@ def run_example(ctx, param, value):
         return
     fasta = pathlib.Path(__file__).parent / "examples" / "example_db.fasta"
     ctx.invoke(run_db_check, delimiter=None, field=None,
-               regex=".*~~(.*)", threads=1, author="Example", db_name="Example DB",
-               prefix="example", keep_files=False, fasta=fasta)
+               regex=".*~~(.*)", callback=None, callback_key=None, callback_workers=1,
+               threads=1, memory=None, workdir=None, cdhit_timeout=None,
+               author="Example", db_name="Example DB",
+               prefix="example", keep_files=False, engine="cdhit", containment=True, collapse=True,
+               max_clusters_in_report=None, output_formats=["markdown"], outdir=".",
+               manifest=None, previous=None, sequence_stats=False, identity=None, validate="fail", cache=False,
+               cache_dir=None, cache_max_size=None, cache_max_age=None, stream=False, nonredundant=None,
+               nonredundant_policy="centroid", skip_checks=(),
+               check_timeout=None, profile=None, cprofile_dir=None, fasta=fasta)
     ctx.exit()
 
 
@@ -54,44 +61,100 @@ def run_example(ctx, param, value):
 @click.option("-d", "--delimiter", default=None, help="When parsing a category from seqid, split on this delimiter (use -1 for last element, -2 for second to last, etc.).")
 @click.option("-f", "--field", default=None, help="When parsing a category from seqid using a delimiter, keep this field number (0-index).", type=int)
 @click.option("-r", "--regex", default=None, help="When parsing a category from seqid extract using this regex.")
-@click.option("-a", "--author", default=f"{os.getlogin()}", help="Who is running the check. (default: $USER)")
+@click.option("-c", "--callback", default=None, help="When parsing a category from seqid use this function, given as module:function or path/to/file.py:function.")
+@click.option("--callback-key", default=None, help="Call the callback once for each distinct part of the seqids matching this regex (or its capture group), instead of once per seqid.")
+@click.option("--callback-workers", default=1, type=int, help="How many processes to run the callback on. (default: 1)")
+@click.option("-a", "--author", default=f"{getpass.getuser()}", help="Who is running the check. (default: $USER)")
 @click.option("-n", "--db_name", default=None, help="Name of the Database. (default: filename)")
-@click.option("-t", "--threads", default=1, help="How many threads to give CD-HIT (default: 1)")
+@click.option("-t", "--threads", default=None, type=int, help="How many threads to give CD-HIT (default: all CPUs)")
+@click.option("-M", "--memory", default=None, type=int, help="How much memory to give CD-HIT, in MB. 0 for no limit. (default: 80% of the available memory)")
+@click.option("--workdir", default=None, type=click.Path(exists=True, file_okay=False), help="Where to run CD-HIT, e.g. a local SSD or tmpfs. (default: the system's temporary directory)")
+@click.option("--cdhit-timeout", default=None, type=float, help="Stop CD-HIT if it runs for longer than this many seconds. (default: no limit)")
 @click.option("-p", "--prefix", default="cdhit", help="Prefix of output files from CD-HIT (default: cdhit)")
 @click.option("-k", "--keep_files", help="Whether to keep CD-HIT output files (default: False)", is_flag=True)
+@click.option("-e", "--engine", default="cdhit", type=click.Choice(["cdhit", "native"]), help="How to cluster the DB. native does not need CD-HIT, and reports where contained sequences sit in the centroid (default: cdhit)")
+@click.option("--containment/--no-containment", default=True, help="With the native engine, whether to also cluster sequences contained within others, or only identical sequences (default: containment)")
+@click.option("--collapse/--no-collapse", default=True, help="Whether to collapse identical sequences before handing the DB to CD-HIT (default: collapse)")
 @click.option("--example", help="Run an example set", is_flag=True, is_eager=True, callback=run_example)
+@click.option("--max-clusters-in-report", default=None, type=int, help="Only list this many clusters in each section of the report. The full listings are saved to <prefix>_*.tsv files. (default: no limit)")
+@click.option("-o", "--output-format", "output_formats", default=["markdown"], multiple=True, type=click.Choice(["markdown", "tsv", "parquet", "json"]), help="What to output. Can be given more than once. markdown goes to stdout, the others are saved to --outdir. (default: markdown)")
+@click.option("--outdir", default=".", help="Where to save tsv, parquet and json outputs. (default: .)")
+@click.option("-m", "--manifest", default=None, help="Save a manifest of this run to this file (and a seed index of the DB to <manifest>.seeds.npz), to re-check the next release against it.")
+@click.option("--previous", default=None, help="Manifest of a previous release. Only re-check what has changed since, without CD-HIT.", type=click.Path(exists=True))
+@click.option("--sequence-stats", help="Index the DB (saved next to it as <FASTA>.dbcheck.fai) and show the GC content and number of ambiguous bases of the sequences listed in the report.", is_flag=True)
+@click.option("--identity", default=None, type=click.FloatRange(0.5, 1.0), help="Also list pairs of sequences in distinct clusters that are at least this identical (e.g., 0.99), found with k-mer sketches rather than CD-HIT. (default: do not look for them)")
+@click.option("--validate", default="fail", type=click.Choice(["fail", "warn", "off"]), help="Validate the DB before clustering it, and report what is found. fail stops at the first record CD-HIT can not handle (e.g., with characters that are not nucleotide codes), warn only reports it. (default: fail)")
+@click.option("--cache/--no-cache", default=True, help="Whether to reuse the clusters of a DB checked before, unchanged and with the same parameters, instead of clustering it again. On by default, so every run writes its clusters to --cache-dir, up to --cache-max-size MB. (default: cache)")
+@click.option("--cache-dir", default=None, type=click.Path(file_okay=False), help="Where to cache clusters. (default: $XDG_CACHE_HOME/db-check/clusters, or ~/.cache/db-check/clusters)")
+@click.option("--cache-max-size", default=2048, type=int, help="Evict the least recently used clusters once the cache is bigger than this many MB. (default: 2048)")
+@click.option("--cache-max-age", default=30, type=float, help="Evict clusters not used for this many days. (default: 30)")
+@click.option("--stream", help="Summarise the clusters in bounded memory, keeping only those listed in the report, for DBs too large to hold in memory. Implies --no-collapse and --no-cache, and only works with the cdhit engine, without --manifest, --previous or --identity.", is_flag=True)
+@click.option("--nonredundant", default=None, help="Also write the DB without redundant sequences to this FASTA file (gzip compressed if it ends in .gz), and the sequences left out, with the sequence kept in their place, to <FASTA>.map.tsv.")
+@click.option("--nonredundant-policy", default="centroid", type=click.Choice(["centroid", "longest", "category"]), help="Which sequences --nonredundant keeps: the centroid of each cluster, the longest, or the centroid (or else the longest) of each category in each cluster. (default: centroid)")
+@click.option("--skip-check", "skip_checks", multiple=True, help="Do not run the check with this name. Can be given more than once.")
+@click.option("--check-timeout", default=None, type=float, help="Give up on any check still running after this many seconds. (default: no limit)")
+@click.option("--profile", default=None, help="Record the wall time, CPU time and peak memory of each stage of the run (including CD-HIT), save them to this JSON file, and print a summary to stderr.")
+@click.option("--cprofile-dir", default=None, help="With --profile, also save a cProfile of each stage to this directory as <stage>.prof.")
 @click.version_option(version=version_string, message=f"db-check v{version_string}")
 @click.argument("fasta")
-def run_db_check(delimiter, field, regex, author, db_name, threads, prefix, example, keep_files, fasta):
+def run_db_check(delimiter, field, regex, callback, callback_key, callback_workers, author, db_name, threads, memory, workdir, cdhit_timeout, prefix, example, keep_files, engine, containment, collapse, max_clusters_in_report, output_formats, outdir, manifest, previous, sequence_stats, identity, validate, cache, cache_dir, cache_max_size, cache_max_age, stream, nonredundant, nonredundant_policy, skip_checks, check_timeout, profile, cprofile_dir, fasta):
     '''
     Check a FASTA DB for potential issues.
     '''
     info("Welcome do db-check.")
     info("Running some routine checks...")
     check_params()
-    check_dependencies()
-    if db_name is None:
-        db_name = pathlib.Path(fasta).stem
-    info("Clustering your DB...")
-    [clusters, workdir] = cluster_db(fasta, prefix, threads=threads)
-    info("Parsing the results...")
-    tab = parse_clustering(clusters)
-    if delimiter is not None and field is not None:
-        tab = parse_categories(tab, delimiter=delimiter, field=field)
-    elif regex is not None:
-        tab = parse_categories(tab, regex=regex)
-    info("Going over all the checks...")
-    checklist = DBChecklist(tab, author=author, db_name=db_name)
-    checklist.ticks()
-    info("Printing your report...")
-    generate_report(checklist)
-    if keep_files:
-        info("You decided to keep the files... Here you go...")
-        wd = pathlib.Path(workdir.name)
-        for f in wd.glob(prefix+"*"):
-            info(f"Keeping {f.name}")
-            shutil.copyfile(f.absolute(), f.name)
-    workdir.cleanup()
+    if nonredundant is not None and fasta == '-':
+        error("Writing a non-redundant DB reads it again, which can not be done from stdin.")
+        raise click.Abort()
+    if nonredundant_policy == "category" and nonredundant is not None and \
+            delimiter is None and regex is None and callback is None:
+        error("--nonredundant-policy category needs categories to be parsed.")
+        raise click.Abort()
+    profiler = Profiler(enabled=profile is not None, cprofile_dir=cprofile_dir)
+    if engine == "cdhit" and previous is None:
+        with profiler.stage("check_dependencies"):
+            from db_check.dependencies import check_dependencies
+            check_dependencies()
+    with profiler.stage("imports"):
+        from db_check.outputs import write_outputs
+        from db_check.pipeline import check_db
+        from db_check.validation import InvalidFasta
+        cluster_cache = None
+        if cache:
+            from db_check.cache import ClusterCache
+            cluster_cache = ClusterCache(cache_dir, max_size_mb=cache_max_size,
+                                         max_age_days=cache_max_age)
+    try:
+        checklist = check_db(fasta, author, db_name=db_name, delimiter=delimiter,
+                             field=field, regex=regex, callback=callback,
+                             callback_key=callback_key, callback_workers=callback_workers,
+                             engine=engine, threads=threads, memory=memory,
+                             workdir=workdir, cdhit_timeout=cdhit_timeout,
+                             prefix=prefix, collapse=collapse, containment=containment, keep_files=keep_files,
+                             manifest=manifest, previous=previous,
+                             sequence_stats=sequence_stats, identity=identity, validate=validate,
+                             cache=cluster_cache, stream=stream,
+                             skip_checks=skip_checks,
+                             check_timeout=check_timeout, profiler=profiler)
+    except InvalidFasta:
+        raise click.Abort()
+    if nonredundant is not None:
+        with profiler.stage("write_nonredundant"):
+            from db_check.nonredundant import write_nonredundant
+            write_nonredundant(fasta, checklist.df, nonredundant, f"{nonredundant}.map.tsv",
+                               policy=nonredundant_policy)
+    with profiler.stage("write_outputs"):
+        write_outputs(checklist, output_formats, outdir=outdir, prefix=prefix)
+    if "markdown" in output_formats:
+        info("Printing your report...")
+        with profiler.stage("generate_report"):
+            from db_check.report import generate_report
+            generate_report(checklist, max_clusters=max_clusters_in_report,
+                            prefix=prefix)
+    if profile is not None:
+        profiler.write_trace(profile)
+        profiler.report()
     info("Happy publishing!")
 
 
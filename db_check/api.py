@@ -0,0 +1,236 @@
+'''
+Check FASTA DBs from Python, without going through the command line.
+
+    import db_check
+
+    result = db_check.check("db.fasta", regex=".*~~(.*)", engine="native")
+    blocking = result.first_blocking()
+    if blocking is not None:
+        print(blocking.message)
+
+Nothing is printed while checking, and the findings (duplicated IDs,
+clusters of overlapping sequences, category conflicts, ...) are generated
+lazily from the results, so a caller can stop at the first one that
+matters, and check many DBs in the same interpreter with check_many.
+'''
+
+import collections
+import contextlib
+import getpass
+import itertools
+
+import numpy as np
+
+from db_check.messages import quiet
+
+Finding = collections.namedtuple(
+    'Finding', ['kind', 'key', 'message', 'records', 'blocking'])
+Finding.__doc__ = '''
+A single finding: its kind (e.g., duplicate_id), what it is about (e.g., the
+seqid or clusterid), a sentence about it, the records involved (a
+pandas.DataFrame) and whether it should block a release.
+'''
+
+# kinds of findings that block a release by default, besides the errors
+# found validating the DB
+BLOCKING = ('duplicate_id', 'category_conflict')
+
+
+def _groups(tab, key):
+    '''
+    Yield (key, rows) for each group of rows sharing the same key. Rows
+    must be sorted so that groups are contiguous.
+    '''
+    keys = tab[key].to_numpy()
+    if not keys.size:
+        return
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], keys.size]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        yield keys[start], tab.iloc[start:end]
+
+
+class CheckResult():
+    '''
+    The result of checking a FASTA DB: the DBChecklist, and generators of
+    the findings in it.
+    '''
+
+    def __init__(self, checklist, blocking=BLOCKING):
+        self.checklist = checklist
+        self.blocking = tuple(blocking)
+
+    def __repr__(self):
+        return f"<CheckResult {self.db_name}: {len(self.issues)} issues>"
+
+    @property
+    def db_name(self):
+        return self.checklist.db_name
+
+    @property
+    def issues(self):
+        return list(self.checklist.issues)
+
+    @property
+    def ok(self):
+        return not self.checklist.issues
+
+    @property
+    def clusters(self):
+        return self.checklist.df
+
+    @property
+    def check_results(self):
+        return self.checklist.check_results
+
+    def summary(self):
+        '''
+        Return the summary of the checks as a dict, as saved to JSON
+        '''
+        from db_check.outputs import summary
+        return summary(self.checklist)
+
+    def tables(self):
+        '''
+        Return a dict of name to pandas.DataFrame with the tables behind
+        the report
+        '''
+        from db_check.outputs import tables
+        return tables(self.checklist)
+
+    def write(self, formats=('tsv', 'json'), outdir=".", prefix="db-check"):
+        '''
+        Save the tables and/or summary (see db_check.outputs.write_outputs)
+        '''
+        from db_check.outputs import write_outputs
+        with quiet():
+            return write_outputs(self.checklist, formats, outdir=outdir, prefix=prefix)
+
+    def report(self, stream=None, max_clusters=None, prefix="db-check"):
+        '''
+        Write the Markdown report to stream (default: stdout)
+        '''
+        from db_check.report import generate_report
+        generate_report(self.checklist, stream=stream, max_clusters=max_clusters,
+                        prefix=prefix)
+
+    def validation_findings(self):
+        '''
+        Yield a Finding for each kind of problem found validating the DB
+        '''
+        validation = getattr(self.checklist, "validation", None)
+        if validation is None or not validation.counts:
+            return
+        from db_check.validation import FINDINGS
+        table = validation.table()
+        for kind in FINDINGS:
+            if kind in validation.counts:
+                yield Finding(f"fasta_{kind}", kind, validation.describe(kind),
+                              table[table.finding == kind],
+                              validation.severity(kind) == 'error')
+
+    def duplicate_ids(self):
+        '''
+        Yield a Finding for each sequence ID used by more than one record
+        '''
+        df = self.checklist.df
+        ix = df.duplicated('seqid', keep=False)
+        if not ix.any():
+            return
+        tab = df[ix]
+        tab = tab.iloc[np.argsort(tab.seqid.astype(str).to_numpy(), kind='stable')]
+        for seqid, rows in _groups(tab, 'seqid'):
+            yield Finding('duplicate_id', seqid,
+                          f"{rows.shape[0]} records with ID {seqid}.", rows,
+                          'duplicate_id' in self.blocking)
+
+    def overlapping_sequences(self):
+        '''
+        Yield a Finding for each cluster of more than one sequence, i.e.,
+        of identical sequences or sequences contained in another
+        '''
+        df = self.checklist.df
+        sizes = df.groupby('clusterid')['clusterid'].transform('size')
+        tab = df[sizes > 1].sort_values('clusterid', kind='stable')
+        for clusterid, rows in _groups(tab, 'clusterid'):
+            yield Finding('overlapping_sequences', clusterid,
+                          f"Cluster {clusterid} has {rows.shape[0]} overlapping sequences.",
+                          rows, 'overlapping_sequences' in self.blocking)
+
+    def category_conflicts(self):
+        '''
+        Yield a Finding for each cluster of sequences with more than one
+        category, if categories were parsed
+        '''
+        n_categories = getattr(self.checklist, "categories_by_cluster_dist", None)
+        if n_categories is None:
+            return
+        df = self.checklist.df
+        tab = df[df.clusterid.map(n_categories) > 1].sort_values('clusterid', kind='stable')
+        for clusterid, rows in _groups(tab, 'clusterid'):
+            categories = ', '.join(str(c) for c in rows.category.dropna().unique())
+            yield Finding('category_conflict', clusterid,
+                          f"Cluster {clusterid} has sequences of categories {categories}.",
+                          rows, 'category_conflict' in self.blocking)
+
+    def near_duplicates(self):
+        '''
+        Yield a Finding for each pair of near-identical sequences in
+        distinct clusters, if they were looked for
+        '''
+        pairs = getattr(self.checklist, "near_duplicates", None)
+        if pairs is None:
+            return
+        for i in range(pairs.shape[0]):
+            pair = pairs.iloc[i]
+            yield Finding('near_duplicate', (pair.seqid_a, pair.seqid_b),
+                          f"{pair.seqid_a} and {pair.seqid_b} are {pair.identity:.2%} identical.",
+                          pairs.iloc[i:i + 1], 'near_duplicate' in self.blocking)
+
+    def findings(self):
+        '''
+        Yield all the findings, starting with those of the validation of
+        the DB
+        '''
+        return itertools.chain(self.validation_findings(), self.duplicate_ids(),
+                               self.category_conflicts(), self.overlapping_sequences(),
+                               self.near_duplicates())
+
+    def first_blocking(self):
+        '''
+        Return the first Finding that blocks a release, or None
+        '''
+        return next((finding for finding in self.findings() if finding.blocking), None)
+
+
+def check(fasta, author=None, db_name=None, blocking=BLOCKING, verbose=False, cache=False, **options):
+    '''
+    Check a FASTA DB, and return a CheckResult.
+
+    options are handed to db_check.pipeline.check_db (e.g., regex, engine,
+    identity or validate). cache can be True to use the default
+    db_check.cache.ClusterCache, or a ClusterCache. Nothing is printed
+    unless verbose is True. Like the command line, a DB that fails
+    validation raises db_check.validation.InvalidFasta, and the cdhit
+    engine raises FileNotFoundError if CD-HIT is not in the PATH.
+    '''
+    from db_check.pipeline import check_db
+    if cache is True:
+        from db_check.cache import ClusterCache
+        cache = ClusterCache()
+    with contextlib.nullcontext() if verbose else quiet():
+        if options.get('engine', 'cdhit') == 'cdhit' and options.get('previous') is None:
+            from db_check.dependencies import check_dependencies
+            check_dependencies()
+        checklist = check_db(fasta, author or getpass.getuser(), db_name=db_name,
+                             cache=cache or None, **options)
+    return CheckResult(checklist, blocking=blocking)
+
+
+def check_many(fastas, **options):
+    '''
+    Check FASTA DBs one after the other, yielding a CheckResult for each.
+    options are handed to check.
+    '''
+    for fasta in fastas:
+        yield check(fasta, **options)
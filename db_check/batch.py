@@ -0,0 +1,193 @@
+'''
+Check a whole directory of per-locus FASTA DBs in one go
+
+As for db-check, the heavy imports wait until the command line is parsed.
+'''
+import collections
+import concurrent.futures
+import getpass
+import glob
+import os
+import pathlib
+import subprocess
+
+import click
+
+from db_check import __VERSION__ as version_string
+from db_check.fasta import COMPRESSION_SUFFIXES, fasta_name
+from db_check.messages import error, info, success
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+FASTA_SUFFIXES = (".fasta", ".fa", ".fas", ".fna", ".tfa")
+
+
+def find_fasta(sources):
+    '''
+    Given directories and/or glob patterns, return the sorted list of FASTA
+    files to check. Directories are searched for files ending in one of
+    FASTA_SUFFIXES, optionally followed by one of COMPRESSION_SUFFIXES.
+    '''
+    def is_fasta(path):
+        suffixes = [suffix.lower() for suffix in path.suffixes[-2:]]
+        if suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+            suffixes = suffixes[:-1]
+        return bool(suffixes) and suffixes[-1] in FASTA_SUFFIXES
+    files = set()
+    for source in sources:
+        path = pathlib.Path(source)
+        if path.is_dir():
+            files.update(f for f in path.iterdir()
+                         if is_fasta(f))
+        else:
+            files.update(pathlib.Path(f) for f in glob.glob(source))
+    return sorted(files)
+
+
+def db_names(fasta_files):
+    '''
+    Return a unique name for each FASTA file, used for its outputs: its
+    fasta_name, or for files sharing one, its path from the directory
+    common to all files joined with _ (e.g., a_locus and b_locus for
+    a/locus.fasta and b/locus.fasta.gz), numbered if still not unique.
+    '''
+    names = [fasta_name(fasta) for fasta in fasta_files]
+    shared = collections.Counter(names)
+    if len(fasta_files) > 1:
+        paths = [pathlib.Path(fasta).absolute() for fasta in fasta_files]
+        common = pathlib.Path(os.path.commonpath([path.parent for path in paths]))
+        names = ["_".join(path.parent.relative_to(common).parts + (name,))
+                 if shared[name] > 1 else name for name, path in zip(names, paths)]
+    seen = collections.Counter()
+    unique = []
+    for name in names:
+        seen[name] += 1
+        unique.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return unique
+
+
+def failure(exc):
+    '''
+    Say why a DB could not be checked, given the exception raised
+    '''
+    from db_check.validation import InvalidFasta
+    if isinstance(exc, InvalidFasta):
+        return "invalid FASTA"
+    if isinstance(exc, subprocess.CalledProcessError):
+        return "CD-HIT failed"
+    if isinstance(exc, TimeoutError):
+        return "timed out"
+    return f"{type(exc).__name__}: {exc}"
+
+
+def balance_threads(threads, workers, n_jobs):
+    '''
+    Split the threads between the workers of the pool. Return the number
+    of workers to use, and the number of threads each worker gives CD-HIT.
+    '''
+    workers = max(1, min(workers, n_jobs))
+    return workers, max(1, threads // workers)
+
+
+@click.command("db-check-batch", context_settings=CONTEXT_SETTINGS)
+@click.option("-d", "--delimiter", default=None, help="When parsing a category from seqid, split on this delimiter (use -1 for last element, -2 for second to last, etc.).")
+@click.option("-f", "--field", default=None, help="When parsing a category from seqid using a delimiter, keep this field number (0-index).", type=int)
+@click.option("-r", "--regex", default=None, help="When parsing a category from seqid extract using this regex.")
+@click.option("-c", "--callback", default=None, help="When parsing a category from seqid use this function, given as module:function or path/to/file.py:function.")
+@click.option("--callback-key", default=None, help="Call the callback once for each distinct part of the seqids matching this regex (or its capture group), instead of once per seqid.")
+@click.option("-a", "--author", default=f"{getpass.getuser()}", help="Who is running the check. (default: $USER)")
+@click.option("-n", "--db_name", default=None, help="Name of the collection of DBs. (default: first directory or pattern)")
+@click.option("-t", "--threads", default=os.cpu_count(), help="How many threads to use in total. (default: number of CPUs)")
+@click.option("-M", "--memory", default=None, type=int, help="How much memory to use in total, in MB, split between the workers. 0 for no limit. (default: 80% of the available memory)")
+@click.option("--workdir", default=None, type=click.Path(exists=True, file_okay=False), help="Where to run CD-HIT, e.g. a local SSD or tmpfs. (default: the system's temporary directory)")
+@click.option("--cdhit-timeout", default=None, type=float, help="Stop CD-HIT if it runs for longer than this many seconds on any DB. (default: no limit)")
+@click.option("-w", "--workers", default=None, help="How many DBs to check at the same time. (default: same as threads)", type=int)
+@click.option("-e", "--engine", default="cdhit", type=click.Choice(["cdhit", "native"]), help="How to cluster the DB. native does not need CD-HIT, and reports where contained sequences sit in the centroid (default: cdhit)")
+@click.option("--containment/--no-containment", default=True, help="With the native engine, whether to also cluster sequences contained within others, or only identical sequences (default: containment)")
+@click.option("--collapse/--no-collapse", default=True, help="Whether to collapse identical sequences before handing the DB to CD-HIT (default: collapse)")
+@click.option("--validate", default="fail", type=click.Choice(["fail", "warn", "off"]), help="Validate each DB before clustering it, and report what is found. fail stops at the first record CD-HIT can not handle, warn only reports it. (default: fail)")
+@click.option("--cache/--no-cache", default=True, help="Whether to reuse the clusters of DBs checked before, unchanged and with the same parameters, instead of clustering them again. On by default, so every run writes the clusters of each DB to --cache-dir, up to --cache-max-size MB. (default: cache)")
+@click.option("--cache-dir", default=None, type=click.Path(file_okay=False), help="Where to cache clusters. (default: $XDG_CACHE_HOME/db-check/clusters, or ~/.cache/db-check/clusters)")
+@click.option("--cache-max-size", default=2048, type=int, help="Evict the least recently used clusters once the cache is bigger than this many MB. (default: 2048)")
+@click.option("--cache-max-age", default=30, type=float, help="Evict clusters not used for this many days. (default: 30)")
+@click.option("--max-clusters-in-report", default=None, type=int, help="Only list this many clusters in each section of the report. The full listings are saved to <prefix>_<DB>_*.tsv files. (default: no limit)")
+@click.option("-o", "--output-format", "output_formats", default=["markdown"], multiple=True, type=click.Choice(["markdown", "tsv", "parquet", "json"]), help="What to output. Can be given more than once. markdown goes to stdout, the others are saved to --outdir for each DB. (default: markdown)")
+@click.option("--outdir", default=".", help="Where to save tsv, parquet and json outputs. (default: .)")
+@click.option("-p", "--prefix", default="db-check", help="Prefix of output files (default: db-check)")
+@click.version_option(version=version_string, message=f"db-check v{version_string}")
+@click.argument("sources", nargs=-1, required=True)
+def run_batch_check(delimiter, field, regex, callback, callback_key, author, db_name, threads, memory, workdir, cdhit_timeout, workers, engine, containment, collapse, validate, cache, cache_dir, cache_max_size, cache_max_age, max_clusters_in_report, output_formats, outdir, prefix, sources):
+    '''
+    Check all FASTA DBs in directories or matching glob patterns, and print
+    a single report.
+    '''
+    modes = [delimiter is not None, regex is not None, callback is not None]
+    if (delimiter is None) != (field is None) or sum(modes) > 1:
+        error("ERROR: Delimiter and field must be specified OR regex OR callback OR None.")
+        raise click.Abort()
+    fasta_files = find_fasta(sources)
+    if not fasta_files:
+        error("Could not find any FASTA files to check.")
+        raise click.Abort()
+    if engine == "cdhit":
+        from db_check.dependencies import check_dependencies
+        check_dependencies()
+    import pandas as pd
+    from db_check.clustering import auto_resources
+    from db_check.outputs import failed_counts, issue_counts, write_outputs
+    from db_check.cache import ClusterCache
+    from db_check.pipeline import check_db
+    if db_name is None:
+        db_name = pathlib.Path(sources[0]).name
+    workers, threads = balance_threads(
+        threads, workers or threads, len(fasta_files))
+    if memory is None:
+        _, memory = auto_resources(threads, memory, share=workers)
+    elif memory > 0:
+        memory = max(1, memory // workers)
+    cluster_cache = None
+    if cache:
+        cluster_cache = ClusterCache(cache_dir, max_size_mb=cache_max_size,
+                                     max_age_days=cache_max_age)
+    info(f"Checking {len(fasta_files)} DBs, {workers} at a time...")
+    names = db_names(fasta_files)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(check_db, fasta, author, db_name=name, delimiter=delimiter,
+                            field=field, regex=regex, callback=callback,
+                            callback_key=callback_key, engine=engine, threads=threads,
+                            memory=memory, workdir=workdir, cdhit_timeout=cdhit_timeout,
+                            prefix=f"cdhit_{name}", collapse=collapse,
+                            containment=containment,
+                            validate=validate,
+                            cache=cluster_cache)
+                for fasta, name in zip(fasta_files, names)]
+        checklists = []
+        failed = {}
+        for fasta, name, job in zip(fasta_files, names, jobs):
+            try:
+                checklists.append(job.result())
+            except Exception as exc:
+                failed[name] = failure(exc)
+                error(f"Could not check {fasta} ({failed[name]}), leaving it out of the batch.")
+    success(f"Checked {len(checklists)} DBs.")
+    for checklist in checklists:
+        write_outputs(checklist, output_formats, outdir=outdir,
+                      prefix=f"{prefix}_{checklist.db_name}")
+    if "tsv" in output_formats:
+        counts = pd.DataFrame([issue_counts(obj) for obj in checklists] +
+                              [failed_counts(name, reason) for name, reason in failed.items()])
+        counts.to_csv(pathlib.Path(outdir) / f"{prefix}.batch_summary.tsv",
+                      sep='\t', index=False)
+    if "markdown" in output_formats:
+        info("Printing your report...")
+        from db_check.report import generate_batch_report
+        generate_batch_report(checklists, author=author, db_name=db_name,
+                              max_clusters=max_clusters_in_report, prefix=prefix,
+                              failed=failed)
+    if failed:
+        error(f"{len(failed)} DBs could not be checked: {', '.join(failed)}")
+        raise SystemExit(1)
+    info("Happy publishing!")
+
+
+if __name__ == "__main__":
+    run_batch_check()
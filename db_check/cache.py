@@ -0,0 +1,186 @@
+'''
+Cache the cluster table of a FASTA DB between runs.
+
+Re-checking an unchanged DB (e.g., to try another --regex) does not need
+it to be clustered again. Cluster tables are saved under a key made of the
+hash of the content of the FASTA file, the versions of db-check and CD-HIT,
+and the clustering parameters, so a change to any of them is a miss.
+Tables are saved as compressed NumPy archives (seqid and other text
+columns as codes and names), and the least recently used ones are evicted
+once the cache grows past its maximum size, or its maximum age.
+'''
+
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from db_check import __VERSION__ as version_string
+from db_check.dependencies import cache_dir
+from db_check.messages import info, warning
+
+CACHE_FORMAT = 1
+CACHE_SUFFIX = ".npz"
+MAX_SIZE_MB = 2048
+MAX_AGE_DAYS = 30
+
+
+def default_cache_dir():
+    '''
+    Where cluster tables are cached by default
+    '''
+    return cache_dir() / "clusters"
+
+
+def file_digest(filename, chunk_size=2**20):
+    '''
+    Return the hex blake2b digest of the content of a file
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(filename, **params):
+    '''
+    Return the key of the cluster table of a FASTA file clustered with
+    params (e.g., engine and CD-HIT version).
+    '''
+    params = dict(params, format=CACHE_FORMAT, version=version_string,
+                  fasta=file_digest(filename))
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(),
+                           digest_size=20).hexdigest()
+
+
+def save_table(tab, filename):
+    '''
+    Save a table as a compressed NumPy archive. Text and categorical
+    columns are saved as integer codes and their names joined by new lines,
+    along with their dtype.
+    '''
+    arrays = {}
+    columns = []
+    for col in tab.columns:
+        values = tab[col]
+        if not pd.api.types.is_numeric_dtype(values):
+            kind = 'category' if isinstance(values.dtype, pd.CategoricalDtype) else str(values.dtype)
+            values = values.astype('category')
+            arrays[f"{col}.codes"] = values.cat.codes.to_numpy()
+            arrays[f"{col}.names"] = np.frombuffer(
+                "\n".join(values.cat.categories.astype(str)).encode(), dtype=np.uint8)
+        else:
+            kind = 'array'
+            arrays[col] = values.to_numpy()
+        columns.append([col, kind])
+    arrays['columns'] = np.frombuffer(json.dumps(columns).encode(), dtype=np.uint8)
+    with open(filename, 'wb') as fh:
+        np.savez_compressed(fh, **arrays)
+
+
+def load_table(filename):
+    '''
+    Load a table saved with save_table
+    '''
+    with np.load(filename) as data:
+        columns = json.loads(data['columns'].tobytes())
+        tab = {}
+        for col, kind in columns:
+            if kind == 'array':
+                tab[col] = data[col]
+                continue
+            names = data[f"{col}.names"].tobytes().decode()
+            names = names.split("\n") if names else []
+            values = pd.Categorical.from_codes(data[f"{col}.codes"], categories=names)
+            tab[col] = values if kind == 'category' else pd.Series(values).astype(kind)
+    return pd.DataFrame(tab, columns=[col for col, _ in columns])
+
+
+class ClusterCache():
+    '''
+    A directory of cluster tables, named by their key
+    '''
+
+    def __init__(self, directory=None, max_size_mb=MAX_SIZE_MB, max_age_days=MAX_AGE_DAYS):
+        self.directory = pathlib.Path(default_cache_dir() if directory is None else directory)
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+
+    def path(self, key):
+        return self.directory / f"{key}{CACHE_SUFFIX}"
+
+    def get(self, key):
+        '''
+        Return the cached table under key, or None
+        '''
+        path = self.path(key)
+        try:
+            tab = load_table(path)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            warning(f"Could not read {path} from the cache ({exc}), clustering again.")
+            return None
+        # mark it as recently used
+        os.utime(path)
+        return tab
+
+    def put(self, key, tab):
+        '''
+        Save a table in the cache under key, and evict old entries. Failing
+        to save it is not an error.
+        '''
+        path = self.path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            save_table(tab, tmp)
+            os.replace(tmp, path)
+        except OSError as exc:
+            warning(f"Could not save the cluster table to the cache ({exc}).")
+            if tmp.exists():
+                tmp.unlink()
+            return
+        self.evict()
+
+    def entries(self):
+        '''
+        Return (last used, size in bytes, path) of every entry, least
+        recently used first
+        '''
+        entries = []
+        for path in self.directory.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        '''
+        Remove the entries not used for max_age_days, and then the least
+        recently used ones until the cache is no bigger than max_size_mb.
+        Return the number of entries removed.
+        '''
+        entries = self.entries()
+        oldest = time.time() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for used, size, path in entries:
+            if used >= oldest and total <= self.max_size_mb * 2**20:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            info(f"Evicted {removed} cluster tables from the cache.")
+        return removed
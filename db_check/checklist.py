@@ -1,9 +1,145 @@
 '''
 A module for different checks that should be performed
+
+Checks are functions that take a DBChecklist and return an issue (a short
+sentence for the report) or None if all is well. They are registered with
+the register_check decorator, in this module or in a plugin exposed under
+the db_check.checks entry point group, e.g. in a plugin's setup.py:
+
+    entry_points={"db_check.checks": ["my_checks=my_package.checks"]}
+
+Loading the entry point is enough to register the checks in the module.
 '''
 
+import collections
 import inspect
+import threading
+import time
+from db_check.conflicts import conflict_graph
 from db_check.messages import *
+from db_check.validation import FINDINGS
+
+Check = collections.namedtuple(
+    'Check', ['name', 'function', 'requires', 'timeout'])
+
+CHECKS = {}
+ENTRY_POINT_GROUP = "db_check.checks"
+_plugins_loaded = False
+
+
+def register_check(name=None, requires=(), timeout=None):
+    '''
+    Decorator to register a check under name (default: the function name).
+
+    requires lists the columns of the cluster table, or attributes of the
+    DBChecklist (e.g., fasta), that the check needs. The check is skipped if
+    any is missing. timeout is the default number of seconds after which
+    the check is given up on.
+    '''
+    def decorator(function):
+        check_name = function.__name__ if name is None else name
+        CHECKS[check_name] = Check(
+            check_name, function, tuple(requires), timeout)
+        return function
+    return decorator
+
+
+def load_plugins():
+    '''
+    Import the checks exposed under the db_check.checks entry point group.
+    An entry point pointing at a function that is not registered yet is
+    registered under the entry point name.
+    '''
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    eps = entry_points()
+    eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') \
+        else eps.get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        try:
+            obj = ep.load()
+        except Exception as exc:
+            warning(f"Could not load the checks in {ep.value}: {exc}")
+            continue
+        if callable(obj) and all(check.function is not obj for check in CHECKS.values()):
+            register_check(ep.name)(obj)
+
+
+def timed(function, *args):
+    '''
+    Call function and return its result with the wall time it took.
+    '''
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run_checks(obj, checks, timeout=None, workers=None):
+    '''
+    Run checks on obj, each on a daemon thread, with at most workers (default:
+    all) running at once. A check still running timeout seconds (default: its
+    own timeout, if any) after it started is abandoned, and its slot given to
+    the next check.
+
+    Return a dict for each check, in order, with its issue, the error it
+    raised, whether it was abandoned, its time limit, and the seconds it
+    ran for, counted from when it started.
+    '''
+    slots = threading.Semaphore(workers or max(len(checks), 1))
+    changed = threading.Condition()
+    runs = [{'issue': None, 'error': None, 'abandoned': False, 'started': None,
+             'done': False, 'seconds': None,
+             'limit': timeout if timeout is not None else check.timeout}
+            for check in checks]
+
+    silenced = is_quiet()
+
+    def run(check, state):
+        slots.acquire()
+        with changed:
+            state['started'] = time.perf_counter()
+            changed.notify_all()
+        try:
+            with quiet(silenced):
+                state['issue'] = check.function(obj)
+        except Exception as exc:
+            state['error'] = exc
+        with changed:
+            state['done'] = True
+            if not state['abandoned']:
+                state['seconds'] = time.perf_counter() - state['started']
+                slots.release()
+            changed.notify_all()
+
+    for check, state in zip(checks, runs):
+        threading.Thread(target=run, args=(check, state), daemon=True,
+                         name=f"check-{check.name}").start()
+    with changed:
+        while True:
+            now = time.perf_counter()
+            running = False
+            deadlines = []
+            for state in runs:
+                if state['done'] or state['abandoned']:
+                    continue
+                running = True
+                if state['started'] is None or state['limit'] is None:
+                    continue
+                if now - state['started'] >= state['limit']:
+                    state.update(abandoned=True, seconds=float(state['limit']))
+                    slots.release()
+                else:
+                    deadlines.append(state['started'] + state['limit'])
+            if not running:
+                return runs
+            # woken up when a check starts or ends, or at the next deadline
+            changed.wait(min(deadlines) - now if deadlines else None)
 
 
 class DBChecklist():
@@ -11,14 +147,22 @@ class DBChecklist():
     A class to hold all the necessary summary data and checks
     '''
 
-    def __init__(self, dataframe, author, db_name):
+    def __init__(self, dataframe, author, db_name, fasta=None, near_duplicates=None, validation=None):
         '''
-        Initialise the instance and attached the dataframe
+        Initialise the instance and attached the dataframe, and optionally
+        a db_check.fasta.IndexedFasta to look up sequences, the pairs of
+        near-identical sequences (see db_check.similarity.near_duplicates),
+        and what was found validating the FASTA DB (see
+        db_check.validation.validate_fasta).
         '''
         self.author = author
         self.db_name = db_name
         self.df = dataframe
+        self.fasta = fasta
+        self.near_duplicates = near_duplicates
+        self.validation = validation
         self.issues = []
+        self.check_results = {}
         self._summarise()
         if 'category' in self.df.columns:
             self._summarise_categories()
@@ -36,7 +180,9 @@ class DBChecklist():
 
     def _summarise_categories(self):
         '''
-        Given we have parsed categories, summarise them.
+        Given we have parsed categories, summarise them, and find which
+        categories are tangled together by overlapping sequences (see
+        db_check.conflicts).
         '''
         dataframe = self.df
         self.n_unique_categories = dataframe.category.nunique()
@@ -44,56 +190,148 @@ class DBChecklist():
             'clusterid')['category'].nunique()
         self.categories_by_cluster_dist_sum = self.categories_by_cluster_dist.describe(
         ).to_frame().transpose()
+        self.conflicts = conflict_graph(dataframe, self.categories_by_cluster_dist)
 
-    def ticks(self):
+    def has(self, requirement):
+        '''
+        Is the requirement (a column of the cluster table or an attribute
+        of the instance) available?
+        '''
+        return requirement in self.df.columns or getattr(self, requirement, None) is not None
+
+    def ticks(self, skip=(), timeout=None, workers=None):
         '''
         Run checks and tick them off.
+
+        Registered checks run concurrently on daemon threads (all at once
+        unless workers is given), and their issues are added in the order
+        the checks were registered. Checks named in skip, or missing what
+        they require, are skipped. A check still running timeout seconds
+        (default: its own timeout, if any) after it started is given up on:
+        its result is ignored, and as its thread is a daemon, it can not
+        keep db-check from exiting. Methods starting with _check, as
+        defined by subclasses, are run afterwards one after the other.
+
+        The status and wall time of every check is saved in check_results.
         '''
+        load_plugins()
+        runnable = []
+        for check in CHECKS.values():
+            missing = [req for req in check.requires if not self.has(req)]
+            if check.name in skip or missing:
+                reason = "asked to" if check.name in skip else f"needs {', '.join(missing)}"
+                info(f"Skipping check {check.name} ({reason})")
+                self.check_results[check.name] = {
+                    'status': 'skipped', 'seconds': 0.0, 'issue': None}
+            else:
+                runnable.append(check)
+        runs = run_checks(self, runnable, timeout=timeout, workers=workers)
+        for check, run in zip(runnable, runs):
+            result = {'status': 'passed', 'seconds': run['seconds'], 'issue': None}
+            if run['abandoned']:
+                warning(f"Check {check.name} took more than {run['limit']}s, giving up on it")
+                result.update(status='timed out')
+            elif run['error'] is not None:
+                error(f"Check {check.name} failed: {run['error']}")
+                result.update(status='failed')
+            elif run['issue'] is not None:
+                result.update(status='issue', issue=run['issue'])
+                self.issues.append(run['issue'])
+            self.check_results[check.name] = result
         checks = {method_name: method for method_name, method in inspect.getmembers(
             self, predicate=inspect.ismethod) if method_name.startswith("_check")}
         for check in checks:
-            checks[check]()
+            n_issues = len(self.issues)
+            _, seconds = timed(checks[check])
+            self.check_results[check] = {
+                'status': 'issue' if len(self.issues) > n_issues else 'passed',
+                'seconds': seconds,
+                'issue': "; ".join(self.issues[n_issues:]) or None}
 
-    def _check_for_duplicates(self):
-        '''
-        Are there two or more sequences with same ID?
-        '''
-        info("Checking for duplicated sequence IDs...")
-        if self.n_unique_sequences == self.total_entries:
-            success("Found no duplicate sequences")
-        else:
-            warning("Found possibly duplicated sequence IDs")
-            self.issues.append('More than one sequence with same ID.')
-
-    def _check_for_overlapping_seqs(self):
-        '''
-        Are there two or more sequences with 100% identity indicating sub-sequences or completely duplicated sequences?
-        '''
-        info(
-            "Checking for partially or completely overlapping sequences...")
-        if self.total_clusters == self.total_entries:
-            success("All sequences are unique")
-        else:
-            warning(
-                "Found partially and/or completely overlapping sequences")
-            self.issues.append(
-                'Partially and/of completely overlapping sequences.')
-
-    def _check_for_overlapping_seqs_distinct_categories(self):
-        '''
-        Are there partially and/or completely overlapping sequences that have distinct categories?
 
-        Only run if categories are parsed out.
-        '''
-        if 'category' not in self.df.columns:
-            return
-        info(
-            "Checking for partially and/or completely overlapping sequences with distinct categories...")
-        if self.categories_by_cluster_dist.max() == 1:
-            success(
-                "There were no partially and/or overlapping sequences with distinct categories.")
-        else:
-            warning(
-                "Found partially and/or completely overlapping sequences with distinct categories.")
-            self.issues.append(
-                'Partially and/of completely overlapping sequences with distinct categories.')
+@register_check("duplicates", requires=('seqid',))
+def check_for_duplicates(obj):
+    '''
+    Are there two or more sequences with same ID?
+    '''
+    info("Checking for duplicated sequence IDs...")
+    if obj.n_unique_sequences == obj.total_entries:
+        success("Found no duplicate sequences")
+        return None
+    warning("Found possibly duplicated sequence IDs")
+    return 'More than one sequence with same ID.'
+
+
+@register_check("overlapping_seqs", requires=('clusterid',))
+def check_for_overlapping_seqs(obj):
+    '''
+    Are there two or more sequences with 100% identity indicating sub-sequences or completely duplicated sequences?
+    '''
+    info(
+        "Checking for partially or completely overlapping sequences...")
+    if obj.total_clusters == obj.total_entries:
+        success("All sequences are unique")
+        return None
+    warning(
+        "Found partially and/or completely overlapping sequences")
+    return 'Partially and/of completely overlapping sequences.'
+
+
+@register_check("overlapping_seqs_distinct_categories", requires=('category',))
+def check_for_overlapping_seqs_distinct_categories(obj):
+    '''
+    Are there partially and/or completely overlapping sequences that have distinct categories?
+
+    Only run if categories are parsed out.
+    '''
+    info(
+        "Checking for partially and/or completely overlapping sequences with distinct categories...")
+    if not (obj.categories_by_cluster_dist > 1).any():
+        success(
+            "There were no partially and/or overlapping sequences with distinct categories.")
+        return None
+    warning(
+        "Found partially and/or completely overlapping sequences with distinct categories.")
+    return 'Partially and/of completely overlapping sequences with distinct categories.'
+
+
+@register_check("near_duplicates", requires=('near_duplicates',))
+def check_for_near_duplicates(obj):
+    '''
+    Are there near-identical sequences in distinct clusters (e.g., alleles
+    differing by an assembly error)?
+
+    Only run if near duplicates were searched for.
+    '''
+    info("Checking for near-identical sequences...")
+    if obj.near_duplicates.empty:
+        success("There were no near-identical sequences in distinct clusters.")
+        return None
+    warning(
+        f"Found {obj.near_duplicates.shape[0]} pairs of near-identical sequences in distinct clusters.")
+    return 'Near-identical sequences in distinct clusters.'
+
+
+def validation_check(kind):
+    '''
+    Register a check reporting the findings of a kind (see
+    db_check.validation.FINDINGS) of the validation of the FASTA DB, as
+    fasta_<kind>. Duplicated IDs are only reported if the cluster table
+    does not show them already (e.g., if CD-HIT left out the records).
+    '''
+    def check(obj):
+        if kind not in obj.validation.counts:
+            return None
+        if kind == 'duplicate_ids' and obj.n_unique_sequences != obj.total_entries:
+            # already reported by the duplicates check
+            return None
+        issue = obj.validation.describe(kind)
+        warning(f"FASTA validation: {issue}")
+        return f"FASTA validation: {issue}"
+    check.__name__ = f"check_fasta_{kind}"
+    check.__doc__ = f"{FINDINGS[kind]}?\n\nOnly run if the FASTA DB was validated."
+    return register_check(f"fasta_{kind}", requires=('validation',))(check)
+
+
+for _kind in FINDINGS:
+    validation_check(_kind)
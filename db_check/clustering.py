@@ -4,41 +4,268 @@ Defining how clustering of the DB is done.
 Here, we use CD-HIT to perform the clustering.
 '''
 
+import collections
+import os
 import pathlib
 import shutil
-import sh
-import re
+import signal
+import subprocess
 import tempfile
+import threading
 
-from db_check.messages import error, info, success
+import numpy as np
+import pandas as pd
 
+from db_check.fasta import is_plain_file, iter_fasta, open_fasta
+from db_check.messages import error, info, is_quiet, progress, quiet
+from db_check.native import canonical_hash
+from db_check.parsers import as_categorical
 
-def check_dependencies():
+# 100% identity, with the sequence IDs in full in the .clstr file
+CDHIT_OPTIONS = ['-c', '1.00', '-g', '1', '-d', '0']
+
+
+def collapse_identical(filename, collapsed, width=60):
+    '''
+    Stream a FASTA DB and write one representative of each group of
+    identical sequences (on either strand) to a new FASTA file. The
+    representatives are named by their number (0, 1, 2, ...).
+
+    Return a pandas.DataFrame with the rep number, seqid, length and strand
+    (forward, relative to the canonical form) of every record in the DB,
+    in the order they were seen.
+    '''
+    reps = {}
+    columns = {'rep': [], 'seqid': [], 'length': [], 'forward': []}
+    with open(collapsed, 'wb') as out:
+        for seqid, seq in iter_fasta(filename):
+            digest, forward = canonical_hash(seq)
+            if digest not in reps:
+                reps[digest] = len(reps)
+                lines = [seq[i:i + width] for i in range(0, len(seq), width)]
+                out.write(b">%d\n%s\n" % (reps[digest], b"\n".join(lines)))
+            columns['rep'].append(reps[digest])
+            columns['seqid'].append(seqid)
+            columns['length'].append(len(seq))
+            columns['forward'].append(forward)
+    members = pd.DataFrame(columns)
+    info(f"Collapsed {members.shape[0]} sequences in to {len(reps)} unique sequences.")
+    return members
+
+
+def expand_clustering(dataframe, members):
+    '''
+    Given the parsed clustering of the collapsed DB, and the members
+    returned by collapse_identical, return the clustering of the full DB.
+
+    Each representative is replaced by all the records it stands for. The
+    first of them keeps the representative's centroid status, the others
+    join it in the same cluster with the same match. Within a cluster,
+    records are in the order of the DB, as CD-HIT lists them.
+    '''
+    tab = dataframe.reset_index(drop=True)
+    members = members.assign(order=members.groupby('rep').cumcount(),
+                             position=np.arange(members.shape[0]))
+    tab = tab.assign(rep=tab.seqid.astype(str).astype(int), row=tab.index)
+    tab['first'] = tab.groupby('clusterid').row.transform('min')
+    result = tab.drop(columns=['seqid', 'length']).merge(
+        members, on='rep', how='left')
+    result = result.sort_values(['first', 'position'], kind='stable')
+    result['is_centroid'] = result.is_centroid & (result.order == 0)
+    result['seqid'] = as_categorical(result.seqid)
+    result['length'] = result.length.astype(dataframe.length.dtype)
+    return result[dataframe.columns].reset_index(drop=True)
+
+
+def expand_clstr(clstr, members, output):
+    '''
+    Given the CD-HIT clustering file of the collapsed DB, and the members
+    returned by collapse_identical, write the clustering file CD-HIT would
+    have written for the full DB to output: each representative replaced
+    by the records it stands for, with their own sequence IDs, in the order
+    of the DB within each cluster.
+    '''
+    records = members.groupby('rep').indices
+    seqids = members.seqid.tolist()
+    lengths = members.length.tolist()
+    forward = members.forward.tolist()
+    flip = {'+': '-', '-': '+'}
+
+    def write_cluster(out, header, rows):
+        out.write(header)
+        for n, (_, row) in enumerate(sorted(rows)):
+            out.write(f"{n}\t{row}\n")
+
+    with open(clstr, 'rt') as fh, open(output, 'wt') as out:
+        header, rows = None, []
+        for line in fh:
+            if line.startswith(">"):
+                if header is not None:
+                    write_cluster(out, header, rows)
+                header, rows = line, []
+                continue
+            # <n>\t<length>nt, ><rep>... <* or at <strand>/<match>%>
+            described, match = line.rstrip("\n").split("\t", 1)[1].rsplit("... ", 1)
+            positions = records[int(described.rsplit(">", 1)[1])]
+            for n, position in enumerate(positions.tolist()):
+                same = forward[position] == forward[positions[0]]
+                if match == "*":
+                    mark = "*" if n == 0 else f"at {'+' if same else '-'}/100.00%"
+                else:
+                    mark = match if same or match[3:4] not in flip else \
+                        f"at {flip[match[3]]}{match[4:]}"
+                rows.append((position, f"{lengths[position]}nt, >{seqids[position]}... {mark}"))
+        if header is not None:
+            write_cluster(out, header, rows)
+
+
+# share of the available memory given to CD-HIT by default
+MEMORY_FRACTION = 0.8
+
+
+def available_memory_mb():
     '''
-    Check if CD-HIT is available
+    Return the memory available to new processes in MB, or None if it can
+    not be found out.
     '''
-    version_pat = re.compile(r'.*([0-9]{1}\.[0-9]{1,2}).*')
-    info("Checking if CD-HIT is present in the PATH...")
-    cdhit_path = shutil.which('cd-hit-est')
-    if cdhit_path is None:
-        error("Could not find CD-HIT in your PATH.")
-        error("Please make sure to add it to your PATH or install it. You can use brew or conda.")
-        raise FileNotFoundError
-    cdhit = sh.Command('cd-hit-est')
-    p = cdhit("-h", _ok_code=[0, 1])
-    [version_string, *_] = version_pat.search(p.stdout.decode('utf8')).groups()
-    success(f"Found CD-HIT version {version_string}")
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2**20
+    except (ValueError, OSError, AttributeError):
+        return None
 
 
-def cluster_db(filename, prefix, threads=4):
+def available_cpus():
+    '''
+    Return the number of CPUs this process may run on
+    '''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def auto_resources(threads=None, memory=None, share=1):
+    '''
+    Fill in the threads (-T) and memory in MB (-M) to give CD-HIT when not
+    set: all the CPUs and MEMORY_FRACTION of the available memory, divided
+    by share (e.g., the number of CD-HIT runs at the same time). A memory
+    of 0 means no limit, which is also used if the available memory is
+    unknown.
+    '''
+    if threads is None:
+        threads = max(1, available_cpus() // share)
+    if memory is None:
+        available = available_memory_mb()
+        memory = 0 if available is None else int(available * MEMORY_FRACTION / share)
+    return threads, memory
+
+
+def run_cdhit(args, timeout=None, tail=20):
+    '''
+    Run cd-hit-est with args, streaming its output to stderr as it goes.
+
+    If it runs for longer than timeout seconds, or db-check is interrupted,
+    CD-HIT is terminated (and killed if it does not stop) and TimeoutError
+    (or KeyboardInterrupt) is raised. If it fails, the last lines of its
+    output are shown and subprocess.CalledProcessError is raised.
+    '''
+    cmd = ['cd-hit-est'] + [str(arg) for arg in args]
+    info(f"Running {' '.join(cmd)}")
+    last_lines = collections.deque(maxlen=tail)
+    # in its own process group, so it can be stopped with all its children
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            stdin=subprocess.DEVNULL, text=True, errors='replace',
+                            start_new_session=os.name == 'posix')
+
+    def stop(sig):
+        if os.name == 'posix':
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                pass
+        else:
+            proc.kill()
+
+    silenced = is_quiet()
+
+    def pump():
+        with quiet(silenced):
+            for line in proc.stdout:
+                line = line.rstrip()
+                if line:
+                    last_lines.append(line)
+                    progress(line)
+    reader = threading.Thread(target=pump, daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except (subprocess.TimeoutExpired, KeyboardInterrupt) as exc:
+        stop(signal.SIGTERM)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            stop(getattr(signal, "SIGKILL", signal.SIGTERM))
+            proc.wait()
+        if isinstance(exc, KeyboardInterrupt):
+            raise
+        error(f"CD-HIT took more than {timeout}s and was stopped.")
+        raise TimeoutError(f"CD-HIT took more than {timeout}s") from None
+    finally:
+        reader.join(timeout=10)
+    if returncode != 0:
+        error(f"CD-HIT failed with exit code {returncode}:")
+        for line in last_lines:
+            error(line)
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def cluster_db(filename, prefix, threads=None, collapse=True, memory=None, workdir=None, timeout=None):
     '''
     Given a FASTA DB, cluster it using CD-HIT. In this case, using cd-hit-est.
+
+    If collapse is True, identical sequences are collapsed before handing
+    the DB to CD-HIT, and the members of each representative are saved
+    next to the CD-HIT output as <prefix>.members.tsv. They are returned
+    to be used with expand_clustering, otherwise None is returned.
+
+    threads and memory (in MB) are handed to CD-HIT as -T and -M, and
+    worked out with auto_resources if not given. The files are written to
+    a temporary directory within workdir (default: the system's), which is
+    removed if CD-HIT fails or runs for longer than timeout seconds.
+
+    CD-HIT reads its input more than once, so it can not be streamed to
+    it. Compressed DBs, or stdin (-), are decompressed as they are
+    collapsed, or, without collapse, spooled to the temporary directory.
     '''
-    cdhit = sh.Command('cd-hit-est')
-    fn = pathlib.Path(filename)
-    tmpdir = tempfile.TemporaryDirectory()
-    workdir = pathlib.Path(tmpdir.name)
-    wd_prefix = workdir / prefix
-    p = cdhit('-i', f'{fn.as_posix()}', '-o', f'{wd_prefix.as_posix()}',
-              '-c', '1.00', '-g', '1', '-T', threads, '-d', '0')
-    return f"{wd_prefix}.clstr", tmpdir
+    threads, memory = auto_resources(threads, memory)
+    fn = filename
+    tmpdir = tempfile.TemporaryDirectory(dir=workdir)
+    try:
+        wd_prefix = pathlib.Path(tmpdir.name) / prefix
+        members = None
+        if collapse:
+            collapsed = pathlib.Path(tmpdir.name) / f"{prefix}.collapsed.fasta"
+            members = collapse_identical(fn, collapsed)
+            members.to_csv(f"{wd_prefix}.members.tsv", sep='\t', index=False)
+            fn = collapsed
+        elif not is_plain_file(fn):
+            spool = pathlib.Path(tmpdir.name) / f"{prefix}.input.fasta"
+            info(f"Decompressing the DB to {spool} for CD-HIT...")
+            with open_fasta(fn) as fh, open(spool, 'wb') as out:
+                shutil.copyfileobj(fh, out, 2**20)
+            fn = spool
+        fn = pathlib.Path(fn)
+        run_cdhit(['-i', fn.as_posix(), '-o', wd_prefix.as_posix(),
+                   '-T', threads, '-M', memory] + CDHIT_OPTIONS,
+                  timeout=timeout)
+    except BaseException:
+        tmpdir.cleanup()
+        raise
+    return f"{wd_prefix}.clstr", tmpdir, members
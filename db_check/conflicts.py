@@ -0,0 +1,142 @@
+'''
+Find which categories are tangled together by overlapping sequences.
+
+Each cluster of sequences with more than one category ties those
+categories together. Categories tied together through a chain of such
+clusters (A and B share a cluster, B and C share another, ...) form a
+conflict component, found with a union-find over the categories of each
+cluster in a single pass. The clusters of each category, and the
+categories of each cluster, are indexed along the way, so questions about
+a component do not need to go over the cluster table again.
+'''
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['component', 'root', 'n_categories', 'n_clusters', 'n_sequences',
+           'categories', 'clusters']
+
+
+def _find(parent, node):
+    '''
+    Return the root of node in a union-find, halving its path on the way
+    '''
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+def _joined(keys, values):
+    '''
+    Given sorted keys and their values, return the values of each distinct
+    key joined in a string
+    '''
+    keys = np.asarray(keys)
+    if not keys.size:
+        return []
+    values = [str(value) for value in values]
+    bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1], True]).tolist()
+    return [", ".join(values[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class ConflictGraph():
+    '''
+    The categories of the clusters with more than one category, indexed
+    both ways (category_clusters and cluster_categories), and grouped in
+    connected components.
+    '''
+
+    def __init__(self, tab):
+        '''
+        Given the clusterid and category of the sequences in clusters with
+        more than one category, index them and find the components.
+        '''
+        tab = tab.dropna(subset=['category'])
+        self.n_sequences = tab.groupby('clusterid').size().to_dict()
+        pairs = tab[['clusterid', 'category']].astype({'category': str}).drop_duplicates()
+        codes, categories = pd.factorize(pairs.category.to_numpy())
+        self.categories = pd.Index(categories, dtype=object)
+        clusters = pairs.clusterid.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(self.categories) + 1))
+        self.category_clusters = {
+            category: clusters[order[start:end]].tolist()
+            for category, start, end in zip(self.categories, bounds[:-1], bounds[1:])}
+        self.cluster_categories = pairs.groupby('clusterid', sort=False).category.agg(list).to_dict()
+        parent = list(range(len(self.categories)))
+        # tie each category of a cluster to its first category
+        first = pd.Series(codes).groupby(clusters, sort=False).transform('first').to_numpy()
+        for a, b in zip(first.tolist(), codes.tolist()):
+            root_a, root_b = _find(parent, a), _find(parent, b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        roots = np.array([_find(parent, node) for node in range(len(parent))], dtype=np.int64)
+        self._components = self._number(roots)
+        self._pairs = pd.DataFrame({'clusterid': clusters, 'code': codes})
+        self._table = None
+
+    def _number(self, roots):
+        '''
+        Number the components from 1, the largest (by number of clusters)
+        first, and return the component of each category
+        '''
+        n_clusters = np.array([len(self.category_clusters[c]) for c in self.categories],
+                              dtype=np.int64)
+        sizes = pd.Series(n_clusters).groupby(roots).sum()
+        ranked = sizes.sort_values(ascending=False, kind='stable').index
+        number = pd.Series(np.arange(1, ranked.size + 1), index=ranked)
+        return number.reindex(roots).to_numpy() if roots.size else roots
+
+    def component_of(self, category):
+        '''
+        Return the number of the component of a category, or None if it
+        shares no cluster with another category
+        '''
+        where = self.categories.get_indexer([str(category)])[0]
+        return None if where < 0 else int(self._components[where])
+
+    def table(self):
+        '''
+        Return a pandas.DataFrame with a row per component: its root (the
+        category in the most clusters with another category), number of
+        categories, clusters and sequences, and the categories and clusters
+        in it. The table is made once, grouping all components together.
+        '''
+        if self._table is not None:
+            return self._table
+        pairs = self._pairs
+        codes = np.arange(len(self.categories))
+        # the distinct categories sharing a cluster with each category, itself included
+        linked = pairs.merge(pairs, on='clusterid').drop_duplicates(['code_x', 'code_y'])
+        members = pd.DataFrame({
+            'component': self._components, 'category': np.asarray(self.categories, dtype=object),
+            'n_clusters': np.bincount(pairs.code, minlength=codes.size),
+            'degree': np.bincount(linked.code_x, minlength=codes.size), 'code': codes})
+        # most clusters first, then ties to the most other categories
+        ranked = members.sort_values(['component', 'n_clusters', 'degree', 'code'],
+                                     ascending=[True, False, False, True])
+        by_category = ranked.groupby('component', sort=True)
+        named = members.sort_values(['component', 'category'])
+        clusters = pd.DataFrame({'component': self._components[pairs.code.to_numpy()],
+                                 'clusterid': pairs.clusterid.to_numpy()})
+        clusters = clusters.drop_duplicates().sort_values(['component', 'clusterid'])
+        clusters['n_sequences'] = clusters.clusterid.map(self.n_sequences)
+        by_cluster = clusters.groupby('component', sort=True)
+        table = pd.DataFrame({
+            'root': by_category.category.first(), 'n_categories': by_category.size(),
+            'n_clusters': by_cluster.size(), 'n_sequences': by_cluster.n_sequences.sum()})
+        table['categories'] = _joined(named.component, named.category)
+        table['clusters'] = _joined(clusters.component, clusters.clusterid)
+        self._table = table.rename_axis('component').reset_index().reindex(columns=COLUMNS)
+        return self._table
+
+
+def conflict_graph(dataframe, categories_by_cluster):
+    '''
+    Given a cluster table with categories, and the number of categories of
+    its clusters, return the ConflictGraph of the clusters with more than
+    one category.
+    '''
+    n_categories = dataframe.clusterid.map(categories_by_cluster)
+    return ConflictGraph(dataframe.loc[n_categories > 1, ['clusterid', 'category']])
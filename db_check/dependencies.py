@@ -0,0 +1,88 @@
+'''
+Check that the external tools db-check needs are available.
+
+Probing a tool means running it, so what is found is cached (in
+$XDG_CACHE_HOME/db-check, or ~/.cache/db-check) along with the size and
+modification time of the binary, and only probed again if it changes.
+'''
+
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+
+from db_check.messages import error, info, success
+
+VERSION_PAT = re.compile(r'.*([0-9]{1}\.[0-9]{1,2}).*')
+
+
+def cache_dir():
+    '''
+    Where db-check caches things between runs
+    '''
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "db-check"
+
+
+def probe_version(path):
+    '''
+    Run path -h and return the version it reports, or "unknown".
+    '''
+    p = subprocess.run([path, "-h"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       stdin=subprocess.DEVNULL)
+    match = VERSION_PAT.search(p.stdout.decode('utf8', errors='replace'))
+    return "unknown" if match is None else match.group(1)
+
+
+def tool_version(path):
+    '''
+    Return the version of the tool at path, from the cache if the binary
+    has not changed since it was last probed.
+    '''
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    key = {'mtime': stat.st_mtime, 'size': stat.st_size}
+    cache = cache_dir() / "tools.json"
+    try:
+        with open(cache) as fh:
+            tools = json.load(fh)
+    except (OSError, ValueError):
+        tools = {}
+    cached = tools.get(real_path, {})
+    if all(cached.get(field) == value for field, value in key.items()) and 'version' in cached:
+        return cached['version']
+    version = probe_version(path)
+    tools[real_path] = dict(key, version=version)
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_name(f"{cache.name}.{os.getpid()}")
+        with open(tmp, 'wt') as fh:
+            json.dump(tools, fh, indent=2)
+        os.replace(tmp, cache)
+    except OSError:
+        pass
+    return version
+
+
+def cdhit_version():
+    '''
+    Return the version of CD-HIT in the PATH, or None if there is none
+    '''
+    cdhit_path = shutil.which('cd-hit-est')
+    return None if cdhit_path is None else tool_version(cdhit_path)
+
+
+def check_dependencies():
+    '''
+    Check if CD-HIT is available
+    '''
+    info("Checking if CD-HIT is present in the PATH...")
+    cdhit_path = shutil.which('cd-hit-est')
+    if cdhit_path is None:
+        error("Could not find CD-HIT in your PATH.")
+        error("Please make sure to add it to your PATH or install it. You can use brew or conda.")
+        raise FileNotFoundError
+    version_string = tool_version(cdhit_path)
+    success(f"Found CD-HIT version {version_string}")
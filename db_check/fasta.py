@@ -0,0 +1,339 @@
+'''
+Reading FASTA DBs without going through CD-HIT.
+
+DBs can be read from files compressed with gzip, bzip2, xz or zstd (the
+latter needs the zstandard package), or from stdin given as -, and are
+decompressed as they are read.
+'''
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+import mmap
+import os
+import pathlib
+import sys
+
+from db_check.messages import error, warning
+
+# magic bytes at the start of compressed files
+MAGIC = {b"\x1f\x8b": 'gzip',
+         b"BZh": 'bz2',
+         b"\xfd7zXZ\x00": 'xz',
+         b"\x28\xb5\x2f\xfd": 'zstd'}
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+
+def compression(fh):
+    '''
+    Given a buffered binary file, return how it is compressed (gzip, bz2,
+    xz or zstd), or None, without moving through it.
+    '''
+    head = fh.peek(6)[:6]
+    for magic, kind in MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def is_plain_file(filename):
+    '''
+    Is the FASTA DB an uncompressed file (and not stdin), i.e., can it be
+    read more than once and at random?
+    '''
+    if str(filename) == '-':
+        return False
+    with open(filename, 'rb') as fh:
+        return compression(fh) is None
+
+
+def fasta_name(filename):
+    '''
+    Return the name of a FASTA DB without the compression and FASTA suffixes
+    '''
+    if str(filename) == '-':
+        return "stdin"
+    fasta = pathlib.Path(filename)
+    if fasta.suffix.lower() in COMPRESSION_SUFFIXES:
+        fasta = fasta.with_suffix('')
+    return fasta.stem
+
+
+@contextlib.contextmanager
+def open_fasta(filename):
+    '''
+    Open a FASTA DB to read bytes from, decompressing it on the fly if need
+    be. - reads from stdin.
+    '''
+    raw = sys.stdin.buffer if str(filename) == '-' else open(filename, 'rb')
+    try:
+        kind = compression(raw)
+        if kind == 'gzip':
+            fh = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif kind == 'bz2':
+            fh = bz2.BZ2File(raw, mode='rb')
+        elif kind == 'xz':
+            fh = lzma.LZMAFile(raw, mode='rb')
+        elif kind == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                error("Reading zstd compressed DBs needs the zstandard package. Please install it.")
+                raise
+            fh = io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(raw, closefd=False))
+        else:
+            fh = raw
+        yield fh
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def parse_header(line):
+    '''
+    Given a FASTA header line return the sequence ID as CD-HIT reports it
+    (i.e., everything after the > up to the first white space).
+
+    Example:
+    b">seq1~~catA Same as seq2"
+    return "seq1~~catA"
+    '''
+    fields = line[1:].split(None, 1)
+    if not fields:
+        return ""
+    return fields[0].decode('utf8', errors='replace')
+
+
+def iter_fasta(filename):
+    '''
+    Stream a FASTA file one record at a time.
+
+    Yields (seqid, sequence) tuples, where the sequence is returned as
+    upper case bytes with line breaks removed. Only one record is held in
+    memory at any time. The DB can be compressed, or - for stdin (see
+    open_fasta).
+    '''
+    seqid = None
+    chunks = []
+    with open_fasta(filename) as fh:
+        for line in fh:
+            if line[:1] == b'>':
+                if seqid is not None:
+                    yield seqid, b"".join(chunks).upper()
+                seqid = parse_header(line)
+                chunks = []
+            elif seqid is not None:
+                chunks.append(line.strip())
+    if seqid is not None:
+        yield seqid, b"".join(chunks).upper()
+
+
+INDEX_SUFFIX = ".dbcheck.fai"
+INDEX_COLUMNS = ['seqid', 'length', 'start', 'end']
+
+
+def index_path(filename):
+    '''
+    Where the index of a FASTA DB is cached: next to it, with INDEX_SUFFIX
+    added to the name.
+    '''
+    fasta = pathlib.Path(filename)
+    return fasta.with_name(fasta.name + INDEX_SUFFIX)
+
+
+def file_stamp(filename):
+    '''
+    Return the size and modification time (in ns) of a file, to tell if it
+    changed in any way, even for an older copy (e.g., cp -p, rsync -t or
+    a tarball)
+    '''
+    stat = pathlib.Path(filename).stat()
+    return f"size={stat.st_size}\tmtime_ns={stat.st_mtime_ns}"
+
+
+def scan_index(filename):
+    '''
+    Index an uncompressed FASTA DB in one streaming pass, and return the
+    list of (seqid, length, start, end) of its records: the seqid, the
+    number of bases, and the byte offsets of the start and end of the
+    sequence in the file.
+    '''
+    fasta = pathlib.Path(filename)
+    if not is_plain_file(fasta):
+        raise ValueError(f"Can only index uncompressed FASTA files, not {filename}")
+    records = []
+    offset = 0
+    record = None
+    with open(fasta, 'rb') as fh:
+        for line in fh:
+            if line[:1] == b'>':
+                if record is not None:
+                    records.append(tuple(record))
+                record = [parse_header(line), 0, offset + len(line), offset + len(line)]
+            elif record is not None:
+                record[1] += len(line.strip())
+                record[3] = offset + len(line)
+            offset += len(line)
+    if record is not None:
+        records.append(tuple(record))
+    return records
+
+
+def write_index(records, index, stamp):
+    '''
+    Save the records of an index, with the stamp of the DB (see file_stamp)
+    '''
+    # written in full before replacing any index there, so it is never half written
+    partial = pathlib.Path(f"{index}.partial")
+    try:
+        with open(partial, 'wt') as out:
+            out.write(f"#{stamp}\n")
+            out.write("\t".join(INDEX_COLUMNS) + "\n")
+            out.writelines("\t".join(str(field) for field in record) + "\n"
+                           for record in records)
+        os.replace(partial, index)
+    finally:
+        if partial.exists():
+            partial.unlink()
+
+
+def read_index(index, stamp):
+    '''
+    Return the records of a saved index, or None if there is none or if it
+    was built from a DB with another stamp
+    '''
+    try:
+        with open(index, 'rt') as fh:
+            if fh.readline().rstrip("\n") != f"#{stamp}":
+                return None
+            next(fh)
+            records = []
+            for line in fh:
+                seqid, length, start, end = line.rstrip("\n").split("\t")
+                records.append((seqid, int(length), int(start), int(end)))
+            return records
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+def build_index(filename):
+    '''
+    Index an uncompressed FASTA DB (see scan_index), and save the index
+    next to it. Return the path to the index.
+
+    The index is a tab separated file in the spirit of samtools' .fai,
+    with one line per record, after a line with the size and modification
+    time of the DB it was built from. Unlike .fai, lines within a record do
+    not need to be the same length.
+    '''
+    stamp = file_stamp(filename)
+    records = scan_index(filename)
+    index = index_path(filename)
+    write_index(records, index, stamp)
+    return index
+
+
+def load_index(filename):
+    '''
+    Return the index of a FASTA DB as a list of (seqid, length, start, end),
+    building it first if there is none or if the size or modification time
+    of the DB changed since. If the index can not be saved next to the DB
+    (e.g., in a read-only directory), it is only kept in memory.
+    '''
+    fasta = pathlib.Path(filename)
+    index = index_path(fasta)
+    stamp = file_stamp(fasta)
+    records = read_index(index, stamp)
+    if records is not None:
+        return records
+    records = scan_index(fasta)
+    try:
+        write_index(records, index, stamp)
+    except OSError as exc:
+        warning(f"Could not save the index of {fasta} to {index} ({exc}), keeping it in memory.")
+    return records
+
+
+class IndexedFasta():
+    '''
+    Random access to the records of a FASTA DB by seqid, through a memory
+    map of the file. Only the index is held in memory.
+    '''
+
+    def __init__(self, filename):
+        '''
+        Load (or build) the index and map the file
+        '''
+        self.filename = pathlib.Path(filename)
+        self.records = load_index(self.filename)
+        self.positions = {}
+        for i, (seqid, *_) in enumerate(self.records):
+            self.positions.setdefault(seqid, []).append(i)
+        self._fh = open(self.filename, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.records else b""
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, seqid):
+        return seqid in self.positions
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # the map can not be pickled, so re-open the file on the other side
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+    def close(self):
+        '''
+        Unmap and close the file
+        '''
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._fh.close()
+
+    def _sequence(self, i):
+        _, _, start, end = self.records[i]
+        return self._mm[start:end].translate(None, b" \t\r\n").upper()
+
+    def fetch(self, seqid):
+        '''
+        Return the sequence of the first record with this seqid, as upper
+        case bytes. Raise KeyError if there is none.
+        '''
+        return self._sequence(self.positions[seqid][0])
+
+    def fetch_all(self, seqid):
+        '''
+        Return the sequences of all the records with this seqid.
+        '''
+        return [self._sequence(i) for i in self.positions.get(seqid, [])]
+
+
+def sequence_stats(fasta, seqids):
+    '''
+    Given an IndexedFasta, return a dict of seqid to (GC content, number of
+    ambiguous bases) for the seqids given. IDs that are missing, or used by
+    more than one record, are left out.
+    '''
+    stats = {}
+    for seqid in seqids:
+        if len(fasta.positions.get(seqid, [])) != 1:
+            continue
+        seq = fasta.fetch(seqid)
+        acgt = sum(seq.count(base) for base in b"ACGT")
+        gc = seq.count(b"G") + seq.count(b"C")
+        stats[seqid] = (round(gc / acgt, 3) if acgt else float('nan'),
+                        len(seq) - acgt)
+    return stats
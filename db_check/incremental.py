@@ -0,0 +1,326 @@
+'''
+Re-check a new release of a FASTA DB against the results of a previous run.
+
+A manifest of a run records, for every record, the digest of its sequence
+(see db_check.native.canonical_hash) and its cluster. Next to it, a seed
+index of the DB records the seed and hash of every distinct sequence, and
+a window of SEED_LENGTH bases every SAMPLE_STEP bases, all on the strand of
+its canonical form. Given the manifest, the new release is read once to
+hash its records, and only new sequences, and sequences in clusters that
+lost their centroid, are searched: through the seed index for the
+sequences it covers, and by scanning the few sequences it does not.
+Clusters that are not touched by the changes keep their assignments from
+the manifest.
+'''
+
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+
+from db_check.fasta import iter_fasta
+from db_check.messages import info
+from db_check.native import (BATCH_SIZE, SEED_LENGTH, _batches, _expand, _hash_batch,
+                             _pattern_hashes, _seed_hashes, _window_hashes,
+                             assign_clusters, canonical_hash, cluster_table,
+                             find_containments, load_unique, locate, reverse_complement)
+
+SAMPLE_STEP = SEED_LENGTH
+# sequences at least this long have a sampled window wherever they are
+MIN_SAMPLED = SEED_LENGTH + SAMPLE_STEP - 1
+
+
+def seed_index_file(manifest):
+    '''
+    Where the seed index of the DB is saved, next to its manifest
+    '''
+    return f"{manifest}.seeds.npz"
+
+
+def unique_canonical(filename, digests):
+    '''
+    Stream a FASTA DB, and yield the digest and the canonical form of each
+    distinct sequence once. Fills digests with seqid to the hex digest of
+    its sequence. IDs that are used more than once can not be told apart,
+    and get an empty digest.
+    '''
+    seen = set()
+    for seqid, seq in iter_fasta(filename):
+        digest, forward = canonical_hash(seq)
+        digests[seqid] = "" if seqid in digests else digest.hex()
+        if digest not in seen:
+            seen.add(digest)
+            yield digest, seq if forward else reverse_complement(seq)
+
+
+def build_seed_index(canonical, batch_size=BATCH_SIZE):
+    '''
+    Given (digest, canonical sequence) pairs, return the seed index as a
+    dict of arrays: the digest, length, seed hash and hash of each sequence
+    (see db_check.native._seed_hashes), and the hash of the window of
+    SEED_LENGTH bases every SAMPLE_STEP bases of each sequence, sorted, with
+    the sequence and position it is at.
+    '''
+    columns = collections.defaultdict(list)
+    batch = []
+    done = 0
+
+    def index_batch():
+        starts, ends, prefix, inv = _hash_batch(batch)
+        for name, column in zip(('length', 'seed', 'hash'),
+                                _seed_hashes(starts, ends, prefix, inv)):
+            columns[name].append(column)
+        lengths = ends - starts
+        n = np.maximum((lengths - SEED_LENGTH) // SAMPLE_STEP + 1, 0)
+        rec = np.repeat(np.arange(len(batch)), n)
+        pos = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)) * SAMPLE_STEP
+        columns['sample_hash'].append(
+            _window_hashes(prefix, inv, starts[rec] + pos, SEED_LENGTH))
+        columns['sample_seq'].append((rec + done).astype(np.int32))
+        columns['sample_pos'].append(pos.astype(np.int32))
+    size = 0
+    for digest, seq in canonical:
+        columns['digest'].append(np.frombuffer(digest, dtype=np.uint8))
+        batch.append(seq)
+        size += len(seq)
+        if size >= batch_size:
+            index_batch()
+            done += len(batch)
+            batch, size = [], 0
+    if batch:
+        index_batch()
+    if not columns:
+        return None
+    index = {name: np.concatenate(column) if name != 'digest' else np.stack(column)
+             for name, column in columns.items()}
+    index['sampling'] = np.array([SEED_LENGTH, SAMPLE_STEP])
+    order = np.argsort(index['sample_hash'], kind='stable')
+    for name in ('sample_hash', 'sample_seq', 'sample_pos'):
+        index[name] = index[name][order]
+    return index
+
+
+def write_seed_index(index, filename):
+    '''
+    Save the seed index, replacing any older one at once
+    '''
+    partial = f"{filename}.partial"
+    with open(partial, "wb") as fh:
+        np.savez(fh, **index)
+    os.replace(partial, filename)
+
+
+def read_seed_index(filename):
+    '''
+    Read a seed index, or return None if it can not be read, or was not
+    sampled as it would be now
+    '''
+    try:
+        with np.load(filename) as data:
+            index = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+    if index.get('sampling', np.zeros(0)).tolist() != [SEED_LENGTH, SAMPLE_STEP]:
+        return None
+    return index
+
+
+def write_manifest(dataframe, filename, manifest):
+    '''
+    Write the manifest of a run, given the cluster table and the FASTA DB
+    it came from, and save the seed index of the DB next to it (see
+    seed_index_file). The manifest is a tab separated file, compressed if
+    the name ends in .gz, .bz2 or .xz.
+    '''
+    digests = {}
+    index = build_seed_index(unique_canonical(filename, digests))
+    if index is not None:
+        write_seed_index(index, seed_index_file(manifest))
+    seqid = dataframe.seqid.astype(str)
+    result = pd.DataFrame({'seqid': seqid,
+                           'digest': seqid.map(digests).fillna(""),
+                           'clusterid': dataframe.clusterid,
+                           'is_centroid': dataframe.is_centroid,
+                           'length': dataframe.length})
+    result.to_csv(manifest, sep='\t', index=False)
+
+
+def read_manifest(manifest):
+    '''
+    Read the manifest of a previous run
+    '''
+    result = pd.read_csv(manifest, sep='\t', dtype={'seqid': str, 'digest': str},
+                         keep_default_na=False)
+    return result
+
+
+def find_in_samples(seqs, patterns, lengths, hashes, texts, positions,
+                    batch_size=BATCH_SIZE):
+    '''
+    Find the sequences at the indices in patterns, of at least MIN_SAMPLED
+    bases, within the sequences covered by a seed index, on either strand.
+    hashes are the sorted hashes of the sampled windows, at positions in the
+    sequences at indices texts, and lengths those of all the sequences.
+
+    Each of the first SAMPLE_STEP windows of a pattern is looked up, as one
+    of them is sampled wherever the pattern is, and every hit is verified
+    base by base. Returns hits as db_check.native.find_containments does.
+    '''
+    hits = []
+    for batch in _batches(patterns, seqs, batch_size):
+        for strand in ('+', '-'):
+            strings = [seqs[i] if strand == '+' else reverse_complement(seqs[i])
+                       for i in batch]
+            starts, ends, prefix, inv = _hash_batch(strings)
+            rec = np.repeat(np.arange(len(batch)), SAMPLE_STEP)
+            shift = np.tile(np.arange(SAMPLE_STEP), len(batch))
+            windows = _window_hashes(prefix, inv, starts[rec] + shift, SEED_LENGTH)
+            first = np.searchsorted(hashes, windows, side='left')
+            counts = np.searchsorted(hashes, windows, side='right') - first
+            for queries, entries in _expand(first, counts):
+                query, text = rec[queries], texts[entries]
+                offset = positions[entries] - shift[queries]
+                size = (ends - starts)[query]
+                fits = (offset >= 0) & (offset + size <= lengths[text])
+                for r, t, o in zip(query[fits].tolist(), text[fits].tolist(),
+                                   offset[fits].tolist()):
+                    if t != batch[r] and seqs[t][o:o + len(strings[r])] == strings[r]:
+                        hits.append((batch[r], t, o, strand))
+    return hits
+
+
+def orient(hit, seqs, forward):
+    '''
+    Given a hit between the canonical forms of two sequences, return it for
+    the sequences as they are in the DB (forward is whether each is on the
+    strand of its canonical form).
+    '''
+    contained, container, offset, strand = hit
+    flip = forward[contained] != forward[container]
+    if not forward[container]:
+        offset = len(seqs[container]) - offset - len(seqs[contained])
+    if flip:
+        strand = '-' if strand == '+' else '+'
+    return container, offset, strand
+
+
+def cluster_db_incremental(filename, manifest):
+    '''
+    Given a FASTA DB and the manifest of a run on a previous release,
+    cluster the DB re-checking only what has changed.
+
+    A sequence is re-checked if it is not in the manifest, if its cluster
+    lost its centroid, or if its cluster's centroid is found within a
+    sequence that is re-checked. The last rule is applied until no more
+    clusters are affected. The result is the same table returned by
+    db_check.native.cluster_db_native.
+
+    Sequences re-checked are looked up in the seed index saved with the
+    manifest, and in the sequences it does not cover, and the sequences
+    they contain are found by scanning them alone (see
+    db_check.native.find_containments), so no window of the rest of the DB
+    is scanned. Without a seed index, the whole DB is scanned instead.
+    '''
+    previous = read_manifest(manifest)
+    groups, digests, seqs = load_unique(filename)
+    forward = [groups[digest][0][2] for digest in digests]
+    # search the canonical forms, whose positions the seed index records
+    seqs = [seq if fwd else reverse_complement(seq) for seq, fwd in zip(seqs, forward)]
+    rank = {digest.hex(): i for i, digest in enumerate(digests)}
+    previous['rep'] = previous.digest.map(rank)
+    # clusters with records we can not identify, or that lost their centroid
+    centroids = previous[previous.is_centroid & previous.rep.notna()]
+    dirty_clusters = set(previous.clusterid[previous.digest == ""]) | \
+        (set(previous.clusterid) - set(centroids.clusterid))
+    old_centroid = dict(zip(centroids.clusterid, centroids.rep.astype(int)))
+    # centroids of the same length that swapped places may take each other's members
+    tied = collections.defaultdict(list)
+    for cluster_id, rep in sorted(old_centroid.items()):
+        tied[len(seqs[rep])].append((cluster_id, rep))
+    for clusters in tied.values():
+        if [rep for _, rep in clusters] != sorted(rep for _, rep in clusters):
+            dirty_clusters.update(cluster_id for cluster_id, _ in clusters)
+    old_cluster = {}
+    members = {}
+    for cluster_id, rep in zip(previous.clusterid, previous.rep):
+        if pd.isna(rep):
+            continue
+        rep = int(rep)
+        if old_cluster.setdefault(rep, cluster_id) != cluster_id:
+            dirty_clusters.update([cluster_id, old_cluster[rep]])
+        members.setdefault(cluster_id, set()).add(rep)
+    dirty = {rep for rep in range(len(digests))
+             if old_cluster.get(rep, None) in dirty_clusters or rep not in old_cluster}
+    info(f"Re-checking {len(dirty)} of {len(digests)} unique sequences...")
+
+    index = read_seed_index(seed_index_file(manifest))
+    if index is None:
+        info("No seed index next to the manifest, searching the whole DB.")
+        index = {'digest': np.zeros((0, 16), dtype=np.uint8)}
+    # where each sequence of the index is in this release, or -1
+    current = np.array([rank.get(digest.tobytes().hex(), -1) for digest in index['digest']],
+                       dtype=np.int64)
+    covered = current >= 0
+    indexed = current[covered].tolist()
+    unindexed = sorted(set(range(len(digests))) - set(indexed))
+    patterns = indexed + unindexed
+    hashes = _pattern_hashes(seqs, unindexed)
+    if indexed:
+        hashes = tuple(np.concatenate([index[name][covered], column])
+                       for name, column in zip(('length', 'seed', 'hash'), hashes))
+        kept = current[index['sample_seq']] >= 0
+        samples = (index['sample_hash'][kept], current[index['sample_seq'][kept]],
+                   index['sample_pos'][kept].astype(np.int64))
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+
+    def search(todo):
+        found = find_containments(seqs, patterns=todo, texts=unindexed) + \
+            find_containments(seqs, patterns=patterns, texts=todo, hashes=hashes)
+        if indexed:
+            found += find_in_samples(seqs, [i for i in todo if lengths[i] >= MIN_SAMPLED],
+                                     lengths, *samples)
+            # sequences too short to be sampled are looked for the slow way
+            short = [i for i in todo if lengths[i] < MIN_SAMPLED]
+            if short:
+                found += find_containments(seqs, patterns=short, texts=indexed)
+        return found
+
+    containers = {}
+    seen = set()
+    searched = set()
+    while dirty - searched:
+        todo = sorted(dirty - searched)
+        hits = search(todo)
+        searched |= set(todo)
+        for hit in hits:
+            if hit in seen:
+                continue
+            seen.add(hit)
+            contained, container = hit[:2]
+            containers.setdefault(contained, []).append(orient(hit, seqs, forward))
+            # a clean centroid might now join the cluster of a dirty sequence
+            if container in dirty and contained not in dirty and \
+                    old_centroid.get(old_cluster[contained]) == contained:
+                dirty |= members[old_cluster[contained]]
+    for found in containers.values():
+        found.sort(key=lambda hit: (hit[0], hit[2], hit[1]))
+
+    def candidates(rep):
+        found = containers.get(rep, [])
+        if rep in dirty:
+            return found
+        centroid = old_centroid[old_cluster[rep]]
+        if centroid == rep:
+            return found
+        return found + [(centroid, None, None)]
+    clusters, assignment = assign_clusters(len(digests), candidates)
+
+    def as_in_db(rep):
+        return seqs[rep] if forward[rep] else reverse_complement(seqs[rep])
+    for rep, (cluster_id, centroid, offset, strand) in assignment.items():
+        if offset is None:
+            offset, strand = locate(as_in_db(rep), as_in_db(centroid))
+            assignment[rep] = (cluster_id, centroid, offset, strand)
+    del seqs
+    return cluster_table(groups, digests, clusters, assignment)
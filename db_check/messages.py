@@ -2,10 +2,41 @@
 A library of messages using click.secho
 '''
 
+import contextlib
+import threading
+
 import click
 
+_local = threading.local()
+
+
+def is_quiet():
+    '''
+    Whether messages of the current thread are silenced
+    '''
+    return getattr(_local, "quiet", 0) > 0
+
+
+@contextlib.contextmanager
+def quiet(silence=True):
+    '''
+    Silence the messages of the current thread while in the context (if
+    silence is True). Other threads go on as they were, so threads doing
+    work for this one should run in quiet(is_quiet()) to follow it.
+    '''
+    if not silence:
+        yield
+        return
+    _local.quiet = getattr(_local, "quiet", 0) + 1
+    try:
+        yield
+    finally:
+        _local.quiet -= 1
+
 
 def echo_stream(msg, col):
+    if is_quiet():
+        return
     click.secho(msg, fg=col, err=True)
 
 
@@ -23,3 +54,7 @@ def warning(msg):
 
 def success(msg):
     echo_stream(msg, col="green")
+
+
+def progress(msg):
+    echo_stream(msg, col=None)
@@ -0,0 +1,396 @@
+'''
+A native clustering engine that does not depend on CD-HIT.
+
+Sequences are streamed from the FASTA DB and grouped by a hash of their
+canonical form (the lexicographically smallest of the sequence and its
+reverse complement), so identical sequences on either strand end up in
+the same cluster. Unique sequences are then indexed once to find every
+sequence that is contained exactly within another, on either strand.
+The result mimics the table returned by db_check.parsers.parse_clustering.
+'''
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from db_check.fasta import iter_fasta
+from db_check.parsers import as_categorical
+
+COMPLEMENT = bytes.maketrans(b"ACGTUMRWSYKVHDBN", b"TGCAAKYWSRMBDHVN")
+
+# polynomial rolling hash, computed modulo 2**64 by letting uint64 wrap
+BASE = 0x100000001B3
+INV_BASE = pow(BASE, -1, 2**64)
+BATCH_SIZE = 2**22
+# patterns are looked up by the hash of their first SEED_LENGTH bases
+SEED_LENGTH = 16
+MAX_CANDIDATES = 2**22
+FILTER_BITS = 24
+
+
+def reverse_complement(seq):
+    '''
+    Return the reverse complement of an upper case bytes sequence
+    '''
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def canonical_hash(seq):
+    '''
+    Return a digest of the canonical form of the sequence, and whether the
+    sequence is on the same strand as its canonical form.
+
+    Example:
+    b"AACG" and b"CGTT" share the same digest, the first is forward (True)
+    and the second is not (False).
+    '''
+    rc = reverse_complement(seq)
+    forward = seq <= rc
+    canonical = seq if forward else rc
+    return hashlib.blake2b(canonical, digest_size=16).digest(), forward
+
+
+def group_identical(records, keep_sequences=False):
+    '''
+    Group records of (seqid, sequence) by the canonical hash of their
+    sequence.
+
+    Returns a dict of digest to a list of (seqid, length, forward) in the
+    order the records were seen. If keep_sequences is True, also return a
+    dict of digest to the sequence of the first record in each group,
+    otherwise sequences are not kept in memory.
+    '''
+    groups = {}
+    sequences = {}
+    for seqid, seq in records:
+        digest, forward = canonical_hash(seq)
+        if digest not in groups:
+            groups[digest] = []
+            if keep_sequences:
+                sequences[digest] = seq
+        groups[digest].append((seqid, len(seq), forward))
+    if keep_sequences:
+        return groups, sequences
+    return groups
+
+
+def _powers(base, n):
+    '''
+    Return base**i modulo 2**64 for i in 0..n-1
+    '''
+    pw = np.full(n, base, dtype=np.uint64)
+    if n > 0:
+        pw[0] = 1
+    return np.cumprod(pw, dtype=np.uint64)
+
+
+def _hash_batch(seqs):
+    '''
+    Concatenate a batch of sequences and pre-compute what is needed to get
+    the rolling hash of any window in O(1).
+
+    Returns the record start and end positions, the prefix sums of the
+    hash and the inverse powers of the base.
+    '''
+    lengths = np.fromiter((len(s) for s in seqs),
+                          dtype=np.int64, count=len(seqs))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    codes = np.frombuffer(b"".join(seqs), dtype=np.uint8).astype(np.uint64)
+    prefix = np.zeros(codes.size + 1, dtype=np.uint64)
+    np.cumsum(codes * _powers(BASE, codes.size), out=prefix[1:])
+    # one more inverse power than bases, for empty sequences at the end
+    return starts, ends, prefix, _powers(INV_BASE, codes.size + 1)
+
+
+def _window_hashes(prefix, inv, positions, length):
+    '''
+    Hash of the windows of a given length starting at positions
+    '''
+    return (prefix[positions + length] - prefix[positions]) * inv[positions]
+
+
+def _batches(indices, seqs, batch_size):
+    '''
+    Split the indices in to batches of roughly batch_size bases
+    '''
+    batch = []
+    size = 0
+    for i in indices:
+        batch.append(i)
+        size += len(seqs[i])
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def _seed_hashes(starts, ends, prefix, inv):
+    '''
+    Given a batch hashed by _hash_batch, return the lengths of its
+    sequences, the hashes of their first SEED_LENGTH bases (all of them for
+    shorter sequences), and the hashes of the whole sequences.
+    '''
+    lengths = ends - starts
+    seeds = _window_hashes(prefix, inv, starts, np.minimum(lengths, SEED_LENGTH))
+    return lengths, seeds, _window_hashes(prefix, inv, starts, lengths)
+
+
+def _pattern_hashes(seqs, indices, batch_size=BATCH_SIZE):
+    '''
+    Return the lengths, seed hashes and hashes of the sequences at indices
+    (see _seed_hashes), as arrays in the order of indices.
+    '''
+    parts = [_seed_hashes(*_hash_batch([seqs[i] for i in batch]))
+             for batch in _batches(indices, seqs, batch_size)]
+    if not parts:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64),
+                np.zeros(0, dtype=np.uint64))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def _seed_index(patterns, lengths, seeds, hashes):
+    '''
+    Index the patterns by their seed, and by the hash of the whole pattern.
+
+    Returns a dict of seed length to the sorted seed hashes and the length
+    of the patterns starting with each, with one entry per distinct seed
+    and length, and a dict of pattern hash to pattern indices.
+    '''
+    entries = set()
+    table = {}
+    for i, length, seed, h in zip(patterns, lengths.tolist(), seeds.tolist(),
+                                  hashes.tolist()):
+        if length > 0:
+            entries.add((min(length, SEED_LENGTH), seed, length))
+            table.setdefault(h, []).append(i)
+    index = {}
+    for k, seed, length in sorted(entries):
+        index.setdefault(k, ([], []))
+        index[k][0].append(seed)
+        index[k][1].append(length)
+    index = {k: (np.array(seed, dtype=np.uint64), np.array(length, dtype=np.int64))
+             for k, (seed, length) in index.items()}
+    return index, table
+
+
+def _expand(first, counts, max_candidates=MAX_CANDIDATES):
+    '''
+    Given the first of counts consecutive entries matched by each query,
+    yield the queries (repeated) and the entries they match, up to
+    max_candidates at a time.
+    '''
+    done = np.cumsum(counts)
+    start = 0
+    while start < counts.size:
+        before = done[start] - counts[start]
+        stop = max(start + 1, int(np.searchsorted(
+            done, before + max_candidates, side='right')))
+        n = counts[start:stop]
+        offsets = np.cumsum(n) - n
+        queries = np.repeat(np.arange(start, stop), n)
+        yield queries, np.repeat(first[start:stop] - offsets, n) + np.arange(n.sum())
+        start = stop
+
+
+def _seed_matches(prefix, inv, limit, k, seeds, lengths, keys):
+    '''
+    Scan every window of k bases once, and extend those hashing as one of
+    the sorted seeds to the length of each pattern starting with it.
+
+    Yields the start positions, lengths and hashes of the extended windows
+    that hash as one of the sorted keys, MAX_CANDIDATES extensions at a
+    time.
+    '''
+    positions = np.flatnonzero(np.arange(limit.size) + k <= limit)
+    windows = _window_hashes(prefix, inv, positions, k)
+    # most windows miss, so filter them on the top bits of the hash first
+    present = np.zeros(1 << FILTER_BITS, dtype=bool)
+    present[seeds >> np.uint64(64 - FILTER_BITS)] = True
+    maybe = present[windows >> np.uint64(64 - FILTER_BITS)]
+    positions, windows = positions[maybe], windows[maybe]
+    first = np.searchsorted(seeds, windows, side='left')
+    counts = np.searchsorted(seeds, windows, side='right') - first
+    hit = counts > 0
+    for queries, candidates in _expand(first[hit], counts[hit]):
+        pos = positions[hit][queries]
+        length = lengths[candidates]
+        fits = pos + length <= limit[pos]
+        pos, length = pos[fits], length[fits]
+        hashes = _window_hashes(prefix, inv, pos, length)
+        found = keys[np.minimum(np.searchsorted(keys, hashes), keys.size - 1)] == hashes
+        yield pos[found], length[found], hashes[found]
+
+
+def find_containments(seqs, patterns=None, texts=None, batch_size=BATCH_SIZE,
+                      hashes=None):
+    '''
+    Given a list of distinct sequences, find every sequence that occurs
+    exactly within another, on either strand.
+
+    Patterns are indexed by their first SEED_LENGTH bases. Every window of
+    that many bases in the other sequences is hashed once, windows that
+    hit a seed are extended to the lengths of the patterns sharing it, and
+    those hashing as a pattern are verified base by base. Patterns shorter
+    than SEED_LENGTH are looked up the same way, one scan per length, so
+    the cost does not grow with the number of distinct lengths.
+
+    The search can be limited to the sequences at the indices in patterns
+    (what to look for) and in texts (where to look for it). If they are
+    already known, hashes are the lengths, seed hashes and hashes of the
+    patterns (see _pattern_hashes).
+
+    Returns a list of (contained, container, offset, strand) tuples, where
+    contained and container are indices in seqs, and offset is the 0-based
+    position of the contained sequence on the forward strand of the
+    container. Hits are sorted by contained, container, strand (+ first)
+    and offset, so the first of each pair is the one locate finds.
+    '''
+    patterns = list(range(len(seqs)) if patterns is None else patterns)
+    texts = list(range(len(seqs)) if texts is None else texts)
+    if hashes is None:
+        hashes = _pattern_hashes(seqs, patterns, batch_size)
+    index, table = _seed_index(patterns, *hashes)
+    hits = []
+    if not table or not texts:
+        return hits
+    keys = np.sort(np.fromiter(table, dtype=np.uint64, count=len(table)))
+    for batch in _batches(texts, seqs, batch_size):
+        for strand in ('+', '-'):
+            strings = [seqs[i] if strand == '+' else reverse_complement(seqs[i])
+                       for i in batch]
+            starts, ends, prefix, inv = _hash_batch(strings)
+            limit = np.repeat(ends, ends - starts)
+            for k, (seeds, lengths) in index.items():
+                for pos, length, found in _seed_matches(prefix, inv, limit, k,
+                                                        seeds, lengths, keys):
+                    records = np.searchsorted(starts, pos, side='right') - 1
+                    for start, rec, size, h in zip(pos.tolist(), records.tolist(),
+                                                   length.tolist(), found.tolist()):
+                        container = batch[rec]
+                        offset = start - int(starts[rec])
+                        window = strings[rec][offset:offset + size]
+                        if strand == '-':
+                            offset = len(strings[rec]) - offset - size
+                        for contained in table[h]:
+                            if contained != container and seqs[contained] == window:
+                                hits.append((contained, container, offset, strand))
+    hits.sort(key=lambda hit: (hit[0], hit[1], hit[3], hit[2]))
+    return hits
+
+
+def locate(seq, container):
+    '''
+    Return the offset and strand of seq within container, or (-1, '+') if
+    it is not there.
+    '''
+    offset = container.find(seq)
+    if offset >= 0:
+        return offset, '+'
+    rc = reverse_complement(seq)
+    offset = container.find(rc)
+    if offset >= 0:
+        return offset, '-'
+    return -1, '+'
+
+
+def assign_clusters(n_unique, candidates):
+    '''
+    Greedily assign unique sequences, sorted by decreasing length, to
+    clusters. Each sequence joins the cluster of the first centroid that
+    contains it, otherwise it starts a new cluster.
+
+    candidates(i) returns the (container, offset, strand) hits of the
+    i-th sequence to pick from. Containers that are not centroids are
+    ignored.
+
+    Returns the list of clusters (lists of indices, centroid first) and
+    the assignment of each index to (clusterid, centroid, offset, strand).
+    '''
+    clusters = []
+    assignment = {}
+    for rep in range(n_unique):
+        hit = min((h for h in candidates(rep)
+                   if h[0] in assignment and assignment[h[0]][1] == h[0]),
+                  default=None, key=lambda h: assignment[h[0]][0])
+        if hit is None:
+            assignment[rep] = (len(clusters), rep, 0, '+')
+            clusters.append([rep])
+        else:
+            cluster_id = assignment[hit[0]][0]
+            assignment[rep] = (cluster_id, hit[0], hit[1], hit[2])
+            clusters[cluster_id].append(rep)
+    return clusters, assignment
+
+
+def cluster_table(groups, digests, clusters, assignment):
+    '''
+    Expand the clusters of unique sequences back to all the records, and
+    return them as a pandas.DataFrame.
+    '''
+    columns = {'clusterid': [], 'seqid': [], 'length': [],
+               'is_centroid': [], 'offset': [], 'strand': []}
+    for cluster_id, reps in enumerate(clusters):
+        for rep in reps:
+            _, _, offset, strand = assignment[rep]
+            member = groups[digests[rep]]
+            rep_forward = member[0][2]
+            for i, (seqid, length, forward) in enumerate(member):
+                same_strand = (strand == '+') == (forward == rep_forward)
+                columns['clusterid'].append(cluster_id)
+                columns['seqid'].append(seqid)
+                columns['length'].append(length)
+                columns['is_centroid'].append(rep == reps[0] and i == 0)
+                columns['offset'].append(offset)
+                columns['strand'].append('+' if same_strand else '-')
+    result = pd.DataFrame({
+        'clusterid': np.array(columns['clusterid'], dtype='int32'),
+        'seqid': as_categorical(columns['seqid']),
+        'length': np.array(columns['length'], dtype='int32'),
+        'is_centroid': np.array(columns['is_centroid'], dtype=bool),
+        'match': np.ones(len(columns['seqid']), dtype='float32'),
+        'offset': np.array(columns['offset'], dtype='int32'),
+        'strand': columns['strand']})
+    return result
+
+
+def load_unique(filename):
+    '''
+    Stream a FASTA DB and return the groups of identical records, the
+    digests of the unique sequences sorted by decreasing length (ties
+    broken by the order in the file), and the unique sequences in that
+    order.
+    '''
+    groups, sequences = group_identical(
+        iter_fasta(filename), keep_sequences=True)
+    digests = sorted(groups, key=lambda d: -groups[d][0][1])
+    seqs = [sequences[d] for d in digests]
+    return groups, digests, seqs
+
+
+def cluster_db_native(filename, containment=True):
+    '''
+    Given a FASTA DB, cluster identical sequences, and sequences contained
+    within other sequences, without CD-HIT.
+
+    As with CD-HIT, sequences are processed by decreasing length (ties
+    broken by the order in the file), and each sequence joins the cluster
+    of the first centroid that contains it, otherwise it starts a new
+    cluster. The first sequence seen in a cluster is the centroid.
+
+    Besides the columns returned by parse_clustering, the table reports the
+    offset and strand of each sequence within the centroid of its cluster.
+    '''
+    groups, digests, seqs = load_unique(filename)
+    containers = {}
+    if containment:
+        for contained, container, offset, strand in find_containments(seqs):
+            containers.setdefault(contained, []).append(
+                (container, offset, strand))
+    del seqs
+    clusters, assignment = assign_clusters(
+        len(digests), lambda rep: containers.get(rep, []))
+    return cluster_table(groups, digests, clusters, assignment)
@@ -0,0 +1,141 @@
+'''
+Write a non-redundant version of a FASTA DB.
+
+Given the clusters of the DB, one representative is kept in each cluster
+(or, to keep every category, one in each category of each cluster), and
+the FASTA DB is streamed through once, copying the records kept as they
+are (headers and line breaks included) and skipping the others. Only
+sequence IDs and the record being copied are held in memory, never the
+whole DB. Each record left out is listed in a TSV file with the record
+kept in its place.
+'''
+
+import collections
+import gzip
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from db_check.fasta import open_fasta, parse_header
+from db_check.messages import error, info, warning
+
+# centroid: the centroid of each cluster (the longest, for CD-HIT)
+# longest: the longest sequence of each cluster, the centroid if tied
+# category: the centroid, or else the longest, of each category of each cluster
+POLICIES = ('centroid', 'longest', 'category')
+MAP_COLUMNS = ['dropped', 'retained', 'clusterid', 'reason']
+
+
+def representatives(tab, policy="centroid"):
+    '''
+    Given a cluster table, return a pandas.DataFrame with the seqid,
+    clusterid and length of every record, the seqid and length of its
+    representative under policy (see POLICIES), and whether it is kept.
+    '''
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy}, expected one of {', '.join(POLICIES)}")
+    if policy == "category" and 'category' not in tab.columns:
+        error("Keeping a sequence per category needs categories to be parsed.")
+        raise ValueError("No categories to keep a sequence per category")
+    tab = tab.reset_index(drop=True)
+    ranks = pd.DataFrame({'clusterid': tab.clusterid,
+                          'not_centroid': ~tab.is_centroid.astype(bool),
+                          'shorter': -tab.length.astype(np.int64),
+                          'row': np.arange(tab.shape[0])})
+    keys = ['clusterid']
+    if policy == "category":
+        ranks['category'] = tab.category
+        keys.append('category')
+    order = ['shorter', 'not_centroid', 'row'] if policy == "longest" else \
+        ['not_centroid', 'shorter', 'row']
+    ranks = ranks.sort_values(order, kind='stable')
+    best = ranks.groupby(keys, sort=False, dropna=False, observed=True)['row'].transform('first')
+    best = best.sort_index().to_numpy()
+    seqid = tab.seqid.astype(str).to_numpy()
+    length = tab.length.to_numpy()
+    return pd.DataFrame({'seqid': seqid, 'clusterid': tab.clusterid.to_numpy(),
+                         'length': length, 'representative': seqid[best],
+                         'representative_length': length[best],
+                         'kept': best == np.arange(tab.shape[0])})
+
+
+def write_nonredundant(fasta, tab, output, mapping, policy="centroid"):
+    '''
+    Write the records of a FASTA DB kept under policy (see representatives)
+    to output (gzip compressed if it ends in .gz), and the records left out
+    to mapping as TSV, with the record kept in their place, their cluster
+    and why they were left out: identical to, or contained in, the record
+    kept, or a later record with the ID of a record already written.
+
+    Records are matched to the rows of the cluster table by ID and length,
+    in the order of the DB, so of records sharing an ID the one chosen is
+    written, whichever comes first. Only one record is written for each
+    ID, though, and records left out for it are counted in a warning.
+    Records missing from the cluster table (e.g., too short for CD-HIT) are
+    written as they are. Only the clusters of more than one sequence are
+    needed in tab, which makes this work with the partial table of
+    db_check.streaming. One record at a time is held in memory.
+
+    Return the number of records written and left out.
+    '''
+    if str(fasta) == '-':
+        error("Writing a non-redundant DB reads it again, which can not be done from stdin.")
+        raise ValueError("Can not write a non-redundant version of a DB read from stdin")
+    reps = representatives(tab, policy)
+    dropped = reps[~reps.kept]
+    mapping_rows = pd.DataFrame({
+        'dropped': dropped.seqid, 'retained': dropped.representative,
+        'clusterid': dropped.clusterid,
+        'reason': np.where(dropped.length == dropped.representative_length,
+                           'identical', 'contained')}, columns=MAP_COLUMNS)
+    # the rows of each ID, as (length, kept), in the order of the table
+    rows = collections.defaultdict(list)
+    for seqid, length, kept in zip(reps.seqid.tolist(), reps.length.tolist(),
+                                   reps.kept.tolist()):
+        rows[seqid].append((length, kept))
+    # the records of an ID written once already, as they come
+    repeated = []
+    written = set()
+    n_written = 0
+    opener = gzip.open if str(output).endswith(".gz") else open
+
+    def keep(seqid, length):
+        '''
+        Whether to write a record, taking the first row of its ID of the
+        same length (or else the first) off the table
+        '''
+        candidates = rows.get(seqid)
+        kept = True
+        if candidates:
+            match = next((i for i, row in enumerate(candidates) if row[0] == length), 0)
+            kept = candidates.pop(match)[1]
+        if kept and seqid in written:
+            repeated.append((seqid, seqid, None, 'duplicate_id'))
+            return False
+        if kept:
+            written.add(seqid)
+        return kept
+
+    with open_fasta(fasta) as fh, opener(output, 'wb') as out:
+        record = []
+        length = 0
+        for line in itertools.chain(fh, [b">"]):
+            if line[:1] == b'>':
+                if record[:1] and record[0][:1] == b'>' and \
+                        keep(parse_header(record[0]), length):
+                    n_written += 1
+                    out.writelines(line if line.endswith(b"\n") else line + b"\n"
+                                   for line in record)
+                record, length = [], 0
+            else:
+                length += len(line.strip())
+            record.append(line)
+    if repeated:
+        warning(f"Left out {len(repeated)} records with the ID of a record already written, "
+                f"see {mapping}.")
+    mapping_rows = pd.concat([mapping_rows, pd.DataFrame(repeated, columns=MAP_COLUMNS)],
+                             ignore_index=True) if repeated else mapping_rows
+    mapping_rows.to_csv(mapping, sep='\t', index=False)
+    info(f"Wrote {n_written} records to {output}, and the {mapping_rows.shape[0]} left out to {mapping}.")
+    return n_written, mapping_rows.shape[0]
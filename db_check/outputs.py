@@ -0,0 +1,154 @@
+'''
+Write the data behind the report in machine readable formats.
+'''
+
+import datetime as dt
+import json
+import pathlib
+
+import pandas as pd
+
+from db_check import __VERSION__ as version_string
+from db_check.messages import error, info
+
+TABLE_FORMATS = ('tsv', 'parquet')
+
+
+def issue_counts(obj):
+    '''
+    Count the number of issues of each kind in a DBChecklist object.
+    '''
+    sizes = obj.df.groupby('clusterid').size()
+    seqids = obj.df.seqid.value_counts()
+    counts = {'DB': obj.db_name,
+              'Entries': obj.total_entries,
+              'Clusters': obj.total_clusters,
+              'Duplicated IDs': int((seqids > 1).sum()),
+              'Clusters with more than one sequence': int((sizes > 1).sum()),
+              'Clusters with more than one category': '-',
+              'Issues': len(obj.issues)}
+    if getattr(obj, "categories_by_cluster_dist", None) is not None:
+        counts['Clusters with more than one category'] = int(
+            (obj.categories_by_cluster_dist > 1).sum())
+    return counts
+
+
+def failed_counts(db_name, reason):
+    '''
+    Return the row of issue_counts for a DB that could not be checked,
+    saying why in place of the number of issues.
+    '''
+    counts = dict.fromkeys(['DB', 'Entries', 'Clusters', 'Duplicated IDs',
+                            'Clusters with more than one sequence',
+                            'Clusters with more than one category'], '-')
+    counts.update({'DB': db_name, 'Issues': f"Failed: {reason}"})
+    return counts
+
+
+def tables(obj):
+    '''
+    Return a dict of name to pandas.DataFrame with the tables of a
+    DBChecklist object.
+    '''
+    df = obj.df
+    result = {'clusters': df,
+              'duplicates': df[df.duplicated('seqid', keep=False)],
+              'cluster_size_dist': obj.cluster_size_dist,
+              'checks': check_table(obj)}
+    if getattr(obj, "categories_by_cluster_dist", None) is not None:
+        n_categories = df.clusterid.map(obj.categories_by_cluster_dist)
+        result['category_conflicts'] = df[n_categories > 1]
+        result['categories_by_cluster_dist'] = obj.categories_by_cluster_dist_sum
+    if getattr(obj, "conflicts", None) is not None:
+        result['conflict_components'] = obj.conflicts.table()
+    if getattr(obj, "near_duplicates", None) is not None:
+        result['near_duplicates'] = obj.near_duplicates
+    if getattr(obj, "validation", None) is not None:
+        result['validation'] = obj.validation.table()
+    return result
+
+
+def check_table(obj):
+    '''
+    Return the status, wall time and issue of each check run on a
+    DBChecklist object.
+    '''
+    results = getattr(obj, "check_results", {})
+    tab = pd.DataFrame.from_dict(results, orient='index',
+                                 columns=['status', 'seconds', 'issue'])
+    return tab.rename_axis('check').reset_index()
+
+
+def describe(tab):
+    '''
+    Turn a one row table from pandas.DataFrame.describe in to a dict,
+    with missing values (e.g., std of a single value) as None.
+    '''
+    row = tab.iloc[0]
+    return {key: None if value != value else float(value) for key, value in row.items()}
+
+
+def summary(obj):
+    '''
+    Return a dict with a compact summary of a DBChecklist object that can
+    be serialised to JSON.
+    '''
+    counts = issue_counts(obj)
+    result = {'db_name': obj.db_name,
+              'author': obj.author,
+              'date': dt.date.today().strftime("%Y-%m-%d"),
+              'version': version_string,
+              'total_entries': int(obj.total_entries),
+              'total_clusters': int(obj.total_clusters),
+              'n_unique_sequences': int(obj.n_unique_sequences),
+              'n_duplicated_ids': counts['Duplicated IDs'],
+              'n_clusters_more_than_one_sequence': counts['Clusters with more than one sequence'],
+              'cluster_size_dist': describe(obj.cluster_size_dist),
+              'issues': list(obj.issues),
+              'checks': getattr(obj, "check_results", {})}
+    if getattr(obj, "categories_by_cluster_dist", None) is not None:
+        result['n_unique_categories'] = int(obj.n_unique_categories)
+        result['n_clusters_more_than_one_category'] = counts['Clusters with more than one category']
+        result['categories_by_cluster_dist'] = describe(obj.categories_by_cluster_dist_sum)
+    if getattr(obj, "conflicts", None) is not None:
+        result['n_conflict_components'] = int(obj.conflicts.table().shape[0])
+    if getattr(obj, "near_duplicates", None) is not None:
+        result['n_near_duplicate_pairs'] = int(obj.near_duplicates.shape[0])
+    if getattr(obj, "validation", None) is not None:
+        result['validation'] = dict(obj.validation.counts)
+    return result
+
+
+def write_outputs(obj, formats, outdir=".", prefix="db-check"):
+    '''
+    Write the tables of a DBChecklist object as <prefix>.<table>.tsv and/or
+    <prefix>.<table>.parquet, and/or a JSON summary as <prefix>.summary.json
+    to outdir. Formats other than tsv, parquet and json are ignored.
+
+    Return the list of files written.
+    '''
+    outdir = pathlib.Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, tab in tables(obj).items():
+        for fmt in TABLE_FORMATS:
+            if fmt not in formats:
+                continue
+            filename = outdir / f"{prefix}.{name}.{fmt}"
+            if fmt == 'tsv':
+                tab.to_csv(filename, sep='\t', index=False)
+            else:
+                try:
+                    tab.to_parquet(filename, index=False)
+                except ImportError:
+                    error("Writing Parquet needs pyarrow or fastparquet. Please install one of them.")
+                    raise
+            written.append(filename)
+    if 'json' in formats:
+        filename = outdir / f"{prefix}.summary.json"
+        with open(filename, 'wt') as fh:
+            json.dump(summary(obj), fh, indent=2)
+        written.append(filename)
+    for filename in written:
+        info(f"Saved {filename}")
+    return written
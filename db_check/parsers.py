@@ -5,9 +5,16 @@ Depends on CD-HIT
 '''
 
 import collections
+import concurrent.futures
+import functools
+import importlib
+import importlib.util
+import itertools
+import mmap
 import pathlib
 import re
 
+import numpy as np
 import pandas as pd
 
 
@@ -34,14 +41,14 @@ def parse_cluster_member(line, cluster_id):
     Return
     For 0
     {length: 1269,
-     seqid: 71\|z4,z32,
+     seqid: 71|z4,z32,
      is_centroid: True,
      match: 1,
      cluster_id: 597}
 
      For 1
     {length: 1269,
-     seqid: 71\|z4,z32,
+     seqid: 71|z4,z32,
      is_centroid: False,
      match: 1,
      cluster_id: 597}
@@ -53,7 +60,7 @@ def parse_cluster_member(line, cluster_id):
     *_, length, seqid = line.strip().split(None, 2)
     length = length.replace("nt,", "")
     fasta_header, match = seqid.split("...")
-    record['seqid'] = fasta_header[1:].replace("|", "\|")
+    record['seqid'] = fasta_header[1:]
     record['length'] = length
     if match[-1] == '*':
         is_centroid = True
@@ -80,25 +87,231 @@ def parse_record(line, cluster_id):
         return False, parse_cluster_member(line, cluster_id)
 
 
+def as_categorical(values):
+    '''
+    Turn values in to a categorical, with categories in the order they are
+    first seen (which is much faster than sorting them).
+    '''
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def _find_next(positions, after):
+    '''
+    For each value in after, return the first of the sorted positions that
+    is at or after it.
+    '''
+    positions = np.append(positions, np.iinfo(np.int64).max)
+    return positions[np.searchsorted(positions, after)]
+
+
+def _find_last(positions, before):
+    '''
+    For each value in before, return the last of the sorted positions that
+    is before it (-1 if none).
+    '''
+    positions = np.insert(positions, 0, -1)
+    return positions[np.searchsorted(positions, before) - 1]
+
+
+def _parse_numbers(buf, starts, stops):
+    '''
+    Parse the decimal numbers written in buf[starts:stops] for all rows
+    at once, one character position at a time.
+    '''
+    value = np.zeros(starts.size, dtype=np.float64)
+    scale = np.ones(starts.size, dtype=np.float64)
+    seen_dot = np.zeros(starts.size, dtype=bool)
+    width = int((stops - starts).max(initial=0))
+    for k in range(width):
+        pos = starts + k
+        inside = pos < stops
+        char = buf[np.where(inside, pos, 0)]
+        is_digit = inside & (char >= ord('0')) & (char <= ord('9'))
+        value = np.where(is_digit, value * 10 + (char - ord('0')), value)
+        scale = np.where(is_digit & seen_dot, scale * 10, scale)
+        seen_dot |= inside & (char == ord('.'))
+    return value / scale
+
+
 def parse_clustering(filename):
     '''
     Given a clustering file produced from CD-HIT return a pandas.DataFrame
     with all the information
+
+    The file is memory mapped and the position of every field on every
+    line is found with vectorised operations over the raw bytes, so only
+    the seqid column is ever turned in to Python objects. seqid is
+    returned as a categorical column.
+
+    Example lines:
+    >Cluster 597
+    0       1269nt, >71|z4,z32... *
+    1       1269nt, >72|z4,z32... at +/100.00%
     '''
     cluster_file = pathlib.Path(filename)
-    cluster_data = []
-    cluster_id = 0
-    with open(cluster_file, 'rt') as cf:
-        for line in cf:
-            new_cluster, record = parse_record(line, cluster_id)
-            if new_cluster:
-                cluster_id = record
-            else:
-                cluster_data.append(record)
-    result = pd.DataFrame(cluster_data)
+    columns = ['clusterid', 'seqid', 'length', 'is_centroid', 'match']
+    if cluster_file.stat().st_size == 0:
+        return pd.DataFrame(columns=columns).astype(
+            {'clusterid': 'int32', 'seqid': 'category', 'length': 'int32',
+             'is_centroid': bool, 'match': 'float32'})
+    with open(cluster_file, 'rb') as cf, \
+            mmap.mmap(cf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        result = parse_clustering_buffer(mm)
     return result
 
 
+def parse_clustering_buffer(data):
+    '''
+    Parse the lines of a CD-HIT clustering file held in data (bytes, or a
+    memory map), starting with a cluster line, in to a pandas.DataFrame
+    (see parse_clustering).
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if ends.size == 0 or ends[-1] != buf.size - 1:
+        ends = np.append(ends, buf.size)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    ends = ends - (buf[np.maximum(ends - 1, 0)] == ord('\r'))
+    not_empty = ends > starts
+    starts, ends = starts[not_empty], ends[not_empty]
+    is_cluster = buf[starts] == ord('>')
+    # the cluster ID is the last word of the cluster lines
+    cluster_ids = _parse_numbers(buf, starts[is_cluster] + 9,
+                                 ends[is_cluster]).astype(np.int32)
+    cluster_ix = np.cumsum(is_cluster)[~is_cluster] - 1
+    clusterid = np.where(cluster_ix >= 0,
+                         cluster_ids[np.maximum(cluster_ix, 0)] if cluster_ids.size else 0, 0)
+    starts, ends = starts[~is_cluster], ends[~is_cluster]
+    # member lines: <n>\t<length>nt, ><seqid>... <* or at .../<match>%>
+    tabs = _find_next(np.flatnonzero(buf == ord('\t')), starts)
+    commas = _find_next(np.flatnonzero(buf == ord(',')), tabs)
+    dots = np.flatnonzero((buf[:-3] == ord('.')) & (buf[1:-2] == ord('.')) &
+                          (buf[2:-1] == ord('.')) & (buf[3:] == ord(' ')))
+    dots = _find_last(dots, ends)
+    length = _parse_numbers(buf, tabs + 1, commas - 2).astype(np.int32)
+    is_centroid = buf[ends - 1] == ord('*')
+    slashes = _find_last(np.flatnonzero(buf == ord('/')), ends)
+    match_start = np.where(slashes > dots, slashes + 1, dots + 7)
+    match = _parse_numbers(buf, match_start, ends - 1) / 100
+    match = np.where(is_centroid, 1.0, match).astype(np.float32)
+    seqid = [data[a:b].decode('utf8', errors='replace')
+             for a, b in zip((commas + 3).tolist(), dots.tolist())]
+    # release the view on the data, so a memory map can be closed
+    del buf
+    return pd.DataFrame({'clusterid': clusterid.astype(np.int32),
+                         'seqid': as_categorical(seqid),
+                         'length': length,
+                         'is_centroid': is_centroid,
+                         'match': match},
+                        columns=['clusterid', 'seqid', 'length', 'is_centroid', 'match'])
+
+
+def categories_by_seqid(seqid, categories):
+    '''
+    Given a categorical seqid column, and the category of each of its
+    unique IDs (in the order of seqid.cat.categories), return the
+    categorical category column.
+    '''
+    categories = as_categorical(categories)
+    codes = seqid.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, categories.codes[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories.categories),
+                     index=seqid.index)
+
+
+CALLBACK_CHUNK_SIZE = 10000
+
+
+def batch_callback(function):
+    '''
+    Mark a callback as taking a list of seqids and returning the list of
+    their categories, instead of one seqid at a time.
+    '''
+    function.batch = True
+    return function
+
+
+@functools.lru_cache(maxsize=None)
+def load_callback(spec):
+    '''
+    Given module:function, or path/to/file.py:function, import and return
+    the function.
+    '''
+    module_name, sep, function_name = spec.rpartition(":")
+    if not sep or not module_name or not function_name:
+        raise ValueError(f"Expected the callback as module:function, got {spec}")
+    if module_name.endswith(".py"):
+        path = pathlib.Path(module_name)
+        module_spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def _call_callback(callback, values):
+    '''
+    Return the categories of a list of values, calling the callback (or
+    loading it first if given as a module:function string) once per value,
+    or once for all of them if it is a batch callback.
+    '''
+    if isinstance(callback, str):
+        callback = load_callback(callback)
+    if getattr(callback, 'batch', False):
+        categories = list(callback(values))
+        if len(categories) != len(values):
+            raise ValueError(
+                f"The callback returned {len(categories)} categories for {len(values)} seqids.")
+        return categories
+    return [callback(value) for value in values]
+
+
+def apply_callback(callback, ids, key=None, workers=1, chunk_size=CALLBACK_CHUNK_SIZE):
+    '''
+    Return the category of each of the unique ids given by a callback.
+
+    If key (a regex) is given, the callback is called with the part of
+    each id it matches (or with its first capture group), and only once
+    for each distinct part. Ids it does not match are passed whole. With
+    more than one worker, the values are split in chunks of chunk_size
+    handed to a pool of processes, in which case the callback must be
+    importable (e.g., given as a module:function string).
+    '''
+    values = list(ids)
+    codes = None
+    if key is not None:
+        pattern = re.compile(key)
+        keys = [_extract(pattern, value) for value in values]
+        keys = [k if k is not None else v for k, v in zip(keys, values)]
+        codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+        values = list(uniques)
+    if workers > 1 and len(values) > chunk_size:
+        chunks = [values[i:i + chunk_size]
+                  for i in range(0, len(values), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            categories = list(itertools.chain.from_iterable(
+                pool.map(_call_callback, itertools.repeat(callback), chunks)))
+    else:
+        categories = _call_callback(callback, values)
+    categories = np.asarray(categories, dtype=object)
+    if codes is not None:
+        categories = categories[codes]
+    return categories
+
+
+def _extract(pattern, value):
+    '''
+    Return the first capture group (or the whole match, if there are no
+    groups) of the first match of the compiled pattern in value, or None.
+    '''
+    match = pattern.search(value)
+    if match is None:
+        return None
+    return match.group(1) if pattern.groups else match.group(0)
+
+
 def parse_categories(dataframe, **parse_args):
     '''
     A function to parse out categories from sequence IDs
@@ -110,22 +323,30 @@ def parse_categories(dataframe, **parse_args):
     - regex: a regex expression with a single capture group
     OR
     - callback: a function that takes the seqid and returns the 
-        category
+        category (or takes a list of seqids, see batch_callback), or its
+        module:function. Optionally with key and workers (see
+        apply_callback).
+
+    Each unique seqid is only parsed once, and category is returned as a
+    categorical column.
     '''
+    seqid = dataframe.seqid.astype('category')
+    ids = seqid.cat.categories
     if "delimiter" in parse_args.keys():
         # must check that delimiter and field are both set
         # in the command line option
         delimiter = parse_args['delimiter']
         field = int(parse_args['field'])
-        dataframe['category'] = dataframe.seqid.str.split(
-            delimiter).str.get(field)
+        categories = ids.to_series(index=None).astype(str).str.split(
+            delimiter).str.get(field).to_numpy()
     elif "regex" in parse_args.keys():
-        regex = parse_args['regex']
-        dataframe['category'] = dataframe.seqid.str.extract(
-            regex, expand=False)
+        pattern = re.compile(parse_args['regex'])
+        categories = [_extract(pattern, str(value)) for value in ids]
     elif "callback" in parse_args.keys():
-        callback = parse_args['callback']
-        dataframe['category'] = dataframe.seqid.apply(lambda s: callback(s))
+        categories = apply_callback(parse_args['callback'], ids,
+                                    key=parse_args.get('key', None),
+                                    workers=parse_args.get('workers', 1))
     else:
         raise Exception("Not sure how to parse categories.")
+    dataframe['category'] = categories_by_seqid(seqid, categories)
     return dataframe
@@ -0,0 +1,204 @@
+'''
+Run all the steps of a check on a FASTA DB, from clustering to ticking off
+the checks.
+'''
+
+import pathlib
+import shutil
+
+from db_check.cache import cache_key
+from db_check.checklist import DBChecklist
+from db_check.fasta import IndexedFasta, fasta_name, is_plain_file
+from db_check.clustering import CDHIT_OPTIONS, cluster_db, expand_clstr, expand_clustering
+from db_check.dependencies import cdhit_version
+from db_check.incremental import cluster_db_incremental, write_manifest
+from db_check.messages import error, info
+from db_check.native import cluster_db_native
+from db_check.parsers import parse_categories, parse_clustering
+from db_check.profiling import Profiler
+from db_check.validation import ERRORS, InvalidFasta, validate_fasta
+
+
+def check_db(fasta, author, db_name=None, delimiter=None, field=None, regex=None,
+             callback=None, callback_key=None, callback_workers=1,
+             engine="cdhit", threads=None, memory=None, workdir=None, cdhit_timeout=None,
+             prefix="cdhit", collapse=True, containment=True,
+             keep_files=False, manifest=None, previous=None, sequence_stats=False,
+             identity=None, validate="fail", cache=None, stream=False, skip_checks=(),
+             check_timeout=None, profiler=None):
+    '''
+    Cluster a FASTA DB, parse the results and categories, and run the
+    checks. Return the DBChecklist.
+
+    The FASTA DB can be compressed, or - to read it from stdin (see
+    db_check.fasta.open_fasta).
+
+    Unless validate is off, the DB is first validated in a single pass (see
+    db_check.validation), and its findings are reported as checks. If
+    validate is fail, the first error found (e.g., a sequence CD-HIT can not
+    handle) stops the run with db_check.validation.InvalidFasta before anything is clustered.
+    A DB read from stdin is not validated.
+
+    Categories are parsed with delimiter and field, regex, or callback
+    (see db_check.parsers.parse_categories).
+
+    With sequence_stats, the DB is indexed (see db_check.fasta.IndexedFasta)
+    and the index attached to the DBChecklist, so the report can show the
+    content of the sequences it lists. Given an identity (e.g., 0.99),
+    pairs of sequences in distinct clusters at least that identical are
+    looked for (see db_check.similarity). skip_checks and check_timeout are
+    handed to DBChecklist.ticks. Given a db_check.profiling.Profiler, the
+    resources used by each stage are recorded.
+
+    With the native engine, sequences contained within others are only
+    clustered with them if containment is True, otherwise only identical
+    sequences are (see db_check.native.cluster_db_native).
+
+    threads, memory, workdir and cdhit_timeout are handed to
+    db_check.clustering.cluster_db. With keep_files, the CD-HIT files are
+    copied to the current directory. If identical sequences were collapsed,
+    the .clstr file is that of the full DB, with the sequence IDs of the
+    records (see db_check.clustering.expand_clstr), and the one CD-HIT
+    wrote is kept as <prefix>.collapsed.clstr.
+
+    Given a db_check.cache.ClusterCache, the cluster table is looked up in
+    it, and only clustered (and saved to it) if it is not there, or if
+    keep_files is True. DBs read from stdin, or checked against a previous
+    release, are not cached.
+
+    With stream, the DB is clustered with CD-HIT without collapsing
+    identical sequences, and its clustering is summarised in bounded memory
+    (see db_check.streaming), keeping only the clusters the report lists.
+    This can not be combined with the native engine, previous, manifest or
+    identity, which need all the clusters, and skips the cache.
+
+    It is up to the caller to make sure CD-HIT is available (see
+    db_check.dependencies.check_dependencies) if the cdhit engine is used.
+    '''
+    if str(fasta) == '-' and manifest is not None:
+        error("Saving a manifest reads the DB twice, which can not be done from stdin.")
+        raise ValueError("Can not save a manifest of a DB read from stdin")
+    if str(fasta) == '-' and identity is not None:
+        error("Looking for near-identical sequences reads the DB twice, which can not be done from stdin.")
+        raise ValueError("Can not look for near-identical sequences in a DB read from stdin")
+    if stream and (engine != "cdhit" or previous is not None or manifest is not None
+                   or identity is not None):
+        error("Streaming the clusters only works with CD-HIT, and without a manifest, "
+              "a previous release or near-identical sequences.")
+        raise ValueError("Can not stream the clusters with these options")
+    if sequence_stats and not is_plain_file(fasta):
+        error("Only uncompressed FASTA files can be indexed for --sequence-stats.")
+        raise ValueError(f"Can not index {fasta}")
+    if db_name is None:
+        db_name = fasta_name(fasta)
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    validation = None
+    if validate != "off" and str(fasta) == '-':
+        info("Can not validate a DB read from stdin before clustering it, skipping validation.")
+    elif validate != "off":
+        info(f"Validating {db_name}...")
+        errors = ERRORS
+        if engine == "cdhit" and previous is None:
+            errors = errors + ('short_records',)
+        with profiler.stage("validate_fasta"):
+            validation = validate_fasta(fasta, errors=errors,
+                                        fail_fast=validate == "fail")
+        if validate == "fail" and validation.has_errors:
+            for kind in errors:
+                if kind in validation.counts:
+                    error(validation.describe(kind))
+            error("Please fix the DB, or use --validate warn to check it anyway.")
+            raise InvalidFasta(f"{fasta} is not a valid FASTA DB")
+    category_args = {}
+    if delimiter is not None and field is not None:
+        category_args = dict(delimiter=delimiter, field=field)
+    elif regex is not None:
+        category_args = dict(regex=regex)
+    elif callback is not None:
+        category_args = dict(callback=callback, key=callback_key, workers=callback_workers)
+    key = tab = tmpdir = stats = None
+    if cache is not None and previous is None and str(fasta) != '-' and not stream:
+        with profiler.stage("cache_lookup"):
+            params = {'engine': engine}
+            if engine == "cdhit":
+                params.update(collapse=collapse, cdhit=cdhit_version(),
+                              cdhit_options=CDHIT_OPTIONS)
+            else:
+                params.update(containment=containment)
+            key = cache_key(fasta, **params)
+            # the CD-HIT files to keep only come from clustering again
+            tab = None if keep_files else cache.get(key)
+    cached = tab is not None
+    if cached:
+        info(f"Found the clusters of {db_name} in the cache, skipping clustering.")
+    elif previous is not None:
+        info(f"Clustering {db_name}...")
+        with profiler.stage("cluster_db_incremental"):
+            tab = cluster_db_incremental(fasta, previous)
+    elif engine == "native":
+        info(f"Clustering {db_name}...")
+        with profiler.stage("cluster_db_native"):
+            tab = cluster_db_native(fasta, containment=containment)
+    else:
+        info(f"Clustering {db_name}...")
+        with profiler.stage("cluster_db"):
+            [clusters, tmpdir, members] = cluster_db(
+                fasta, prefix, threads=threads, collapse=collapse and not stream,
+                memory=memory, workdir=workdir, timeout=cdhit_timeout)
+        if stream:
+            info("Streaming the results...")
+            with profiler.stage("stream_clusters"):
+                from db_check.streaming import stream_clusters
+                stats = stream_clusters(clusters, spill_dir=workdir, **category_args)
+        else:
+            info("Parsing the results...")
+            with profiler.stage("parse_clustering"):
+                tab = parse_clustering(clusters)
+                if members is not None:
+                    tab = expand_clustering(tab, members)
+    if key is not None and not cached:
+        with profiler.stage("cache_save"):
+            cache.put(key, tab)
+    if category_args and stats is None:
+        with profiler.stage("parse_categories"):
+            tab = parse_categories(tab, **category_args)
+    if manifest is not None:
+        info(f"Saving the manifest to {manifest}...")
+        with profiler.stage("write_manifest"):
+            write_manifest(tab, fasta, manifest)
+    fasta_index = None
+    if sequence_stats:
+        info("Indexing the DB...")
+        with profiler.stage("index_fasta"):
+            fasta_index = IndexedFasta(fasta)
+    near_dups = None
+    if identity is not None:
+        info(f"Looking for sequences at least {identity:.0%} identical...")
+        with profiler.stage("near_duplicates"):
+            from db_check.similarity import near_duplicates
+            near_dups = near_duplicates(fasta, tab, identity)
+    info("Going over all the checks...")
+    with profiler.stage("checks"):
+        if stats is not None:
+            from db_check.streaming import StreamingChecklist
+            checklist = StreamingChecklist(stats, author=author, db_name=db_name,
+                                           fasta=fasta_index, validation=validation)
+        else:
+            checklist = DBChecklist(tab, author=author, db_name=db_name, fasta=fasta_index,
+                                    near_duplicates=near_dups, validation=validation)
+        checklist.ticks(skip=skip_checks, timeout=check_timeout)
+    if tmpdir is not None:
+        if keep_files:
+            info("You decided to keep the files... Here you go...")
+            wd = pathlib.Path(tmpdir.name)
+            for f in wd.glob(prefix+"*"):
+                info(f"Keeping {f.name}")
+                if members is not None and f.name == f"{prefix}.clstr":
+                    # the clusters of the full DB, as CD-HIT would have written them
+                    shutil.copyfile(f.absolute(), f"{prefix}.collapsed.clstr")
+                    expand_clstr(f, members, f.name)
+                else:
+                    shutil.copyfile(f.absolute(), f.name)
+        tmpdir.cleanup()
+    return checklist
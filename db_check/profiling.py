@@ -0,0 +1,114 @@
+'''
+Record where the time and memory of a run go.
+
+A Profiler times each stage of a run (wall and CPU time, including that of
+child processes such as cd-hit-est) and keeps track of the peak resident
+memory of db-check and of its children. It can dump a cProfile of each
+stage, save a JSON trace, and print a short table to stderr.
+'''
+
+import contextlib
+import cProfile
+import json
+import pathlib
+import sys
+import time
+
+from db_check.messages import info
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+MAXRSS_TO_MB = 1 / 2**20 if sys.platform == 'darwin' else 1 / 2**10
+
+
+def usage():
+    '''
+    Return the CPU time and peak RSS in MB of this process and of its
+    children that have been waited for, or None where not available.
+    '''
+    if resource is None:
+        return {'cpu': time.process_time(), 'rss': None,
+                'children_cpu': None, 'children_rss': None}
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'cpu': own.ru_utime + own.ru_stime,
+            'rss': own.ru_maxrss * MAXRSS_TO_MB,
+            'children_cpu': children.ru_utime + children.ru_stime,
+            'children_rss': children.ru_maxrss * MAXRSS_TO_MB}
+
+
+class Profiler():
+    '''
+    Collect the resources used by each stage of a run. A disabled profiler
+    runs the stages without recording anything.
+    '''
+
+    def __init__(self, enabled=True, cprofile_dir=None):
+        '''
+        If cprofile_dir is given, a cProfile of each stage is saved there as
+        <stage>.prof
+        '''
+        self.enabled = enabled
+        self.cprofile_dir = None if cprofile_dir is None else pathlib.Path(
+            cprofile_dir)
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Record the resources used by the block of code within the context.
+
+        Peak RSS can only go up over a run: it is the peak of the process
+        (and of the largest child, e.g. cd-hit-est) at the end of the stage.
+        '''
+        if not self.enabled:
+            yield
+            return
+        profile = None
+        if self.cprofile_dir is not None:
+            self.cprofile_dir.mkdir(parents=True, exist_ok=True)
+            profile = cProfile.Profile()
+        before = usage()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.cprofile_dir / f"{name}.prof")
+            wall = time.perf_counter() - start
+            after = usage()
+
+            def delta(key):
+                return None if after[key] is None else round(after[key] - before[key], 3)
+
+            self.stages.append({'stage': name,
+                                'wall_seconds': round(wall, 3),
+                                'cpu_seconds': delta('cpu'),
+                                'children_cpu_seconds': delta('children_cpu'),
+                                'peak_rss_mb': after['rss'],
+                                'children_peak_rss_mb': after['children_rss']})
+
+    def write_trace(self, filename):
+        '''
+        Save the stages as JSON
+        '''
+        with open(filename, 'wt') as fh:
+            json.dump({'stages': self.stages}, fh, indent=2)
+        info(f"Saved profile to {filename}")
+
+    def report(self):
+        '''
+        Print a table of the stages to stderr
+        '''
+        if not self.stages:
+            return
+        from tabulate import tabulate
+        info("Time and memory used by each stage:")
+        info(tabulate(self.stages, headers="keys", floatfmt=".2f"))
@@ -0,0 +1,247 @@
+'''
+Answer questions about single sequences against a FASTA DB held in memory.
+
+The unique sequences of the DB are indexed once: by the canonical hash of
+their sequence (see db_check.native.canonical_hash), by a sample of their
+k-mers (every step-th k-mer, to find sequences a query is contained in),
+and by their first k-mer (to find sequences contained in a query). Every
+hit is verified base by base.
+'''
+
+import datetime as dt
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from db_check.checklist import DBChecklist
+from db_check.fasta import fasta_name
+from db_check.messages import quiet
+from db_check.native import (_batches, _hash_batch, _window_hashes, canonical_hash,
+                             load_unique, reverse_complement)
+from db_check.parsers import parse_categories
+
+
+def kmer_hashes(seq, k):
+    '''
+    Return the rolling hashes of all the k-mers of a sequence, in order
+    '''
+    if len(seq) < k:
+        return np.array([], dtype=np.uint64)
+    _, _, prefix, inv = _hash_batch([seq])
+    return _window_hashes(prefix, inv, np.arange(len(seq) - k + 1), k)
+
+
+def lookup(keys, values, hashes):
+    '''
+    Given sorted keys, return the indices in hashes and the values of every
+    key equal to one of the hashes.
+    '''
+    left = np.searchsorted(keys, hashes, side='left')
+    right = np.searchsorted(keys, hashes, side='right')
+    counts = right - left
+    which = np.repeat(np.arange(hashes.size), counts)
+    first = np.repeat(left - np.cumsum(counts) + counts, counts)
+    return which, values[first + np.arange(which.size)]
+
+
+class QueryIndex():
+    '''
+    An index of a FASTA DB to find the records that are identical to, that
+    contain, or that are contained in a query sequence, and the records
+    with a given ID.
+    '''
+
+    def __init__(self, filename, k=24, step=8, **parse_args):
+        '''
+        Load and index the DB. parse_args are handed to
+        db_check.parsers.parse_categories to get the category of each
+        record.
+        '''
+        self.filename = pathlib.Path(filename)
+        self.k = k
+        self.step = step
+        self.parse_args = parse_args
+        self.loaded_at = dt.datetime.now().isoformat(timespec='seconds')
+        groups, digests, self.seqs = load_unique(filename)
+        self.records = [groups[digest] for digest in digests]
+        self.rep = {digest: i for i, digest in enumerate(digests)}
+        self.ids = {}
+        for i, members in enumerate(self.records):
+            for seqid, *_ in members:
+                self.ids.setdefault(seqid, []).append(i)
+        self.categories = self.parse_categories(list(self.ids))
+        self._index()
+
+    def parse_categories(self, seqids):
+        '''
+        Return a dict of seqid to category, empty if categories are not
+        parsed.
+        '''
+        if not self.parse_args or not seqids:
+            return {}
+        tab = parse_categories(pd.DataFrame({'seqid': pd.Categorical(seqids)}),
+                               **self.parse_args)
+        return dict(zip(seqids, tab.category.astype(object).where(
+            tab.category.notna(), None)))
+
+    def _index(self):
+        '''
+        Index every step-th k-mer, and the first k-mer, of each unique
+        sequence. Shorter sequences are kept aside to be scanned, and all
+        sequences are joined to scan for short queries.
+        '''
+        k, step = self.k, self.step
+        self.joined = b"\n".join(self.seqs)
+        lengths = np.fromiter((len(seq) + 1 for seq in self.seqs), dtype=np.int64,
+                              count=len(self.seqs))
+        self.starts = np.cumsum(lengths) - lengths
+        indexed = [i for i, seq in enumerate(self.seqs) if len(seq) >= k]
+        self.short = [i for i, seq in enumerate(self.seqs) if len(seq) < k]
+        sample_hashes, sample_values, first_hashes = [], [], []
+        for batch in _batches(indexed, self.seqs, 2**22):
+            starts, ends, prefix, inv = _hash_batch([self.seqs[i] for i in batch])
+            first_hashes.append(_window_hashes(prefix, inv, starts, k))
+            n_windows = (ends - starts - k) // step + 1
+            record = np.repeat(np.arange(len(batch)), n_windows)
+            offset = (np.arange(record.size) -
+                      np.repeat(np.cumsum(n_windows) - n_windows, n_windows)) * step
+            sample_hashes.append(_window_hashes(prefix, inv, starts[record] + offset, k))
+            sample_values.append(np.stack([np.asarray(batch)[record], offset], axis=1))
+        hashes = np.concatenate(sample_hashes) if sample_hashes else np.array([], dtype=np.uint64)
+        values = np.concatenate(sample_values) if sample_values else np.zeros((0, 2), dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+        self.sample_keys, self.sample_values = hashes[order], values[order]
+        hashes = np.concatenate(first_hashes) if first_hashes else np.array([], dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        self.first_keys = hashes[order]
+        self.first_values = np.asarray(indexed, dtype=np.int64)[order]
+
+    def __len__(self):
+        return sum(len(members) for members in self.records)
+
+    def contained_in(self, seq):
+        '''
+        Return the (rep, offset, strand) of every unique sequence seq is
+        contained in, other than itself, with the offset on the rep's strand.
+        '''
+        hits = set()
+        m = len(seq)
+        for strand, query in (('+', seq), ('-', reverse_complement(seq))):
+            if m >= self.k + self.step - 1:
+                which, values = lookup(self.sample_keys, self.sample_values,
+                                       kmer_hashes(query, self.k))
+                candidates = set(zip(values[:, 0].tolist(),
+                                     (values[:, 1] - which).tolist()))
+            else:
+                # too short to be sure to cover a sampled k-mer
+                positions = []
+                position = self.joined.find(query) if query else -1
+                while position >= 0:
+                    positions.append(position)
+                    position = self.joined.find(query, position + 1)
+                reps = np.searchsorted(self.starts, positions, side='right') - 1
+                candidates = set(zip(reps.tolist(),
+                                     (np.asarray(positions, dtype=np.int64) - self.starts[reps]).tolist()))
+            for rep, offset in candidates:
+                text = self.seqs[rep]
+                if offset >= 0 and len(text) > m and text[offset:offset + m] == query:
+                    hits.add((rep, offset, strand))
+        return sorted(hits)
+
+    def contains(self, seq):
+        '''
+        Return the (rep, offset, strand) of every unique sequence contained
+        in seq, other than itself, with the offset on the query's strand.
+        '''
+        hits = set()
+        m = len(seq)
+        for strand, query in (('+', seq), ('-', reverse_complement(seq))):
+            which, reps = lookup(self.first_keys, self.first_values,
+                                 kmer_hashes(query, self.k))
+            candidates = set(zip(reps.tolist(), which.tolist()))
+            for rep in self.short:
+                pattern = self.seqs[rep]
+                offset = query.find(pattern) if pattern else -1
+                while offset >= 0:
+                    candidates.add((rep, offset))
+                    offset = query.find(pattern, offset + 1)
+            for rep, offset in candidates:
+                pattern = self.seqs[rep]
+                if len(pattern) < m and query[offset:offset + len(pattern)] == pattern:
+                    if strand == '-':
+                        offset = m - offset - len(pattern)
+                    hits.add((rep, offset, strand))
+        return sorted(hits)
+
+    def _records(self, rep, offset=None, strand='+', length=None):
+        '''
+        Describe the records of a unique sequence, turning the offset and
+        strand of a hit on the rep in to that on each record, if length
+        (of the query) is given.
+        '''
+        members = self.records[rep]
+        rep_forward = members[0][2]
+        result = []
+        for seqid, seq_length, forward in members:
+            record = {'seqid': seqid, 'length': seq_length,
+                      'category': self.categories.get(seqid)}
+            if offset is not None:
+                same = forward == rep_forward
+                record['strand'] = strand if same else ('-' if strand == '+' else '+')
+                record['offset'] = offset if same or length is None else \
+                    seq_length - offset - length
+            result.append(record)
+        return result
+
+    def query(self, sequence=None, seqid=None):
+        '''
+        Return a dict with the records sharing the seqid, and the records
+        identical to, containing or contained in the sequence, along with
+        the issues the checks find when the query is added to them.
+        '''
+        result = {'db': fasta_name(self.filename), 'seqid': seqid,
+                  'category': None, 'same_id': [], 'identical': [],
+                  'contained_in': [], 'contains': []}
+        if seqid is not None:
+            result['category'] = self.parse_categories([seqid]).get(seqid)
+            result['same_id'] = [record for rep in self.ids.get(seqid, [])
+                                 for record in self._records(rep)
+                                 if record['seqid'] == seqid]
+        if sequence is not None:
+            seq = sequence.encode() if isinstance(sequence, str) else sequence
+            seq = b"".join(seq.split()).upper()
+            result['length'] = len(seq)
+            rep = self.rep.get(canonical_hash(seq)[0])
+            if rep is not None:
+                result['identical'] = self._records(rep)
+            for rep, offset, strand in self.contained_in(seq):
+                result['contained_in'].extend(
+                    self._records(rep, offset, strand, len(seq)))
+            for rep, offset, strand in self.contains(seq):
+                result['contains'].extend(self._records(rep, offset, strand))
+        result['issues'] = self.issues(result)
+        return result
+
+    def issues(self, result):
+        '''
+        Run the checks on a table of the query and the records it overlaps
+        or shares its ID with, as if the query was added to the DB.
+        '''
+        seqid = result['seqid'] or "query"
+        rows = [(0, seqid, result['category'])]
+        overlapping = result['identical'] + result['contained_in'] + result['contains']
+        rows.extend((0, record['seqid'], record['category']) for record in overlapping)
+        seen = {(record['seqid'], record['length']) for record in overlapping}
+        rows.extend((i + 1, record['seqid'], record['category'])
+                    for i, record in enumerate(result['same_id'])
+                    if (record['seqid'], record['length']) not in seen)
+        tab = pd.DataFrame(rows, columns=['clusterid', 'seqid', 'category'])
+        tab['seqid'] = tab.seqid.astype('category')
+        if not self.parse_args or tab.category.isna().all():
+            tab = tab.drop(columns='category')
+        checklist = DBChecklist(tab, author="db-check-server",
+                                db_name=result['db'])
+        with quiet():
+            checklist.ticks()
+        return checklist.issues
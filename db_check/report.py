@@ -1,28 +1,132 @@
 '''
 Define different report sections and how to print them.
+
+Every section writes to a stream (stdout by default) as it goes.
 '''
 
 import datetime as dt
+import sys
+import types
+import numpy as np
+import pandas as pd
 from tabulate import tabulate
 from markdown_strings import *
 
 from db_check import __VERSION__ as version_string
+from db_check.fasta import sequence_stats
+from db_check.outputs import failed_counts, issue_counts
+from db_check.validation import FINDINGS
 
 SEP = horizontal_rule()
 TABLEFMT = 'pipe'
+# rows of grouped tables rendered at a time
+RENDER_ROWS = 5000
+
+
+def write(stream, *parts, sep="\n\n"):
+    '''
+    Write the parts to the stream like print would, defaulting to stdout.
+    '''
+    stream = sys.stdout if stream is None else stream
+    stream.write(sep.join(str(part) for part in parts) + "\n")
+
+
+def escape_pipes(tab):
+    '''
+    Escape | in the seqid and category columns (and their _a and _b
+    versions in tables of pairs), so they do not break the Markdown tables.
+    '''
+    def escape(value):
+        return str(value).replace("|", "\\|")
+    for col in tab.columns:
+        if str(col).split('_')[0] not in ('seqid', 'category'):
+            continue
+        if isinstance(tab[col].dtype, pd.CategoricalDtype):
+            tab = tab.assign(**{col: tab[col].cat.rename_categories(escape)})
+        else:
+            tab = tab.assign(**{col: tab[col].map(escape, na_action='ignore')})
+    return tab
+
+
+def add_sequence_stats(tab, fasta):
+    '''
+    Add the GC content and number of ambiguous bases of each sequence,
+    looked up in an IndexedFasta. Left empty for duplicated IDs.
+    '''
+    seqid = tab.seqid.astype(str)
+    stats = sequence_stats(fasta, seqid.unique())
+    missing = (np.nan, np.nan)
+    return tab.assign(gc=[stats.get(s, missing)[0] for s in seqid],
+                      n_ambiguous=[stats.get(s, missing)[1] for s in seqid])
+
+
+def grouped_tables(tab, key, title, caption, level, stream=None, max_groups=None, side_file=None, what="clusters", fasta=None):
+    '''
+    Write one table per group of rows sharing the same key, with a title
+    and caption formatted with the key. Rows must be sorted so that groups
+    are contiguous.
+
+    Tables are rendered a chunk of groups (about RENDER_ROWS rows) at a
+    time, with one call to tabulate per chunk split up by group, so memory
+    does not grow with the listing. If there are more than max_groups
+    groups, only the first max_groups are written, followed by a note on
+    how many were left out, and the rows of all groups are saved to
+    side_file as TSV.
+
+    Given an IndexedFasta, the sequences written are annotated with their
+    GC content and number of ambiguous bases.
+    '''
+    stream = sys.stdout if stream is None else stream
+    keys = tab[key].to_numpy()
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) \
+        if keys.size else np.array([], dtype=int)
+    n_groups = starts.size
+    n_rows = tab.shape[0]
+    if max_groups is not None and n_groups > max_groups:
+        n_rows = starts[max_groups] if max_groups > 0 else 0
+        starts = starts[:max_groups]
+    first = 0
+    while first < starts.size:
+        # whole groups, at least one, up to about RENDER_ROWS rows
+        last = max(first + 1, int(np.searchsorted(starts, starts[first] + RENDER_ROWS)))
+        begin = starts[first]
+        end = starts[last] if last < starts.size else n_rows
+        chunk = tab.iloc[begin:end]
+        if fasta is not None:
+            chunk = add_sequence_stats(chunk, fasta)
+        chunk = escape_pipes(chunk)
+        lines = tabulate(chunk, showindex=False, headers="keys",
+                         tablefmt=TABLEFMT).split("\n")
+        head, rows = "\n".join(lines[:2]), lines[2:]
+        group_starts = starts[first:last] - begin
+        group_ends = np.r_[group_starts[1:], end - begin]
+        names = chunk[key].to_numpy()[group_starts]
+        stream.writelines(
+            "\n\n".join([header(title.format(k), level),
+                         caption.format(k),
+                         head + "\n" + "\n".join(rows[s:e]),
+                         ""]) + "\n"
+            for k, s, e in zip(names, group_starts.tolist(), group_ends.tolist()))
+        first = last
+    if starts.size < n_groups:
+        msg = f"{n_groups - starts.size} more {what} were left out of this report."
+        if side_file is not None:
+            tab.to_csv(side_file, sep='\t', index=False)
+            msg += f" The full listing is in {side_file}."
+        write(stream, bold(msg), "")
 
 
-def preamble(obj):
+def preamble(obj, stream=None):
     '''
     Print some preamble data
     '''
     today = dt.date.today().strftime("%Y-%m-%d")
     title = header(f"db-check Report {obj.db_name}", 1)
     subtitle = italics(f"By {obj.author} on {today}")
-    print(title, subtitle, SEP, sep='\n\n')
+    write(stream, title, subtitle, SEP)
 
 
-def summary(obj):
+def summary(obj, stream=None):
     '''
     Print the summary header component.
     '''
@@ -37,155 +141,256 @@ def summary(obj):
     total_clusters = f"- {bold('Total clusters:')} {obj.total_clusters}"
     n_unique_seq = f"- {bold('Unique sequence IDs:')} {obj.n_unique_sequences}"
 
-    print(title,
+    write(stream,
+          title,
           subtitle1,
           issues,
           subtitle2,
           total_entries,
           total_clusters,
           n_unique_seq,
-          SEP, sep='\n\n')
+          SEP)
 
 
-def clusters_summary(obj):
+def validation_report(obj, stream=None):
+    '''
+    Given the FASTA DB was validated, print what was found, with the first
+    example of each kind of finding.
+    '''
+    validation = getattr(obj, "validation", None)
+    if validation is None:
+        return
+    title = header("FASTA validation", 2)
+    if not validation.counts:
+        msg = bold(f"Congratulations! All {validation.records} records are well formed.")
+        write(stream, title, msg, SEP)
+        return
+    tab = validation.table().drop_duplicates('finding')
+    tab = tab.assign(finding=tab.finding.map(FINDINGS), seqid=tab.seqid.fillna(""))
+    tab_cap = "Table: What was found validating the FASTA DB, with the first example of each."
+    tab_body = tabulate(escape_pipes(tab), showindex=False,
+                        headers="keys", tablefmt=TABLEFMT)
+    write(stream, title, tab_cap, tab_body, SEP)
+
+
+def clusters_summary(obj, stream=None, max_clusters=None, side_file=None):
     '''
     Given a DBChecklist object, print out some cluster summary data.
     '''
     tab = obj.cluster_size_dist
-    col_header = tab.columns.values
     title = header("Cluster size distribution", 2)
     tab_cap = "Table: Distribution of cluster sizes (i.e., number of sequences)."
     tab_body = tabulate(tab,
-                        showindex=False, tablefmt=TABLEFMT, headers=col_header)
-    print(title,
+                        showindex=False, tablefmt=TABLEFMT, headers="keys")
+    write(stream,
+          title,
           tab_cap,
           tab_body,
-          SEP,
-          sep="\n\n")
+          SEP)
     if tab['max'].values[0] > 1:
-        cluster_report(obj)
+        cluster_report(obj, stream=stream,
+                       max_clusters=max_clusters, side_file=side_file)
     else:
         msg = bold(
             "Congratulations! There were no clusters with more than one sequence.")
-        print(msg, sep="\n")
+        write(stream, msg, sep="\n")
 
 
-def duplicate_report(obj):
+def duplicate_report(obj, stream=None, max_clusters=None, side_file=None):
     '''
     Print a duplicate report
     '''
     title = header("Summary of duplicated IDs", 2)
     tab = obj.df
     ix = tab.duplicated('seqid', keep=False)
-    if sum(ix) == 0:
-        msg = bold("Congratulations! No duplicated IDs found.")
+    if not ix.any():
         return
-    print(title, sep="\n")
-    g = tab[ix].groupby("seqid")
-    for h in g.groups:
-        subtitle = header(f"Duplicate ID {h}", 3)
-        tab_cap = f"Table: Sequences with ID {h}"
-        h = g.get_group(h)
-        tab_body = tabulate(h, showindex=False,
-                            headers=h.columns.values, tablefmt=TABLEFMT)
-        print(subtitle,
-              tab_cap,
-              tab_body,
-              "",
-              sep="\n\n")
-    print(SEP, sep="\n")
-
-
-def cluster_report(obj):
+    write(stream, title, sep="\n")
+    tab = tab[ix]
+    tab = tab.iloc[np.argsort(tab.seqid.astype(str).to_numpy(), kind='stable')]
+    grouped_tables(tab, 'seqid', "Duplicate ID {}", "Table: Sequences with ID {}", 3,
+                   stream=stream, max_groups=max_clusters, side_file=side_file,
+                   what="duplicated IDs")
+    write(stream, SEP, sep="\n")
+
+
+def cluster_report(obj, stream=None, max_clusters=None, side_file=None):
     '''
     Given there are clusters, print out a cluster report, printing clusters with multiple hits
     '''
-    tab = obj.cluster_size_dist
     subtitle = header("Clusters with more than one sequence", 3)
-    print(subtitle, sep="\n")
-    g = obj.df.groupby('clusterid')
-    ix = g.size() > 1
-    ix = sorted(ix.index[ix], key=int)
-    for i in ix:
-        h = g.get_group(i)
-        subsubtitle = header(f"Cluster {i}", 4)
-        col_headers = h.columns.values
-        tab_cap = f"Title: Sequences in cluster {i}"
-        tab_body = tabulate(h, showindex=False,
-                            headers=col_headers, tablefmt=TABLEFMT)
-        print(subsubtitle,
-              tab_cap,
-              tab_body,
-              "",
-              sep="\n\n")
-    print(SEP, sep="\n")
-
-
-def category_report(obj):
+    write(stream, subtitle, sep="\n")
+    tab = obj.df
+    sizes = tab.groupby('clusterid')['clusterid'].transform('size')
+    tab = tab[sizes > 1].sort_values('clusterid', kind='stable')
+    grouped_tables(tab, 'clusterid', "Cluster {}", "Title: Sequences in cluster {}", 4,
+                   stream=stream, max_groups=max_clusters, side_file=side_file,
+                   fasta=getattr(obj, "fasta", None))
+    write(stream, SEP, sep="\n")
+
+
+def category_report(obj, stream=None, max_clusters=None, side_file=None):
     '''
     Given categories have been parse, print out a category report.
     '''
     tab = getattr(obj, "categories_by_cluster_dist_sum", None)
     if tab is None:
         return
-    col_header = tab.columns.values
     title = header("Category report", 2)
     subtitle = header("Distribution of categories by cluster of sequences.", 3)
     tab_cap = f"Table: Distribution of categories by cluster of sequences."
     tab_body = tabulate(tab, showindex=False,
-                        headers=col_header, tablefmt=TABLEFMT)
-    print(title,
+                        headers="keys", tablefmt=TABLEFMT)
+    write(stream,
+          title,
           subtitle,
           tab_cap,
           tab_body,
-          "",
-          sep="\n\n")
+          "")
 
     subtitle = header("Clusters with more than one category", 3)
-    print(subtitle, sep="\n")
+    write(stream, subtitle, sep="\n")
     if tab['max'].values[0] > 1:
-        g = obj.df.groupby('clusterid')
-        ix = g.size() > 1
-        ix = sorted(ix.index[ix], key=int)
-        for i in ix:
-            h = g.get_group(i)
-            if h.category.nunique() > 1:
-                subsubtitle = header(f"Cluster {i}", 4)
-                col_headers = h.columns.values
-                tab_cap = f"Title: Sequences in cluster {i}"
-                tab_body = tabulate(h, showindex=False,
-                                    headers=col_headers, tablefmt=TABLEFMT)
-                print(subsubtitle,
-                      tab_cap,
-                      tab_body,
-                      "",
-                      sep="\n\n")
+        tab = obj.df
+        n_categories = tab.clusterid.map(obj.categories_by_cluster_dist)
+        tab = tab[n_categories > 1].sort_values('clusterid', kind='stable')
+        grouped_tables(tab, 'clusterid', "Cluster {}", "Title: Sequences in cluster {}", 4,
+                       stream=stream, max_groups=max_clusters, side_file=side_file,
+                       fasta=getattr(obj, "fasta", None))
     else:
         msg = bold(
             "Congratulations! There were no clusters with more than one category.")
-        print(msg, sep="\n")
-    print(SEP, sep="\n")
+        write(stream, msg, sep="\n")
+    write(stream, SEP, sep="\n")
+
+
+def conflict_report(obj, stream=None, max_clusters=None, side_file=None):
+    '''
+    Given categories have been parsed, list the groups of categories tied
+    together by clusters with more than one category.
+    '''
+    conflicts = getattr(obj, "conflicts", None)
+    if conflicts is None:
+        return
+    tab = conflicts.table()
+    if tab.empty:
+        return
+    title = header("Categories tangled together", 2)
+    tab_cap = ("Table: Groups of categories tied together, directly or through other categories, "
+               "by clusters with more than one category, with the category in the most of those clusters (root).")
+    shown = tab if max_clusters is None else tab.iloc[:max_clusters]
+    # category names may have | in them
+    shown = shown.assign(root=shown.root.str.replace("|", "\\|", regex=False),
+                         categories=shown.categories.str.replace("|", "\\|", regex=False))
+    tab_body = tabulate(shown, showindex=False, headers="keys", tablefmt=TABLEFMT)
+    write(stream, title, tab_cap, tab_body, "")
+    if shown.shape[0] < tab.shape[0]:
+        msg = f"{tab.shape[0] - shown.shape[0]} more groups were left out of this report."
+        if side_file is not None:
+            tab.to_csv(side_file, sep='\t', index=False)
+            msg += f" The full listing is in {side_file}."
+        write(stream, bold(msg), "")
+    write(stream, SEP, sep="\n")
+
+
+def near_duplicate_report(obj, stream=None, max_clusters=None, side_file=None):
+    '''
+    Given near duplicates were looked for, list the pairs of near-identical
+    sequences in distinct clusters.
+    '''
+    tab = getattr(obj, "near_duplicates", None)
+    if tab is None:
+        return
+    title = header("Near-identical sequences", 2)
+    write(stream, title, sep="\n")
+    if tab.empty:
+        msg = bold(
+            "Congratulations! There were no near-identical sequences in distinct clusters.")
+        write(stream, msg, SEP, sep="\n")
+        return
+    tab_cap = "Table: Pairs of sequences in distinct clusters, with the number of edits between them and their identity."
+    shown = tab if max_clusters is None else tab.iloc[:max_clusters]
+    tab_body = tabulate(escape_pipes(shown), showindex=False,
+                        headers="keys", tablefmt=TABLEFMT)
+    write(stream, tab_cap, tab_body, "")
+    if shown.shape[0] < tab.shape[0]:
+        msg = f"{tab.shape[0] - shown.shape[0]} more pairs were left out of this report."
+        if side_file is not None:
+            tab.to_csv(side_file, sep='\t', index=False)
+            msg += f" The full listing is in {side_file}."
+        write(stream, bold(msg), "")
+    write(stream, SEP, sep="\n")
 
 
-def footer():
+def footer(stream=None):
     '''
     Print a footer
     '''
     footer1 = italics(f"Generated using db-check v{version_string}")
     footer2 = f"db-check is on {link('GitHub', 'https://github.com/andersgs/db-check')}. Please submit {link('issues', 'https://github.com/andersgs/db-check/issues')}"
-    print(" ",
+    write(stream,
+          " ",
           footer1,
-          footer2,
-          sep="\n\n")
+          footer2)
 
 
-def generate_report(checklist_obj):
+def batch_summary(checklist_objs, stream=None, failed=None):
+    '''
+    Print a table with the number of issues found in each DB of a batch,
+    and why the DBs in failed (a dict of DB name to reason) were not checked.
+    '''
+    title = header("Summary across DBs", 2)
+    tab = [issue_counts(obj) for obj in checklist_objs]
+    tab += [failed_counts(name, reason) for name, reason in (failed or {}).items()]
+    tab_cap = "Table: Number of issues found in each DB."
+    tab_body = tabulate(tab, headers="keys", tablefmt=TABLEFMT)
+    write(stream,
+          title,
+          tab_cap,
+          tab_body,
+          SEP)
+
+
+def db_sections(obj, stream=None, max_clusters=None, prefix="db-check"):
+    '''
+    Print all the sections about a single DB. Listings cut short by
+    max_clusters are saved in full to files starting with prefix.
+    '''
+    summary(obj, stream=stream)
+    validation_report(obj, stream=stream)
+    clusters_summary(obj, stream=stream, max_clusters=max_clusters,
+                     side_file=f"{prefix}_clusters.tsv")
+    duplicate_report(obj, stream=stream, max_clusters=max_clusters,
+                     side_file=f"{prefix}_duplicates.tsv")
+    category_report(obj, stream=stream, max_clusters=max_clusters,
+                    side_file=f"{prefix}_category_conflicts.tsv")
+    conflict_report(obj, stream=stream, max_clusters=max_clusters,
+                    side_file=f"{prefix}_conflict_components.tsv")
+    near_duplicate_report(obj, stream=stream, max_clusters=max_clusters,
+                          side_file=f"{prefix}_near_duplicates.tsv")
+
+
+def generate_report(checklist_obj, stream=None, max_clusters=None, prefix="db-check"):
     '''
     Generate various summaries
     '''
-    preamble(checklist_obj)
-    summary(checklist_obj)
-    clusters_summary(checklist_obj)
-    duplicate_report(checklist_obj)
-    category_report(checklist_obj)
-    footer()
+    preamble(checklist_obj, stream=stream)
+    db_sections(checklist_obj, stream=stream,
+                max_clusters=max_clusters, prefix=prefix)
+    footer(stream=stream)
+
+
+def generate_batch_report(checklist_objs, author, db_name, stream=None, max_clusters=None, prefix="db-check", failed=None):
+    '''
+    Generate a single report for a batch of DBs, with a summary across DBs
+    (including the DBs in failed, see batch_summary) followed by the
+    summaries of each DB checked.
+    '''
+    preamble(types.SimpleNamespace(
+        author=author, db_name=db_name), stream=stream)
+    batch_summary(checklist_objs, failed=failed, stream=stream)
+    for obj in checklist_objs:
+        write(stream, header(f"DB {obj.db_name}", 1), sep="\n")
+        db_sections(obj, stream=stream, max_clusters=max_clusters,
+                    prefix=f"{prefix}_{obj.db_name}")
+    footer(stream=stream)
@@ -0,0 +1,237 @@
+'''
+Serve queries against a FASTA DB held in memory, to check new sequences
+as they are submitted (see db_check.query.QueryIndex).
+
+Endpoints, all answering in JSON:
+
+- GET /status: the DB loaded, and when
+- POST /query: a JSON object with a sequence and/or a seqid (or the same
+  as GET /query?sequence=...&seqid=...)
+- POST /reload: load the DB again, e.g. after a new release was published.
+  Queries are answered from the old DB until the new one is ready, or if
+  the new one can not be loaded.
+
+Bad requests get a JSON object with an error, and status 400.
+'''
+
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from db_check import __VERSION__ as version_string
+from db_check.messages import error, info, success
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+MAX_BODY = 2**26
+
+
+class IndexHolder():
+    '''
+    Hold the current QueryIndex of a DB, and swap it for a new one when the
+    DB is reloaded.
+    '''
+
+    def __init__(self, fasta, **index_args):
+        self.fasta = fasta
+        self.index_args = index_args
+        self.lock = threading.Lock()
+        self.index = None
+        self.mtime = None
+        self.reload()
+
+    def reload(self):
+        '''
+        Load the DB in to a new index and start answering from it
+        '''
+        from db_check.query import QueryIndex
+        with self.lock:
+            info(f"Loading {self.fasta}...")
+            start = time.perf_counter()
+            mtime = os.stat(self.fasta).st_mtime
+            index = QueryIndex(self.fasta, **self.index_args)
+            self.index, self.mtime = index, mtime
+            success(f"Loaded {len(index)} records in {time.perf_counter() - start:.1f}s")
+        return self.status()
+
+    def reload_if_changed(self):
+        '''
+        Reload the DB if the file changed since it was loaded
+        '''
+        try:
+            changed = os.stat(self.fasta).st_mtime != self.mtime
+        except OSError:
+            return
+        if changed:
+            self.reload()
+
+    def status(self):
+        index = self.index
+        return {'fasta': str(self.fasta), 'records': len(index),
+                'unique_sequences': len(index.seqs), 'loaded_at': index.loaded_at,
+                'version': version_string}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''
+    Answer the requests. The server holds the IndexHolder as holder.
+    '''
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def query(self, params):
+        sequence = params.get('sequence')
+        seqid = params.get('seqid')
+        if sequence is None and seqid is None:
+            self.send_json({'error': "Give a sequence and/or a seqid."}, 400)
+            return
+        if any(value is not None and not isinstance(value, str) for value in (sequence, seqid)):
+            self.send_json({'error': "sequence and seqid must be strings."}, 400)
+            return
+        try:
+            result = self.server.holder.index.query(sequence=sequence, seqid=seqid)
+        except Exception as exc:
+            error(f"Could not answer a query: {exc}")
+            self.send_json({'error': f"Could not answer the query: {exc}"}, 500)
+            return
+        self.send_json(result)
+
+    def reload(self):
+        holder = self.server.holder
+        try:
+            status = holder.reload()
+        except Exception as exc:
+            error(f"Could not reload {holder.fasta}, still answering from the DB loaded before: {exc}")
+            self.send_json({'error': f"Could not reload {holder.fasta}: {exc}",
+                            'status': holder.status()}, 500)
+            return
+        self.send_json(status)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/status":
+            self.send_json(self.server.holder.status())
+        elif url.path == "/query":
+            params = {key: values[0] for key, values in
+                      urllib.parse.parse_qs(url.query).items()}
+            self.query(params)
+        else:
+            self.send_json({'error': f"Unknown path {url.path}"}, 404)
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY:
+            self.send_json({'error': "Request too large."}, 413)
+            return
+        body = self.rfile.read(length) if length else b""
+        if url.path == "/reload":
+            self.reload()
+        elif url.path == "/query":
+            try:
+                params = json.loads(body or b"{}")
+            except ValueError:
+                self.send_json({'error': "Expected a JSON object."}, 400)
+                return
+            if not isinstance(params, dict):
+                self.send_json({'error': "Expected a JSON object."}, 400)
+                return
+            self.query(params)
+        else:
+            self.send_json({'error': f"Unknown path {url.path}"}, 404)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(holder, host="127.0.0.1", port=8000, socket=None):
+    '''
+    Return an HTTP server answering queries from holder, on host:port or
+    on a Unix socket.
+    '''
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = ThreadingUnixHTTPServer(socket, QueryHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.holder = holder
+    return server
+
+
+def watch(holder, interval):
+    '''
+    Reload the DB whenever the file changes, checking every interval
+    seconds
+    '''
+    while True:
+        time.sleep(interval)
+        try:
+            holder.reload_if_changed()
+        except Exception as exc:
+            error(f"Could not reload {holder.fasta}: {exc}")
+
+
+@click.command("db-check-server", context_settings=CONTEXT_SETTINGS)
+@click.option("-d", "--delimiter", default=None, help="When parsing a category from seqid, split on this delimiter (use -1 for last element, -2 for second to last, etc.).")
+@click.option("-f", "--field", default=None, help="When parsing a category from seqid using a delimiter, keep this field number (0-index).", type=int)
+@click.option("-r", "--regex", default=None, help="When parsing a category from seqid extract using this regex.")
+@click.option("-c", "--callback", default=None, help="When parsing a category from seqid use this function, given as module:function or path/to/file.py:function.")
+@click.option("--host", default="127.0.0.1", help="Address to listen on. (default: 127.0.0.1)")
+@click.option("--port", default=8000, help="Port to listen on. (default: 8000)")
+@click.option("--socket", default=None, help="Listen on this Unix socket instead of --host and --port.")
+@click.option("--watch", "watch_interval", default=None, type=float, help="Reload the DB when the file changes, checking every this many seconds. (default: only on POST /reload)")
+@click.option("-k", "--kmer", default=24, help="Length of the k-mers indexed. (default: 24)")
+@click.option("--step", default=8, help="Index every this many k-mers of each sequence. Queries shorter than kmer + step - 1 are scanned for. (default: 8)")
+@click.version_option(version=version_string, message=f"db-check v{version_string}")
+@click.argument("fasta", type=click.Path(exists=True, dir_okay=False))
+def run_server(delimiter, field, regex, callback, host, port, socket, watch_interval, kmer, step, fasta):
+    '''
+    Answer queries about new sequences against a FASTA DB held in memory.
+    '''
+    modes = [delimiter is not None, regex is not None, callback is not None]
+    if (delimiter is None) != (field is None) or sum(modes) > 1:
+        error("ERROR: Delimiter and field must be specified OR regex OR callback OR None.")
+        raise click.Abort()
+    parse_args = {}
+    if delimiter is not None:
+        parse_args = {'delimiter': delimiter, 'field': field}
+    elif regex is not None:
+        parse_args = {'regex': regex}
+    elif callback is not None:
+        parse_args = {'callback': callback}
+    holder = IndexHolder(fasta, k=kmer, step=step, **parse_args)
+    if watch_interval is not None:
+        threading.Thread(target=watch, args=(holder, watch_interval),
+                         daemon=True).start()
+    server = make_server(holder, host=host, port=port, socket=socket)
+    where = socket if socket is not None else f"http://{host}:{port}"
+    info(f"Answering queries on {where}. Press Ctrl-C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        info("Bye!")
+    finally:
+        server.server_close()
+        if socket is not None and os.path.exists(socket):
+            os.remove(socket)
+
+
+if __name__ == "__main__":
+    run_server()
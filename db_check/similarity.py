@@ -0,0 +1,239 @@
+'''
+Find near-identical sequences (e.g., alleles one or two bases apart that
+are likely assembly errors) without comparing all pairs.
+
+Each unique sequence is sketched by one-permutation MinHash over its
+canonical k-mers (the smallest hash of each k-mer and its reverse
+complement, so strand does not matter): the k-mer hash space is split in
+to bins, and the sketch keeps the smallest hash falling in each bin.
+Sketches are then cut in to bands, and sequences sharing a whole band are
+candidate pairs (locality sensitive hashing). Only the candidates are
+compared base by base.
+'''
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from db_check.native import _batches, _hash_batch, _window_hashes, load_unique, reverse_complement
+
+N_BINS = 128
+EMPTY = np.iinfo(np.uint64).max
+# the probability that a pair at the identity asked for is a candidate
+RECALL = 0.995
+
+
+def _mix(h):
+    '''
+    Scramble the bits of uint64 hashes (the splitmix64 finaliser), so that
+    the top bits can be used to pick a bin
+    '''
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def kmer_size(identity):
+    '''
+    Pick a k-mer size that leaves sequences at the given identity with
+    enough k-mers in common: about one k-mer in ten is hit by a mismatch.
+    '''
+    if identity >= 1:
+        return 21
+    return int(min(max(round(0.1 / (1 - identity)), 8), 21))
+
+
+def expected_jaccard(identity, k, length):
+    '''
+    The Jaccard similarity of the k-mers of two sequences of the given
+    length at the given identity, if the mismatches are spread out so that
+    each one changes k k-mers (the worst case).
+    '''
+    n = max(length - k + 1, 1)
+    shared = max(n - math.ceil((1 - identity) * length) * k, 0)
+    return shared / (2 * n - shared)
+
+
+def band_rows(jaccard, n_bins=N_BINS, recall=RECALL):
+    '''
+    Return the largest number of rows per band (fewer candidates) that
+    still makes pairs with the given Jaccard similarity candidates with
+    probability recall.
+    '''
+    for rows in range(8, 1, -1):
+        bands = n_bins // rows
+        if 1 - (1 - jaccard ** rows) ** bands >= recall:
+            return rows
+    return 1
+
+
+def sketch(seqs, k, n_bins=N_BINS, batch_size=2**22):
+    '''
+    Return the one-permutation MinHash sketches of the sequences as an
+    array of len(seqs) by n_bins. Bins with no k-mer (e.g., in sequences
+    shorter than k) hold EMPTY.
+    '''
+    sketches = np.full((len(seqs), n_bins), EMPTY, dtype=np.uint64)
+    shift = np.uint64(64 - int(math.log2(n_bins)))
+    long_enough = [i for i, seq in enumerate(seqs) if len(seq) >= k]
+    for batch in _batches(long_enough, seqs, batch_size):
+        starts, ends, prefix, inv = _hash_batch([seqs[i] for i in batch])
+        _, _, rc_prefix, _ = _hash_batch([reverse_complement(seqs[i]) for i in batch])
+        n_kmers = ends - starts - k + 1
+        record = np.repeat(np.arange(len(batch)), n_kmers)
+        offset = np.arange(record.size) - np.repeat(np.cumsum(n_kmers) - n_kmers, n_kmers)
+        forward = _window_hashes(prefix, inv, starts[record] + offset, k)
+        # the reverse complement of the k-mer at offset starts at
+        # length - k - offset on the reverse strand
+        rc_positions = starts[record] + n_kmers[record] - 1 - offset
+        reverse = _window_hashes(rc_prefix, inv, rc_positions, k)
+        hashes = _mix(np.minimum(forward, reverse))
+        cells = np.asarray(batch, dtype=np.int64)[record] * n_bins + \
+            (hashes >> shift).astype(np.int64)
+        np.minimum.at(sketches.reshape(-1), cells, hashes)
+    return sketches
+
+
+def candidate_pairs(sketches, rows):
+    '''
+    Return the pairs (i, j), with i < j, of sketches sharing at least one
+    band of rows bins, as an array of shape (n, 2).
+    '''
+    n, n_bins = sketches.shape
+    multipliers = _mix(np.arange(1, rows + 1, dtype=np.uint64))
+    keys = []
+    for band in range(n_bins // rows):
+        values = sketches[:, band * rows:(band + 1) * rows]
+        # bands with no k-mer at all say nothing about similarity
+        valid = np.flatnonzero((values != EMPTY).any(axis=1))
+        key = _mix((values[valid] * multipliers).sum(axis=1, dtype=np.uint64))
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        bounds = np.flatnonzero(np.r_[True, key[1:] != key[:-1], True])
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            if end - start < 2:
+                continue
+            members = np.sort(valid[order[start:end]])
+            i, j = np.triu_indices(members.size, 1)
+            keys.append(members[i] * n + members[j])
+    if not keys:
+        return np.zeros((0, 2), dtype=np.int64)
+    keys = np.unique(np.concatenate(keys))
+    return np.stack([keys // n, keys % n], axis=1)
+
+
+def edit_distance(a, b, max_edits):
+    '''
+    Return the edit distance between a and b, or None if it is more than
+    max_edits. Only the band of the dynamic programming matrix within
+    max_edits of the diagonal is filled in.
+    '''
+    if len(a) > len(b):
+        a, b = b, a
+    n, m = len(a), len(b)
+    if m - n > max_edits:
+        return None
+    width = 2 * max_edits + 1
+    over = max_edits + 1
+    # row i holds the distances to b[:j] for j in i - max_edits..i + max_edits
+    previous = [j - max_edits if 0 <= j - max_edits <= m else over for j in range(width)]
+    for i in range(1, n + 1):
+        current = [over] * width
+        ai = a[i - 1]
+        low = i - max_edits
+        for d in range(width):
+            j = low + d
+            if j < 0 or j > m:
+                continue
+            if j == 0:
+                current[d] = i if i <= max_edits else over
+                continue
+            best = previous[d] + (ai != b[j - 1])
+            if d + 1 < width and previous[d + 1] + 1 < best:
+                best = previous[d + 1] + 1
+            if d > 0 and current[d - 1] + 1 < best:
+                best = current[d - 1] + 1
+            current[d] = best if best < over else over
+        if min(current) >= over:
+            return None
+        previous = current
+    distance = previous[m - n + max_edits]
+    return None if distance > max_edits else distance
+
+
+def compare(a, b, identity):
+    '''
+    Return the number of edits and strand (of b relative to a) of the best
+    alignment of a and b if their identity (1 - edits / the longest length)
+    is at least identity, otherwise None.
+    '''
+    max_edits = int((1 - identity) * max(len(a), len(b)) + 1e-9)
+    best = None
+    for strand, other in (('+', b), ('-', reverse_complement(b))):
+        if len(a) == len(other):
+            # most near duplicates only differ by substitutions
+            mismatches = int(np.count_nonzero(np.frombuffer(a, dtype=np.uint8) !=
+                                              np.frombuffer(other, dtype=np.uint8)))
+            if mismatches <= 1:
+                edits = mismatches if mismatches <= max_edits else None
+            else:
+                edits = edit_distance(a, other, min(mismatches, max_edits))
+        else:
+            edits = edit_distance(a, other, max_edits)
+        if edits is not None and (best is None or edits < best[0]):
+            best = (edits, strand)
+    return best
+
+
+def find_near_duplicates(seqs, identity):
+    '''
+    Return (i, j, edits, strand) for every pair of distinct sequences whose
+    identity is at least identity.
+    '''
+    if len(seqs) < 2:
+        return []
+    k = kmer_size(identity)
+    length = int(np.median([len(seq) for seq in seqs]))
+    rows = band_rows(expected_jaccard(identity, k, length))
+    pairs = []
+    for i, j in candidate_pairs(sketch(seqs, k), rows).tolist():
+        result = compare(seqs[i], seqs[j], identity)
+        if result is not None and result[0] > 0:
+            pairs.append((i, j) + result)
+    return pairs
+
+
+def near_duplicates(filename, tab, identity):
+    '''
+    Given a FASTA DB and its cluster table, return a pandas.DataFrame of the
+    pairs of sequences in distinct clusters with at least the given
+    identity. Each unique sequence is represented by its first record.
+    Pairs with a record missing from the cluster table (e.g., too short for
+    CD-HIT) are left out.
+    '''
+    groups, digests, seqs = load_unique(filename)
+    pairs = find_near_duplicates(seqs, identity)
+    del seqs
+    first = tab.drop_duplicates('seqid')
+    first.index = first.seqid.astype(str)
+    columns = ['seqid', 'clusterid', 'length'] + \
+        (['category'] if 'category' in tab.columns else [])
+    records = [(groups[digests[i]][0], groups[digests[j]][0]) for i, j, _, _ in pairs]
+    rows_a = first.reindex([str(a[0]) for a, _ in records])[columns].reset_index(drop=True)
+    rows_b = first.reindex([str(b[0]) for _, b in records])[columns].reset_index(drop=True)
+    result = pd.concat([rows_a.add_suffix("_a"), rows_b.add_suffix("_b")], axis=1)
+    result['edits'] = [edits for _, _, edits, _ in pairs]
+    result['strand'] = [strand for _, _, _, strand in pairs]
+    result['identity'] = [round(1 - edits / max(a[1], b[1]), 4)
+                          for (a, b), (_, _, edits, _) in zip(records, pairs)]
+    found = result.seqid_a.notna() & result.seqid_b.notna()
+    result = result[found & (result.clusterid_a != result.clusterid_b)]
+    dtypes = {f"{col}{end}": tab[col].dtype if col in ('clusterid', 'length') else object
+              for col in columns for end in ("_a", "_b")}
+    result = result.astype(dtypes)
+    return result.sort_values(['identity', 'clusterid_a', 'clusterid_b'],
+                              ascending=[False, True, True], kind='stable',
+                              ignore_index=True)
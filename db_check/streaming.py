@@ -0,0 +1,246 @@
+'''
+Check very large DBs in bounded memory.
+
+The checks only need a few numbers about the whole DB (number of records,
+clusters and unique IDs, and the distributions of cluster sizes and of
+categories by cluster), and the report only lists the clusters with more
+than one sequence and the records with duplicated IDs. Here, the CD-HIT
+clustering file is read in chunks of whole clusters, and each chunk is
+summarised in to exact counters (e.g., the number of clusters of each
+size) before being dropped, keeping only the clusters the report lists.
+Finding duplicated IDs needs to see every ID, so records are spilled to
+disk, partitioned by the hash of their ID, and each partition is read back
+on its own at the end. Memory then depends on the size of a chunk, of a
+partition and of the clusters listed, not on the size of the DB.
+'''
+
+import collections
+import math
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from db_check.checklist import DBChecklist
+from db_check.conflicts import conflict_graph
+from db_check.messages import progress
+from db_check.parsers import as_categorical, parse_categories, parse_clustering_buffer
+
+# bytes of the clustering file read at a time
+CHUNK_SIZE = 2**24
+# bytes of the clustering file per partition of spilled records
+PARTITION_SIZE = 2**25
+MAX_PARTITIONS = 512
+STATS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+def iter_clustering(filename, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the clustering in a CD-HIT clustering file as a pandas.DataFrame
+    for each chunk of about chunk_size bytes, cut between clusters.
+    '''
+    rest = b""
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk_size), b""):
+            data = rest + block
+            cut = data.rfind(b"\n>")
+            if cut < 0:
+                rest = data
+                continue
+            rest = data[cut + 1:]
+            yield parse_clustering_buffer(data[:cut + 1])
+    if rest.strip():
+        yield parse_clustering_buffer(rest)
+
+
+def describe_counts(counts, name):
+    '''
+    Given a dict of value to the number of times it was seen, return the
+    same one row table as pandas.Series.describe on all those values.
+    '''
+    values = np.array(sorted(counts), dtype=np.float64)
+    weights = np.array([counts[value] for value in sorted(counts)], dtype=np.int64)
+    n = int(weights.sum())
+    row = dict.fromkeys(STATS, np.nan)
+    row['count'] = float(n)
+    if n:
+        mean = float((values * weights).sum() / n)
+        row.update({'mean': mean, 'min': values[0], 'max': values[-1]})
+        if n > 1:
+            row['std'] = math.sqrt(float(((values - mean)**2 * weights).sum()) / (n - 1))
+        ends = np.cumsum(weights)
+        for q, stat in ((0.25, '25%'), (0.5, '50%'), (0.75, '75%')):
+            # linear interpolation between the closest ranks, as pandas does
+            position = q * (n - 1)
+            lower = values[np.searchsorted(ends, math.floor(position), side='right')]
+            upper = values[np.searchsorted(ends, math.ceil(position), side='right')]
+            row[stat] = lower + (upper - lower) * (position - math.floor(position))
+    return pd.DataFrame([row], index=[name], columns=STATS)
+
+
+def load_all(filename):
+    '''
+    Yield the objects pickled one after the other in a file
+    '''
+    with open(filename, 'rb') as fh:
+        while True:
+            try:
+                yield pickle.load(fh)
+            except EOFError:
+                return
+
+
+class ClusterStats():
+    '''
+    Exact summaries of a clustering, added to one chunk of whole clusters
+    at a time, with the records spilled to partitions in spill_dir to
+    count unique IDs at the end (see finish).
+    '''
+
+    def __init__(self, spill_dir, partitions=1):
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+        self.total_entries = 0
+        self.total_clusters = 0
+        self.n_unique_sequences = None
+        self.size_counts = collections.Counter()
+        self.category_counts = None
+        self.categories = None
+        self.listed = []
+        self.listed_categories = []
+        self.df = None
+        self._spills = {}
+
+    def add(self, chunk):
+        '''
+        Summarise a chunk of whole clusters, keep those with more than one
+        sequence, and spill all the records
+        '''
+        self.total_entries += chunk.shape[0]
+        sizes = chunk.groupby('clusterid')['clusterid'].size()
+        self.total_clusters += sizes.size
+        self.size_counts.update(sizes.value_counts().to_dict())
+        listed = chunk.clusterid.map(sizes).to_numpy() > 1
+        if 'category' in chunk.columns:
+            if self.category_counts is None:
+                self.category_counts = collections.Counter()
+                self.categories = set()
+            n_categories = chunk.groupby('clusterid')['category'].nunique()
+            self.category_counts.update(n_categories.value_counts().to_dict())
+            self.categories.update(chunk.category.dropna().unique().tolist())
+            self.listed_categories.append(n_categories[sizes > 1])
+        # as plain strings, so the clusters kept do not carry all the IDs of the chunk
+        chunk = chunk.astype({'seqid': str})
+        if listed.any():
+            self.listed.append(chunk[listed])
+        self._spill(chunk.assign(listed=listed))
+
+    def _spill(self, chunk):
+        partition = pd.util.hash_pandas_object(chunk.seqid, index=False).to_numpy() % self.partitions
+        for number, rows in chunk.groupby(partition, sort=False):
+            if number not in self._spills:
+                self._spills[number] = open(
+                    os.path.join(self.spill_dir, f"partition{number}.pickle"), 'wb')
+            pickle.dump(rows, self._spills[number], protocol=pickle.HIGHEST_PROTOCOL)
+
+    def finish(self, columns, dtypes):
+        '''
+        Read back the spilled records one partition at a time to count
+        unique IDs, and gather the clusters listed and the records with
+        duplicated IDs in df, with the given columns and dtypes
+        '''
+        self.n_unique_sequences = 0
+        duplicates = []
+        for number, fh in sorted(self._spills.items()):
+            fh.close()
+            records = pd.concat(load_all(fh.name), ignore_index=True)
+            counts = records.seqid.value_counts()
+            self.n_unique_sequences += counts.size
+            ix = (records.seqid.map(counts) > 1) & ~records.listed
+            if ix.any():
+                duplicates.append(records[ix].drop(columns='listed'))
+            os.remove(fh.name)
+        self._spills = {}
+        tables = self.listed + duplicates
+        if tables:
+            df = pd.concat([tab.astype(dtypes) for tab in tables], ignore_index=True)
+            df = df.sort_values('clusterid', kind='stable').reset_index(drop=True)
+        else:
+            df = pd.DataFrame(columns=columns).astype(dtypes)
+        df['seqid'] = as_categorical(df.seqid)
+        if 'category' in df.columns:
+            df['category'] = as_categorical(df.category)
+        self.df = df
+        self.listed = []
+        return self
+
+    def categories_by_cluster_dist(self):
+        '''
+        The number of categories of each cluster with more than one sequence
+        '''
+        if not self.listed_categories:
+            return pd.Series([], dtype='int64', name='category', index=pd.Index(
+                [], dtype='int32', name='clusterid'))
+        return pd.concat(self.listed_categories)
+
+
+def stream_clusters(filename, spill_dir=None, chunk_size=CHUNK_SIZE, **parse_args):
+    '''
+    Summarise a CD-HIT clustering file in bounded memory, parsing the
+    categories of each chunk with parse_args if any (see
+    db_check.parsers.parse_categories). Records are spilled to a temporary
+    directory within spill_dir (default: the system's). Return the
+    ClusterStats.
+    '''
+    size = os.path.getsize(filename)
+    partitions = min(max(1, math.ceil(size / PARTITION_SIZE)), MAX_PARTITIONS)
+    columns = dtypes = None
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmpdir:
+        stats = ClusterStats(tmpdir, partitions)
+        for chunk in iter_clustering(filename, chunk_size):
+            if parse_args:
+                chunk = parse_categories(chunk, **parse_args)
+            if columns is None:
+                columns = list(chunk.columns)
+                dtypes = {col: str(dtype) for col, dtype in chunk.dtypes.items()
+                          if col not in ('seqid', 'category')}
+            stats.add(chunk)
+            progress(f"Summarised {stats.total_entries} records in {stats.total_clusters} clusters...")
+        if columns is None:
+            columns = ['clusterid', 'seqid', 'length', 'is_centroid', 'match']
+            dtypes = {'clusterid': 'int32', 'length': 'int32', 'is_centroid': bool,
+                      'match': 'float32'}
+            if parse_args:
+                columns.append('category')
+                stats.category_counts, stats.categories = collections.Counter(), set()
+        stats.finish(columns, dtypes)
+    return stats
+
+
+class StreamingChecklist(DBChecklist):
+    '''
+    A DBChecklist of a DB summarised with stream_clusters. Its df only
+    holds the clusters with more than one sequence and the records with
+    duplicated IDs, and categories_by_cluster_dist only the clusters with
+    more than one sequence, which is all the checks and report need.
+    '''
+
+    def __init__(self, stats, author, db_name, **kwargs):
+        self.stats = stats
+        super().__init__(stats.df, author, db_name, **kwargs)
+
+    def _summarise(self):
+        stats = self.stats
+        self.total_entries = stats.total_entries
+        self.total_clusters = stats.total_clusters
+        self.n_unique_sequences = stats.n_unique_sequences
+        self.cluster_size_dist = describe_counts(stats.size_counts, 'clusterid')
+
+    def _summarise_categories(self):
+        stats = self.stats
+        self.n_unique_categories = len(stats.categories)
+        self.categories_by_cluster_dist = stats.categories_by_cluster_dist()
+        self.categories_by_cluster_dist_sum = describe_counts(stats.category_counts, 'category')
+        self.conflicts = conflict_graph(self.df, self.categories_by_cluster_dist)
@@ -0,0 +1,183 @@
+'''
+Validate a FASTA DB in a single pass, before clustering it.
+
+Records that CD-HIT chokes on (e.g., characters that are not nucleotide
+codes) or silently drops (sequences of 10 bases or fewer) would otherwise
+only show up as a failed run or a wrong report after clustering. The DB is
+streamed line by line, so sequences are never held in memory, but an 8
+byte hash of every sequence ID is kept to find duplicated IDs: memory
+grows with the number of records (about 75 bytes each, with the set
+holding them), plus a few examples of each finding.
+'''
+
+import collections
+import hashlib
+
+import pandas as pd
+
+from db_check.fasta import open_fasta
+
+# IUPAC nucleotide codes, in upper and lower case
+IUPAC = b"ACGTUNRYSWKMBDHVacgtunryswkmbdhv"
+# CD-HIT throws away sequences of 10 bases or fewer (its -l option)
+CDHIT_MIN_LENGTH = 11
+MAX_EXAMPLES = 100
+
+# kind of finding: description, as used in the report
+FINDINGS = {
+    'no_records': "No records",
+    'before_first_header': "Lines before the first header",
+    'empty_ids': "Records without a sequence ID right after the >",
+    'mangled_ids': "Sequence IDs that CD-HIT would mangle (with ... or non-printable characters)",
+    'empty_records': "Records without a sequence",
+    'invalid_characters': "Sequences with characters that are not IUPAC nucleotide codes",
+    'short_records': "Sequences too short to be clustered by CD-HIT",
+    'duplicate_ids': "Sequence IDs used more than once",
+    'blank_lines': "Blank lines",
+    'crlf_line_endings': "Windows (CRLF) line endings",
+    'mixed_line_endings': "A mix of Windows (CRLF) and Unix (LF) line endings",
+    'no_final_newline': "No line break at the end of the file",
+}
+# findings that make CD-HIT fail, or the report wrong
+ERRORS = ('no_records', 'before_first_header', 'empty_ids', 'mangled_ids', 'empty_records',
+          'invalid_characters')
+PRINTABLE = bytes(range(33, 127))
+
+
+class InvalidFasta(ValueError):
+    '''
+    Raised when a FASTA DB fails validation
+    '''
+
+
+class FastaValidation():
+    '''
+    What was found validating a FASTA DB: the number of findings of each
+    kind, and up to MAX_EXAMPLES examples of each as (line, seqid, detail).
+    '''
+
+    def __init__(self, errors=ERRORS):
+        self.errors = tuple(errors)
+        self.records = 0
+        self.counts = collections.Counter()
+        self.examples = collections.defaultdict(list)
+        self.complete = True
+
+    def add(self, kind, line, seqid, detail=""):
+        self.counts[kind] += 1
+        if len(self.examples[kind]) < MAX_EXAMPLES:
+            self.examples[kind].append((line, seqid, detail))
+
+    def severity(self, kind):
+        return 'error' if kind in self.errors else 'warning'
+
+    @property
+    def has_errors(self):
+        return any(kind in self.counts for kind in self.errors)
+
+    def describe(self, kind):
+        '''
+        A sentence on the findings of a kind, with the first example
+        '''
+        line, seqid, detail = self.examples[kind][0]
+        where = f"{seqid} on line {line}" if seqid else f"line {line}"
+        detail = f": {detail}" if detail else ""
+        return f"{FINDINGS[kind]} ({self.counts[kind]}, e.g., {where}{detail})."
+
+    def table(self):
+        '''
+        Return the examples of every kind of finding as a pandas.DataFrame
+        '''
+        rows = [(kind, self.severity(kind), self.counts[kind], line, seqid, detail)
+                for kind in FINDINGS for line, seqid, detail in self.examples.get(kind, [])]
+        return pd.DataFrame(rows, columns=['finding', 'severity', 'count', 'line',
+                                           'seqid', 'detail'])
+
+
+def validate_fasta(filename, min_length=CDHIT_MIN_LENGTH, errors=ERRORS, fail_fast=False):
+    '''
+    Stream a FASTA DB (compressed or not, or - for stdin) and return a
+    FastaValidation of what was found. Findings of the kinds in errors are
+    errors, the rest are warnings. With fail_fast, stop at the first error
+    (and set complete to False).
+    '''
+    result = FastaValidation(errors)
+    seen = set()
+    seqid = None
+    header_line = 0
+    length = 0
+    invalid = set()
+    crlf = lf = 0
+    line = b""
+
+    def end_record():
+        if length == 0:
+            result.add('empty_records', header_line, seqid)
+        elif length < min_length:
+            result.add('short_records', header_line, seqid, f"{length} bases")
+        if invalid:
+            chars = ''.join(sorted(chr(char) for char in invalid))
+            result.add('invalid_characters', header_line, seqid, repr(chars))
+
+    def failed():
+        # with fail_fast, stop at the first error
+        return fail_fast and result.has_errors
+
+    with open_fasta(filename) as fh:
+        for number, line in enumerate(fh, 1):
+            if line.endswith(b"\r\n"):
+                crlf += 1
+            elif line.endswith(b"\n"):
+                lf += 1
+            if line[:1] == b'>':
+                if seqid is not None:
+                    end_record()
+                    if failed():
+                        result.complete = False
+                        break
+                result.records += 1
+                header_line, length = number, 0
+                invalid = set()
+                fields = line[1:].split(None, 1)
+                # CD-HIT takes the ID to be everything up to the first space
+                raw_id = fields[0] if fields and not line[1:2].isspace() else b""
+                seqid = raw_id.decode('utf8', errors='replace')
+                if not raw_id:
+                    result.add('empty_ids', number, None)
+                else:
+                    if b"..." in raw_id or raw_id.translate(None, PRINTABLE):
+                        result.add('mangled_ids', number, seqid)
+                    digest = hashlib.blake2b(raw_id, digest_size=8).digest()
+                    if digest in seen:
+                        result.add('duplicate_ids', number, seqid)
+                    else:
+                        seen.add(digest)
+            else:
+                bases = line.rstrip(b"\r\n")
+                if not bases.strip():
+                    result.add('blank_lines', number, None)
+                    continue
+                if seqid is None:
+                    result.add('before_first_header', number, None)
+                else:
+                    length += len(bases)
+                    bad = bases.translate(None, IUPAC)
+                    if bad:
+                        # white space within a line is dropped, not invalid
+                        not_space = bad.translate(None, b" \t")
+                        invalid.update(not_space)
+                        length -= len(bad) - len(not_space)
+            if failed():
+                result.complete = False
+                break
+        else:
+            if seqid is not None:
+                end_record()
+            if line and not line.endswith(b"\n"):
+                result.add('no_final_newline', number, None)
+    if result.complete and result.records == 0:
+        result.add('no_records', 0, None)
+    if crlf:
+        result.add('mixed_line_endings' if lf else 'crlf_line_endings', 1, None,
+                   f"{crlf} CRLF and {lf} LF lines")
+    return result
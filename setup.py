@@ -29,11 +29,13 @@ setup(
     ],
     packages=find_packages(),
     include_package_data=True,
-    install_requires=["click", "pandas", "sh",
+    install_requires=["click", "pandas",
                       "tabulate>=0.8.2", "markdown_strings"],
     entry_points={
         "console_scripts": [
             "db-check=db_check.__main__:run_db_check",
+            "db-check-batch=db_check.batch:run_batch_check",
+            "db-check-server=db_check.server:run_server",
         ]
     },
 )
@@ -21,3 +21,16 @@ def deploy_patch(ctx):
     ctx.run("twine check dist/*")
     ctx.run("twine upload dist/*")
     ctx.run("git push --tags")
+
+
+@invoke.task
+def benchmark(ctx, sizes="10000,1000000,10000000", baseline=None, output="benchmarks.json"):
+    '''
+    Run the benchmarks on synthetic DBs, optionally comparing the results
+    against those of an earlier run
+    python3 benchmarks/run.py --sizes <sizes> --output <output> [--baseline <baseline>]
+    '''
+    cmd = f"python3 benchmarks/run.py --sizes {sizes} --output {output}"
+    if baseline is not None:
+        cmd += f" --baseline {baseline}"
+    ctx.run(cmd)
@@ -0,0 +1,68 @@
+'''
+Tests for the Python API
+'''
+
+import pathlib
+
+import pytest
+
+import db_check
+from db_check.api import *
+from db_check.validation import InvalidFasta
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+def test_lazy_import():
+    '''
+    Make sure the API is available from the package
+    '''
+    assert db_check.check is check
+    with pytest.raises(AttributeError):
+        db_check.nothing
+
+
+def test_check(capsys):
+    '''
+    Make sure nothing is printed, and the findings match the issues
+    '''
+    result = check(EXAMPLE, author="test", engine="native", regex=".*~~(.*)")
+    captured = capsys.readouterr()
+    assert captured.out == captured.err == ""
+    assert not result.ok
+    duplicates = list(result.duplicate_ids())
+    assert [finding.key for finding in duplicates] == ["seq6~~catD"]
+    assert duplicates[0].records.shape[0] == 2
+    conflicts = list(result.category_conflicts())
+    assert conflicts and all(finding.blocking for finding in conflicts)
+    assert all(finding.records.category.nunique() > 1 for finding in conflicts)
+    overlaps = list(result.overlapping_sequences())
+    assert all(finding.records.clusterid.nunique() == 1 for finding in overlaps)
+    assert not any(finding.blocking for finding in overlaps)
+    assert list(result.near_duplicates()) == []
+    kinds = [finding.kind for finding in result.findings()]
+    assert kinds[0].startswith("fasta_")
+    assert result.first_blocking().kind == 'duplicate_id'
+
+
+def test_check_blocking():
+    '''
+    Make sure the kinds of blocking findings can be chosen
+    '''
+    result = check(EXAMPLE, author="test", engine="native", validate="off",
+                   blocking=('overlapping_sequences',))
+    assert result.first_blocking().kind == 'overlapping_sequences'
+    assert list(result.category_conflicts()) == []
+
+
+def test_check_many(tmp_path):
+    '''
+    Make sure DBs are checked lazily, one at a time
+    '''
+    bad = tmp_path / "bad.fasta"
+    bad.write_bytes(b">a\nAC*GTACGTACGT\n")
+    results = check_many([EXAMPLE, bad], author="test", engine="native")
+    assert next(results).first_blocking() is not None
+    with pytest.raises(InvalidFasta):
+        next(results)
@@ -0,0 +1,77 @@
+'''
+Tests for the batch mode
+'''
+
+import subprocess
+
+import pytest
+
+pytest.importorskip("markdown_strings")
+
+from db_check.batch import *  # noqa: E402
+
+
+def test_find_fasta(tmp_path):
+    '''
+    Make sure only FASTA files are picked up from directories
+    '''
+    for name in ["locA.fasta", "locB.fa", "notes.txt"]:
+        (tmp_path / name).write_text(">seq1\nACGT\n")
+    assert [f.name for f in find_fasta([tmp_path])] == ["locA.fasta", "locB.fa"]
+    assert [f.name for f in find_fasta([str(tmp_path / "*.fa")])] == ["locB.fa"]
+
+
+@pytest.mark.parametrize("threads, workers, n_jobs, expected", [
+    (8, 8, 100, (8, 1)),
+    (8, 2, 100, (2, 4)),
+    (8, 8, 2, (2, 4)),
+    (1, 4, 100, (4, 1))]
+)
+def test_balance_threads(threads, workers, n_jobs, expected):
+    '''
+    Make sure CD-HIT threads are split between the workers
+    '''
+    assert balance_threads(threads, workers, n_jobs) == expected
+
+
+def test_invalid_locus(tmp_path):
+    '''
+    Make sure a locus failing validation is marked as failed in the summary
+    without losing the other loci
+    '''
+    from click.testing import CliRunner
+    (tmp_path / "locA.fasta").write_text(">a\nACGTACGTACGT\n>b\nACGTACGT\n")
+    (tmp_path / "locB.fasta").write_text(">a\nACGTACGTACGT\n>b\n")
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    result = CliRunner().invoke(run_batch_check, [
+        "--engine", "native", "--no-cache", "--threads", "1", "-o", "tsv",
+        "--outdir", str(outdir), str(tmp_path)])
+    assert result.exit_code == 1
+    summary = (outdir / "db-check.batch_summary.tsv").read_text().splitlines()
+    assert [line.split("\t")[0] for line in summary[1:]] == ["locA", "locB"]
+    assert summary[-1].endswith("Failed: invalid FASTA")
+    assert (outdir / "db-check_locA.clusters.tsv").exists()
+
+
+def test_db_names(tmp_path):
+    '''
+    Make sure DBs of the same name in different directories get distinct
+    names
+    '''
+    files = [tmp_path / "a" / "locus.fasta", tmp_path / "b" / "locus.fasta.gz",
+             tmp_path / "b" / "other.fa", tmp_path / "b" / "other.fasta"]
+    assert db_names(files) == ["a_locus", "b_locus", "b_other", "b_other_2"]
+    assert db_names(files[:1]) == ["locus"]
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (subprocess.CalledProcessError(1, ["cd-hit-est"]), "CD-HIT failed"),
+    (TimeoutError("CD-HIT took more than 1s"), "timed out"),
+    (MemoryError(), "MemoryError: ")]
+)
+def test_failure(exc, expected):
+    '''
+    Make sure the reason a DB could not be checked is recorded
+    '''
+    assert failure(exc) == expected
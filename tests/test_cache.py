@@ -0,0 +1,87 @@
+'''
+Tests for caching cluster tables between runs
+'''
+
+import os
+import pathlib
+import shutil
+import time
+
+import pandas as pd
+
+import db_check.pipeline
+from db_check.cache import *
+from db_check.native import cluster_db_native
+from db_check.parsers import parse_categories
+from db_check.pipeline import check_db
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+def test_save_table(tmp_path):
+    '''
+    Make sure tables come back as they were saved
+    '''
+    tab = parse_categories(cluster_db_native(EXAMPLE), delimiter="~~", field=-1)
+    tab['note'] = pd.Series(["a|b"] * tab.shape[0], dtype=object)
+    filename = tmp_path / "table.npz"
+    save_table(tab, filename)
+    loaded = load_table(filename)
+    pd.testing.assert_frame_equal(loaded, tab)
+
+
+def test_cache_key(tmp_path):
+    '''
+    Make sure the key changes with the content of the DB and the parameters,
+    and only with those
+    '''
+    fasta = tmp_path / "db.fasta"
+    shutil.copyfile(EXAMPLE, fasta)
+    key = cache_key(fasta, engine="native")
+    assert cache_key(fasta, engine="native") == key
+    assert cache_key(fasta, engine="cdhit") != key
+    os.utime(fasta, (0, 0))
+    assert cache_key(fasta, engine="native") == key
+    with open(fasta, 'a') as fh:
+        fh.write("\n>seq9\nACGTACGTACGT\n")
+    assert cache_key(fasta, engine="native") != key
+
+
+def test_eviction(tmp_path):
+    '''
+    Make sure old entries, and then the least recently used ones, are
+    evicted
+    '''
+    tab = cluster_db_native(EXAMPLE)
+    cache = ClusterCache(tmp_path, max_size_mb=1, max_age_days=1)
+    for key in "abc":
+        cache.put(key, tab)
+    now = time.time()
+    os.utime(cache.path("a"), (now - 2 * 86400, now - 2 * 86400))
+    os.utime(cache.path("b"), (now - 60, now - 60))
+    assert cache.evict() == 1
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    cache.max_size_mb = cache.path("b").stat().st_size * 1.5 / 2**20
+    assert cache.evict() == 1
+    # b was used last
+    assert cache.get("b") is not None
+    assert cache.get("c") is None
+
+
+def test_check_db_cache(tmp_path, monkeypatch):
+    '''
+    Make sure a DB checked before is not clustered again, whatever the
+    categories
+    '''
+    cache = ClusterCache(tmp_path / "cache")
+    first = check_db(EXAMPLE, "test", engine="native", cache=cache)
+
+    def cluster_again(*args, **kwargs):
+        raise AssertionError("clustered again")
+
+    monkeypatch.setattr(db_check.pipeline, "cluster_db_native", cluster_again)
+    second = check_db(EXAMPLE, "test", engine="native", regex=".*~~(.*)", cache=cache)
+    pd.testing.assert_frame_equal(second.df.drop(columns='category'), first.df)
+    assert second.n_unique_categories == 5
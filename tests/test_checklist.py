@@ -0,0 +1,119 @@
+'''
+Tests for the checks
+'''
+
+import pathlib
+import threading
+import time
+
+import pytest
+
+from db_check.checklist import *
+from db_check.native import cluster_db_native
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.fixture
+def registry():
+    '''
+    Restore the registered checks after a test
+    '''
+    saved = dict(CHECKS)
+    yield CHECKS
+    CHECKS.clear()
+    CHECKS.update(saved)
+
+
+def test_ticks(registry):
+    '''
+    Make sure checks are skipped, time-boxed and recorded, and that their
+    issues keep the order they were registered in
+    '''
+    @register_check("slow", timeout=0.2)
+    def slow(obj):
+        time.sleep(1)
+        return "Too slow."
+
+    @register_check("needs_fasta", requires=('fasta',))
+    def needs_fasta(obj):
+        return "Should not run."
+
+    @register_check()
+    def broken(obj):
+        raise ValueError("oops")
+
+    checklist = DBChecklist(cluster_db_native(EXAMPLE),
+                            author="tester", db_name="example")
+    checklist.ticks(skip=("overlapping_seqs",))
+    results = checklist.check_results
+    assert checklist.issues == ['More than one sequence with same ID.']
+    assert results['duplicates']['status'] == 'issue'
+    assert results['overlapping_seqs']['status'] == 'skipped'
+    assert results['overlapping_seqs_distinct_categories']['status'] == 'skipped'
+    assert results['slow']['status'] == 'timed out'
+    assert results['needs_fasta']['status'] == 'skipped'
+    assert results['broken']['status'] == 'failed'
+
+
+def test_ticks_abandoned(registry):
+    '''
+    Make sure checks given up on run on daemon threads, so they do not keep
+    the interpreter from exiting, and that checks are timed from their own
+    start, not from the first check's
+    '''
+    @register_check("sleepy", timeout=0.1)
+    def sleepy(obj):
+        time.sleep(2)
+
+    @register_check("late")
+    def late(obj):
+        raise ValueError("oops")
+
+    checklist = DBChecklist(cluster_db_native(EXAMPLE),
+                            author="tester", db_name="example")
+    checklist.ticks(workers=1)
+    results = checklist.check_results
+    assert results['sleepy']['status'] == 'timed out'
+    assert results['late']['status'] == 'failed'
+    assert results['late']['seconds'] < 0.1
+    abandoned = [thread for thread in threading.enumerate()
+                 if thread.name == "check-sleepy"]
+    assert abandoned and all(thread.daemon for thread in abandoned)
+
+
+def test_legacy_checks():
+    '''
+    Make sure _check methods of subclasses are still run
+    '''
+    class Checklist(DBChecklist):
+        def _check_always(self):
+            self.issues.append("Always.")
+
+    checklist = Checklist(cluster_db_native(EXAMPLE),
+                          author="tester", db_name="example")
+    checklist.ticks()
+    assert checklist.issues[-1] == "Always."
+    assert checklist.check_results['_check_always']['issue'] == "Always."
+
+
+def test_quiet_threads(registry, capsys):
+    '''
+    Make sure quiet only silences the thread it is used in, and the checks
+    it runs
+    '''
+    @register_check("chatty")
+    def chatty(obj):
+        info("Checking...")
+
+    checklist = DBChecklist(cluster_db_native(EXAMPLE),
+                            author="tester", db_name="example")
+    with quiet():
+        other = threading.Thread(target=info, args=("From another thread",))
+        other.start()
+        other.join()
+        checklist.ticks()
+    err = capsys.readouterr().err
+    assert "From another thread" in err
+    assert "Checking..." not in err
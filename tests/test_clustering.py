@@ -0,0 +1,147 @@
+'''
+Tests for the clustering
+'''
+
+import gzip
+import os
+import pathlib
+import subprocess
+
+import pytest
+
+from db_check.clustering import *
+from db_check.parsers import parse_clustering
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+def test_collapse_identical(tmp_path):
+    '''
+    Make sure only one of each identical sequence is written out
+    '''
+    collapsed = tmp_path / "collapsed.fasta"
+    members = collapse_identical(EXAMPLE, collapsed)
+    assert members.rep.tolist() == [0, 0, 1, 2, 2, 3, 4, 5]
+    assert collapsed.read_text().count(">") == 6
+
+
+def test_expand_clustering(tmp_path):
+    '''
+    Make sure all the records come back after clustering the collapsed DB
+    '''
+    members = collapse_identical(EXAMPLE, tmp_path / "collapsed.fasta")
+    clstr = tmp_path / "cdhit.clstr"
+    clstr.write_text(">Cluster 0\n"
+                     "0\t20nt, >0... *\n"
+                     "1\t15nt, >1... at +/100.00%\n"
+                     ">Cluster 1\n"
+                     "0\t20nt, >2... *\n"
+                     ">Cluster 2\n"
+                     "0\t20nt, >3... *\n"
+                     ">Cluster 3\n"
+                     "0\t20nt, >4... *\n"
+                     ">Cluster 4\n"
+                     "0\t20nt, >5... *\n")
+    tab = expand_clustering(parse_clustering(clstr), members)
+    assert list(tab.columns) == ['clusterid', 'seqid',
+                                 'length', 'is_centroid', 'match']
+    assert tab.seqid.tolist()[:5] == ['seq1~~catA', 'seq2~~catB',
+                                      'seq3~~catA', 'seq4~~catC', 'seq5~~catC']
+    assert tab.clusterid.tolist() == [0, 0, 0, 1, 1, 2, 3, 4]
+    assert tab.is_centroid.tolist() == [True, False, False,
+                                        True, False, True, True, True]
+    assert tab.length.tolist() == [20, 20, 15, 20, 20, 20, 20, 20]
+
+
+def test_expand_clstr(tmp_path):
+    '''
+    Make sure the clustering file of the collapsed DB is written back with
+    the records' own IDs and strands, in the order of the DB
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(">a\nAACCGGTTAC\n>b\nCCGGTTA\n>c\nAACCGGTTAC\n>d\nGTAACCGGTT\n")
+    members = collapse_identical(fasta, tmp_path / "collapsed.fasta")
+    assert members.rep.tolist() == [0, 1, 0, 0]
+    clstr = tmp_path / "cdhit.clstr"
+    clstr.write_text(">Cluster 0\n"
+                     "0\t10nt, >0... *\n"
+                     "1\t7nt, >1... at +/100.00%\n")
+    expand_clstr(clstr, members, tmp_path / "expanded.clstr")
+    assert (tmp_path / "expanded.clstr").read_text() == (
+        ">Cluster 0\n"
+        "0\t10nt, >a... *\n"
+        "1\t7nt, >b... at +/100.00%\n"
+        "2\t10nt, >c... at +/100.00%\n"
+        "3\t10nt, >d... at -/100.00%\n")
+    tab = expand_clustering(parse_clustering(clstr), members)
+    expanded = parse_clustering(tmp_path / "expanded.clstr")
+    assert tab.seqid.tolist() == expanded.seqid.tolist() == ["a", "b", "c", "d"]
+    assert tab.is_centroid.tolist() == expanded.is_centroid.tolist()
+
+
+@pytest.fixture
+def fake_cdhit(tmp_path, monkeypatch):
+    '''
+    Put a cd-hit-est on the PATH that runs the shell code given in
+    $FAKE_CDHIT
+    '''
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    script = bindir / "cd-hit-est"
+    script.write_text('#!/bin/sh\neval "$FAKE_CDHIT"\n')
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}:{os.environ['PATH']}")
+    return lambda code: monkeypatch.setenv("FAKE_CDHIT", code)
+
+
+def test_run_cdhit(fake_cdhit, capsys):
+    '''
+    Make sure the output is streamed, and failures and timeouts raise
+    '''
+    fake_cdhit('echo "1000 finished"; echo "$@"')
+    run_cdhit(['-i', 'db.fasta', '-M', 100])
+    assert "-i db.fasta -M 100" in capsys.readouterr().err
+    fake_cdhit('echo "Fatal Error: not enough memory"; exit 1')
+    with pytest.raises(subprocess.CalledProcessError):
+        run_cdhit([])
+    assert "not enough memory" in capsys.readouterr().err
+    fake_cdhit('sleep 10')
+    with pytest.raises(TimeoutError):
+        run_cdhit([], timeout=0.2)
+
+
+def test_cluster_db_cleans_up(fake_cdhit, tmp_path):
+    '''
+    Make sure the work dir is removed when CD-HIT fails
+    '''
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+    fake_cdhit('exit 1')
+    with pytest.raises(subprocess.CalledProcessError):
+        cluster_db(EXAMPLE, "cdhit", threads=1, memory=0, workdir=workdir)
+    assert list(workdir.iterdir()) == []
+
+
+def test_auto_resources():
+    '''
+    Make sure explicit values are kept, and others are filled in
+    '''
+    assert auto_resources(3, 0) == (3, 0)
+    threads, memory = auto_resources(share=2)
+    assert threads >= 1 and memory >= 0
+
+
+def test_cluster_db_compressed(fake_cdhit, tmp_path, capsys):
+    '''
+    Make sure CD-HIT is given an uncompressed DB
+    '''
+    fasta = tmp_path / "example_db.fasta.gz"
+    fasta.write_bytes(gzip.compress(EXAMPLE.read_bytes()))
+    fake_cdhit('head -n 1 "$2"')
+    for collapse in (True, False):
+        _, tmpdir, _ = cluster_db(fasta, "cdhit", threads=1, memory=0,
+                                  collapse=collapse)
+        tmpdir.cleanup()
+    err = capsys.readouterr().err
+    assert ">0" in err and ">seq1~~catA" in err
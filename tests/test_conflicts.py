@@ -0,0 +1,82 @@
+'''
+Tests for the graph of categories tangled together by overlapping sequences
+'''
+
+import numpy as np
+import pandas as pd
+
+from db_check.conflicts import *
+
+
+def cluster_table(clusters):
+    '''
+    A cluster table from a list of the categories of each cluster
+    '''
+    rows = [(clusterid, category) for clusterid, categories in enumerate(clusters)
+            for category in categories]
+    return pd.DataFrame(rows, columns=['clusterid', 'category'])
+
+
+def test_conflict_graph():
+    '''
+    Make sure chains of clusters end up in the same component, with the
+    category in the most clusters as root
+    '''
+    tab = cluster_table([["A", "B"], ["B", "C", "C"], ["D", "E"], ["F", "F"], ["G"],
+                         ["E", None, "D"], ["C", "H"], ["I", "C"]])
+    graph = conflict_graph(tab, tab.groupby('clusterid').category.nunique())
+    result = graph.table()
+    assert result.to_dict('list') == {
+        'component': [1, 2],
+        'root': ["C", "D"],
+        'n_categories': [5, 2],
+        'n_clusters': [4, 2],
+        'n_sequences': [9, 4],
+        'categories': ["A, B, C, H, I", "D, E"],
+        'clusters': ["0, 1, 6, 7", "2, 5"]}
+    assert graph.table() is result
+    assert graph.component_of("A") == graph.component_of("H") == 1
+    assert graph.component_of("F") is None
+    assert graph.category_clusters["C"] == [1, 6, 7]
+    assert graph.cluster_categories[1] == ["B", "C"]
+
+
+def test_conflict_graph_random():
+    '''
+    Make sure the components match those found by walking the graph
+    '''
+    rng = np.random.default_rng(0)
+    clusters = [[f"c{c}" for c in rng.integers(0, 300, size=rng.integers(2, 4))]
+                for _ in range(200)]
+    tab = cluster_table(clusters)
+    graph = conflict_graph(tab, tab.groupby('clusterid').category.nunique())
+    neighbours = {}
+    for categories in clusters:
+        if len(set(categories)) > 1:
+            for category in categories:
+                neighbours.setdefault(category, set()).update(categories)
+    expected = set()
+    seen = set()
+    for start in neighbours:
+        if start in seen:
+            continue
+        component, todo = set(), [start]
+        while todo:
+            category = todo.pop()
+            if category not in component:
+                component.add(category)
+                todo.extend(neighbours[category] - component)
+        seen |= component
+        expected.add(frozenset(component))
+    found = {frozenset(categories.split(", ")) for categories in graph.table().categories}
+    assert found == expected
+
+
+def test_conflict_graph_empty():
+    '''
+    Make sure a DB without conflicts has no components
+    '''
+    tab = cluster_table([["A"], ["B", "B"]])
+    graph = conflict_graph(tab, tab.groupby('clusterid').category.nunique())
+    assert graph.table().empty
+    assert graph.component_of("A") is None
@@ -0,0 +1,27 @@
+'''
+Tests for the dependency checks
+'''
+
+import os
+
+from db_check.dependencies import *
+
+
+def test_tool_version(tmp_path, monkeypatch):
+    '''
+    Make sure the version is probed once, and again when the binary changes
+    '''
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    tool = tmp_path / "cd-hit-est"
+    calls = tmp_path / "calls"
+    tool.write_text(f'#!/bin/sh\necho x >> {calls}\necho "CD-HIT version 4.8 (built on Jan 1 2020)"\nexit 1\n')
+    tool.chmod(0o755)
+    assert tool_version(tool) == "4.8"
+    assert tool_version(tool) == "4.8"
+    assert calls.read_text().count("x") == 1
+    tool.write_text(tool.read_text().replace("4.8", "4.6"))
+    stat = tool.stat()
+    os.utime(tool, (stat.st_atime, stat.st_mtime + 10))
+    assert tool_version(tool) == "4.6"
+    assert calls.read_text().count("x") == 2
+    assert (tmp_path / "cache" / "db-check" / "tools.json").exists()
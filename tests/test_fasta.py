@@ -0,0 +1,77 @@
+'''
+Tests for reading FASTA DBs
+'''
+
+import bz2
+import gzip
+import lzma
+import os
+import pathlib
+import pickle
+
+import pytest
+
+from db_check.fasta import *
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.mark.parametrize("suffix, compress", [
+    (".gz", gzip.compress),
+    (".bz2", bz2.compress),
+    (".xz", lzma.compress),
+    ("", lambda data: data)]
+)
+def test_compressed_fasta(tmp_path, suffix, compress):
+    '''
+    Make sure compressed DBs are read like uncompressed ones
+    '''
+    fasta = tmp_path / f"example_db.fasta{suffix}"
+    fasta.write_bytes(compress(EXAMPLE.read_bytes()))
+    assert list(iter_fasta(fasta)) == list(iter_fasta(EXAMPLE))
+    assert fasta_name(fasta) == "example_db"
+    assert is_plain_file(fasta) == (suffix == "")
+
+
+def test_indexed_fasta(tmp_path):
+    '''
+    Make sure records are fetched by seqid whatever the line lengths, and
+    that a stale index is rebuilt
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">seq1 desc\nACGT\nac\n>seq2\r\nGGNN\r\n>seq1\nTTTT\n>empty\n")
+    expected = dict(iter_fasta(fasta))
+    with IndexedFasta(fasta) as db:
+        assert len(db) == 4
+        assert index_path(fasta).exists()
+        assert db.fetch("seq1") == b"ACGTAC"
+        assert db.fetch("seq2") == expected["seq2"]
+        assert db.fetch_all("seq1") == [b"ACGTAC", b"TTTT"]
+        assert db.fetch("empty") == b""
+        assert "seq3" not in db
+        assert sequence_stats(db, ["seq1", "seq2", "seq3"]) == {"seq2": (1.0, 2)}
+        assert pickle.loads(pickle.dumps(db)).fetch("seq2") == b"GGNN"
+    fasta.write_bytes(b">seq3\nAAAA\n")
+    stat = index_path(fasta).stat()
+    os.utime(fasta, (stat.st_atime + 10, stat.st_mtime + 10))
+    with IndexedFasta(fasta) as db:
+        assert db.fetch("seq3") == b"AAAA"
+    # a copy older than the index, as with cp -p or a tarball
+    fasta.write_bytes(b">seq4\nCCCCCC\n")
+    os.utime(fasta, (stat.st_atime - 1000, stat.st_mtime - 1000))
+    with IndexedFasta(fasta) as db:
+        assert db.fetch("seq4") == b"CCCCCC"
+
+
+def test_index_not_saved(tmp_path, monkeypatch, capsys):
+    '''
+    Make sure a DB is indexed in memory if the index can not be saved
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">seq1\nACGT\n")
+    monkeypatch.setattr("db_check.fasta.index_path",
+                        lambda filename: tmp_path / "read-only" / "db.fasta.dbcheck.fai")
+    with IndexedFasta(fasta) as db:
+        assert db.fetch("seq1") == b"ACGT"
+    assert "keeping it in memory" in capsys.readouterr().err
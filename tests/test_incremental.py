@@ -0,0 +1,85 @@
+'''
+Tests for the incremental re-check
+'''
+
+import pathlib
+import random
+
+import pytest
+
+from db_check.incremental import *
+from db_check.native import cluster_db_native, reverse_complement
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+def test_write_manifest(tmp_path):
+    '''
+    Make sure repeated IDs get an empty digest in the manifest
+    '''
+    manifest = tmp_path / "manifest.tsv"
+    write_manifest(cluster_db_native(EXAMPLE), EXAMPLE, manifest)
+    tab = read_manifest(manifest)
+    assert tab.shape[0] == 8
+    assert (tab.digest == "").sum() == 2
+    assert tab.digest[tab.seqid == 'seq1~~catA'].tolist() == \
+        tab.digest[tab.seqid == 'seq2~~catB'].tolist()
+    index = read_seed_index(seed_index_file(manifest))
+    assert index['digest'].shape == (6, 16)
+    assert (index['sample_hash'][1:] >= index['sample_hash'][:-1]).all()
+
+
+def test_cluster_db_incremental(tmp_path):
+    '''
+    Make sure a re-check against a manifest matches a full run
+    '''
+    manifest = tmp_path / "manifest.tsv"
+    write_manifest(cluster_db_native(EXAMPLE), EXAMPLE, manifest)
+    release = tmp_path / "release.fasta"
+    release.write_text(EXAMPLE.read_text().replace(
+        ">seq1~~catA", ">seq0~~catF\nGGAACCTTCATACAGATCTAGAGG\n>seq1~~catA"))
+    full = cluster_db_native(release)
+    incremental = cluster_db_incremental(release, manifest)
+    assert incremental.equals(full)
+    seq0 = incremental[incremental.seqid == 'seq0~~catF'].iloc[0]
+    assert seq0.is_centroid
+    assert (incremental.clusterid == seq0.clusterid).sum() == 4
+
+
+@pytest.mark.parametrize("seeds", [True, False])
+def test_cluster_db_incremental_seed_index(tmp_path, monkeypatch, seeds):
+    '''
+    Make sure a re-check through the seed index, or without it, matches a
+    full run, and with it only the few sequences re-checked are scanned
+    '''
+    random.seed(2)
+
+    def random_seq(length):
+        return "".join(random.choice("ACGT") for _ in range(length))
+
+    def write(fasta, records):
+        fasta.write_text("".join(f">{seqid}\n{seq}\n" for seqid, seq in records))
+    seqs = [random_seq(random.randint(40, 300)) for _ in range(60)]
+    records = [(f"r{i}", seq) for i, seq in enumerate(seqs)] + \
+        [(f"p{i}", seq[5:45]) for i, seq in enumerate(seqs[::3])]
+    release1, release2 = tmp_path / "release1.fasta", tmp_path / "release2.fasta"
+    write(release1, records)
+    manifest = tmp_path / "manifest.tsv"
+    write_manifest(cluster_db_native(release1), release1, manifest)
+    if not seeds:
+        pathlib.Path(seed_index_file(manifest)).unlink()
+    new = [("n0", random_seq(5) + seqs[0] + random_seq(5)),
+           ("n1", reverse_complement(seqs[1][10:80].encode()).decode()),
+           ("n2", seqs[2][3:40]), ("n3", random_seq(100))]
+    write(release2, records[5:] + new)
+    scanned = []
+    search = find_containments
+
+    def counted(seqs, patterns=None, texts=None, **kwargs):
+        scanned.append(len(seqs) if texts is None else len(texts))
+        return search(seqs, patterns=patterns, texts=texts, **kwargs)
+    monkeypatch.setattr("db_check.incremental.find_containments", counted)
+    full = cluster_db_native(release2)
+    assert cluster_db_incremental(release2, manifest).equals(full)
+    assert max(scanned) < 10 if seeds else max(scanned) > 60
@@ -0,0 +1,129 @@
+'''
+Tests for the native clustering engine
+'''
+
+import pathlib
+import random
+
+import pytest
+
+import db_check.native
+from db_check.native import *
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.mark.parametrize("seq, rc", [
+    (b"AACG", b"CGTT"),
+    (b"ACGT", b"ACGT"),
+    (b"AANTG", b"CANTT")]
+)
+def test_canonical_hash(seq, rc):
+    '''
+    Make sure a sequence and its reverse complement share a digest
+    '''
+    assert reverse_complement(seq) == rc
+    assert canonical_hash(seq)[0] == canonical_hash(rc)[0]
+
+
+@pytest.mark.parametrize("seqs, expected", [
+    ([b"AACCTTCA", b"CCTT"], [(1, 0, 2, '+')]),
+    ([b"AACCTTCA", b"TGAAG"], [(1, 0, 3, '-')]),
+    ([b"AACCTTCA", b"GGGG"], [])]
+)
+def test_find_containments(seqs, expected):
+    '''
+    Make sure contained sequences are found on both strands
+    '''
+    assert find_containments(seqs) == expected
+
+
+def test_find_containments_many_lengths():
+    '''
+    Make sure sequences of many distinct lengths, some shorter than the
+    seed, are all found where they are, as a plain search finds them
+    '''
+    random.seed(0)
+    text = bytes(random.choice(b"ACGT") for _ in range(600))
+    seqs = {text}
+    for length in range(1, 400, 3):
+        start = random.randrange(len(text) - length)
+        seq = text[start:start + length]
+        seqs.add(seq if length % 2 else reverse_complement(seq))
+    seqs = sorted(seqs, key=lambda s: -len(s))
+    expected = []
+    for i, seq in enumerate(seqs):
+        for j, other in enumerate(seqs):
+            for strand, strands in (('+', other), ('-', reverse_complement(other))):
+                offset = strands.find(seq)
+                while i != j and offset >= 0:
+                    expected.append((i, j, offset if strand == '+' else
+                                     len(other) - offset - len(seq), strand))
+                    offset = strands.find(seq, offset + 1)
+    for batch_size in (500, BATCH_SIZE):
+        assert find_containments(seqs, batch_size=batch_size) == sorted(expected, key=lambda hit: (hit[0], hit[1], hit[3], hit[2]))
+
+
+def test_cluster_db_native():
+    '''
+    Make sure identical and contained sequences are clustered together
+    '''
+    tab = cluster_db_native(EXAMPLE)
+    assert list(tab.columns) == ['clusterid', 'seqid', 'length',
+                                 'is_centroid', 'match', 'offset', 'strand']
+    assert tab.shape[0] == 8
+    clusters = tab.groupby('clusterid')['seqid'].apply(tuple).tolist()
+    assert ('seq1~~catA', 'seq2~~catB', 'seq3~~catA') in clusters
+    assert ('seq4~~catC', 'seq5~~catC') in clusters
+    assert tab.is_centroid.sum() == tab.clusterid.nunique()
+    seq3 = tab[tab.seqid == 'seq3~~catA'].iloc[0]
+    assert (seq3.offset, seq3.strand) == (2, '+')
+
+
+def test_cluster_db_native_many_lengths(tmp_path, monkeypatch):
+    '''
+    Make sure a DB with hundreds of distinct lengths is scanned once per
+    strand, not once per length, and contained sequences are still found
+    '''
+    random.seed(1)
+    seqs = [bytes(random.choice(b"ACGT") for _ in range(random.randint(300, 900)))
+            for _ in range(500)]
+    fasta = tmp_path / "db.fasta"
+    with open(fasta, "wb") as fh:
+        for i, seq in enumerate(seqs):
+            fh.write(b">long%d\n%s\n>part%d\n%s\n" % (
+                i, seq, i, reverse_complement(seq[i % 50:i % 50 + 100 + i % 150])))
+    scans = []
+    seed_matches = db_check.native._seed_matches
+
+    def counted(*args, **kwargs):
+        scans.append(args[3])
+        return seed_matches(*args, **kwargs)
+    monkeypatch.setattr("db_check.native._seed_matches", counted)
+    tab = cluster_db_native(fasta)
+    assert scans == [SEED_LENGTH, SEED_LENGTH]
+    assert tab.clusterid.nunique() == len(seqs)
+    parts = tab[tab.seqid.str.startswith("part")]
+    assert (parts.strand == '-').all() and not parts.is_centroid.any()
+    assert cluster_db_native(fasta, containment=False).clusterid.nunique() == 2 * len(seqs)
+
+
+def test_cluster_db_native_identical_only():
+    '''
+    Make sure contained sequences are kept apart without containment
+    '''
+    tab = cluster_db_native(EXAMPLE, containment=False)
+    assert tab.clusterid.nunique() == 6
+
+
+def test_cluster_db_native_empty_record(tmp_path):
+    '''
+    Make sure an empty record, which sorts last, does not break the search
+    for contained sequences
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">a\nAACCTTCATACAG\n>b\nCCTTCA\n>c\n\n")
+    tab = cluster_db_native(fasta)
+    assert tab.shape[0] == 3
+    assert tab[tab.seqid.isin(['a', 'b'])].clusterid.nunique() == 1
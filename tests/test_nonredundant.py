@@ -0,0 +1,82 @@
+'''
+Tests for writing a non-redundant DB
+'''
+
+import gzip
+import pathlib
+
+import pandas as pd
+import pytest
+
+from db_check.fasta import iter_fasta
+from db_check.native import cluster_db_native
+from db_check.nonredundant import *
+from db_check.parsers import parse_categories
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.fixture(scope="module")
+def clusters():
+    return parse_categories(cluster_db_native(EXAMPLE), regex=".*~~(.*)")
+
+
+@pytest.mark.parametrize("policy, kept", [
+    ("centroid", ["seq1~~catA", "seq4~~catC", "seq6~~catD", "seq7~~catE"]),
+    ("longest", ["seq1~~catA", "seq4~~catC", "seq6~~catD", "seq7~~catE"]),
+    ("category", ["seq1~~catA", "seq2~~catB", "seq4~~catC", "seq6~~catD", "seq7~~catE"])]
+)
+def test_write_nonredundant(tmp_path, clusters, policy, kept):
+    '''
+    Make sure the records kept are copied as they are, and the others are
+    mapped to the record kept in their place
+    '''
+    output = tmp_path / "nr.fasta.gz"
+    mapping = tmp_path / "nr.map.tsv"
+    n_written, n_dropped = write_nonredundant(EXAMPLE, clusters, output, mapping, policy=policy)
+    records = list(iter_fasta(output))
+    assert [seqid for seqid, _ in records] == kept
+    assert n_written == len(kept) and n_dropped == 8 - len(kept)
+    assert gzip.decompress(output.read_bytes()).startswith(
+        b">seq1~~catA Same as seq2 but different category\nAACCTTCATACAGATCTAGA\n")
+    dropped = pd.read_csv(mapping, sep='\t')
+    assert list(dropped.columns) == MAP_COLUMNS
+    reasons = dict(zip(dropped.dropped, dropped.reason))
+    assert reasons["seq3~~catA"] == "contained"
+    assert reasons["seq5~~catC"] == "identical"
+    assert reasons["seq6~~catD"] == "duplicate_id"
+    assert set(dropped.retained) <= set(kept)
+
+
+def test_representatives_longest():
+    '''
+    Make sure the longest sequence is kept over a shorter centroid
+    '''
+    tab = pd.DataFrame({'clusterid': [0, 0, 0], 'seqid': ['a', 'b', 'c'],
+                        'length': [10, 12, 12], 'is_centroid': [True, False, False]})
+    assert representatives(tab, "centroid").representative.tolist() == ['a'] * 3
+    assert representatives(tab, "longest").representative.tolist() == ['b'] * 3
+    with pytest.raises(ValueError):
+        representatives(tab, "category")
+
+
+def test_write_nonredundant_duplicate_ids(tmp_path, capsys):
+    '''
+    Make sure the record chosen is written even if an earlier record has
+    its ID, and that distinct records sharing an ID are warned about
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(">x\nCCTTCATACAG\n>y\nAACCTTCATACAGATCTAGA\n>x\nGGGGTTTTAAAACCCC\n"
+                     ">z\nTTTTTTTTGGGGGGGGAAA\n>z\nCCCCCCCCAAAAAAAATTT\n")
+    output = tmp_path / "nr.fasta"
+    mapping = tmp_path / "nr.map.tsv"
+    n_written, n_dropped = write_nonredundant(fasta, cluster_db_native(fasta), output, mapping)
+    assert list(iter_fasta(output)) == [("y", b"AACCTTCATACAGATCTAGA"),
+                                        ("x", b"GGGGTTTTAAAACCCC"),
+                                        ("z", b"TTTTTTTTGGGGGGGGAAA")]
+    assert (n_written, n_dropped) == (3, 2)
+    dropped = pd.read_csv(mapping, sep='\t')
+    assert dropped[['dropped', 'retained', 'reason']].values.tolist() == [
+        ["x", "y", "contained"], ["z", "z", "duplicate_id"]]
+    assert "Left out 1 records with the ID of a record already written" in capsys.readouterr().err
@@ -0,0 +1,38 @@
+'''
+Tests for the machine readable outputs
+'''
+
+import json
+import pathlib
+
+import pandas as pd
+
+from db_check.checklist import DBChecklist
+from db_check.native import cluster_db_native
+from db_check.outputs import *
+from db_check.parsers import parse_categories
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+def test_write_outputs(tmp_path):
+    '''
+    Make sure the tables and the JSON summary are written
+    '''
+    tab = parse_categories(cluster_db_native(EXAMPLE), regex=".*~~(.*)")
+    checklist = DBChecklist(tab, author="tester", db_name="example")
+    checklist.ticks()
+    written = write_outputs(checklist, ["tsv", "json"], outdir=tmp_path)
+    assert len(written) == 8
+    clusters = pd.read_csv(tmp_path / "db-check.clusters.tsv", sep='\t')
+    assert clusters.shape[0] == 8
+    conflicts = pd.read_csv(
+        tmp_path / "db-check.category_conflicts.tsv", sep='\t')
+    assert set(conflicts.category) == {'catA', 'catB'}
+    with open(tmp_path / "db-check.summary.json") as fh:
+        summary = json.load(fh)
+    assert summary['n_duplicated_ids'] == 1
+    assert summary['n_clusters_more_than_one_category'] == 1
+    assert summary['n_conflict_components'] == 1
+    assert len(summary['issues']) == 3
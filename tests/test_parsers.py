@@ -4,6 +4,7 @@ Tests for the parsers
 
 from collections import OrderedDict
 
+import pandas as pd
 import pytest
 
 from db_check.parsers import *
@@ -19,12 +20,71 @@ def test_parse_cluster_id():
 
 @pytest.mark.parametrize("test_input, expected", [
     ("0       1269nt, > 71|z4,z32... *",
-     OrderedDict([('clusterid', '580'), ('seqid', ' 71\\|z4,z32'), ('length', '1269'), ('is_centroid', True), ('match', 1.0)])),
+     OrderedDict([('clusterid', '580'), ('seqid', ' 71|z4,z32'), ('length', '1269'), ('is_centroid', True), ('match', 1.0)])),
     ("1       1269nt, >72|z4,z32... at +/100.00%",
-     OrderedDict([('clusterid', '580'), ('seqid', '72\\|z4,z32'), ('length', '1269'), ('is_centroid', False), ('match', 1.0)]))]
+     OrderedDict([('clusterid', '580'), ('seqid', '72|z4,z32'), ('length', '1269'), ('is_centroid', False), ('match', 1.0)]))]
 )
 def test_cluster_member(test_input, expected):
     '''
     Make sure cluster_member returns correct dictionary
     '''
     assert parse_cluster_member(test_input, "580") == expected
+
+
+def test_parse_clustering(tmp_path):
+    '''
+    Make sure parse_clustering returns typed columns
+    '''
+    clstr = tmp_path / "cdhit.clstr"
+    clstr.write_text(">Cluster 0\n"
+                     "0\t20nt, >seq1|catA... *\n"
+                     "1\t15nt, >seq2|catA... at +/100.00%\n"
+                     ">Cluster 1\n"
+                     "0\t20nt, >seq3|catB... *\n")
+    tab = parse_clustering(clstr)
+    assert tab.clusterid.tolist() == [0, 0, 1]
+    assert tab.seqid.tolist() == ['seq1|catA', 'seq2|catA', 'seq3|catB']
+    assert tab.length.tolist() == [20, 15, 20]
+    assert tab.is_centroid.tolist() == [True, False, True]
+    assert tab.match.tolist() == [1.0, 1.0, 1.0]
+    assert tab.clusterid.dtype == 'int32'
+    assert tab.match.dtype == 'float32'
+    assert tab.seqid.dtype == 'category'
+
+
+@pytest.mark.parametrize("parse_args, expected", [
+    ({'delimiter': '|', 'field': -1}, ['catA', 'catA', 'catB']),
+    ({'regex': r'.*\|(.*)'}, ['catA', 'catA', 'catB']),
+    ({'callback': lambda s: s[:4]}, ['seq1', 'seq2', 'seq3']),
+    ({'callback': batch_callback(lambda ids: [s[-1] for s in ids])}, ['A', 'A', 'B']),
+    ({'callback': 'string:capwords'}, ['Seq1|cata', 'Seq2|cata', 'Seq3|catb']),
+    ({'callback': 'string:capwords', 'workers': 2}, ['Seq1|cata', 'Seq2|cata', 'Seq3|catb']),
+    ({'callback': str.upper, 'key': r'\|(.*)'}, ['CATA', 'CATA', 'CATB'])]
+)
+def test_parse_categories(parse_args, expected):
+    '''
+    Make sure categories are parsed out in to a categorical column
+    '''
+    tab = pd.DataFrame({'seqid': pd.Categorical(
+        ['seq1|catA', 'seq2|catA', 'seq3|catB'])})
+    tab = parse_categories(tab, **parse_args)
+    assert tab.category.tolist() == expected
+    assert tab.category.dtype == 'category'
+
+
+def test_apply_callback():
+    '''
+    Make sure the callback is called once per distinct key, and chunks
+    come back in order
+    '''
+    calls = []
+
+    def callback(value):
+        calls.append(value)
+        return value.upper()
+    ids = ['abcZ_1', 'abcZ_2', 'adk_1', 'other']
+    assert apply_callback(callback, ids, key='^[^_]+(?=_)').tolist() == \
+        ['ABCZ', 'ABCZ', 'ADK', 'OTHER']
+    assert calls == ['abcZ', 'adk', 'other']
+    assert apply_callback('string:capwords', ids, workers=2, chunk_size=1).tolist() == \
+        ['Abcz_1', 'Abcz_2', 'Adk_1', 'Other']
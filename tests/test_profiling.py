@@ -0,0 +1,33 @@
+'''
+Tests for the profiler
+'''
+
+import json
+import subprocess
+import sys
+import time
+
+from db_check.profiling import *
+
+
+def test_profiler(tmp_path):
+    '''
+    Make sure stages are recorded, with the CPU time of child processes,
+    and that nothing is recorded when disabled
+    '''
+    profiler = Profiler(cprofile_dir=tmp_path / "prof")
+    with profiler.stage("child"):
+        subprocess.run([sys.executable, "-c", "sum(range(10**6))"], check=True)
+    with profiler.stage("sleep"):
+        time.sleep(0.05)
+    profiler.write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as fh:
+        stages = json.load(fh)['stages']
+    assert [stage['stage'] for stage in stages] == ["child", "sleep"]
+    assert stages[0]['children_cpu_seconds'] > 0
+    assert stages[1]['wall_seconds'] >= 0.05
+    assert (tmp_path / "prof" / "sleep.prof").exists()
+    disabled = Profiler(enabled=False)
+    with disabled.stage("nothing"):
+        pass
+    assert disabled.stages == []
@@ -0,0 +1,130 @@
+'''
+Tests for querying a DB held in memory
+'''
+
+import json
+import pathlib
+import random
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from db_check.native import reverse_complement
+from db_check.query import *
+from db_check.server import IndexHolder, make_server
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.fixture(scope="module")
+def example_index():
+    return QueryIndex(EXAMPLE, delimiter="~~", field=-1)
+
+
+def seqids(records):
+    return sorted(record['seqid'] for record in records)
+
+
+@pytest.mark.parametrize("sequence, identical, contained_in, contains", [
+    ("AACCTTCATACAGATCTAGA", ["seq1~~catA", "seq2~~catB"], [], ["seq3~~catA"]),
+    ("TCTAGATCTGTATGAAGGTT", ["seq1~~catA", "seq2~~catB"], [], ["seq3~~catA"]),
+    ("CCTTCATACAG", [], ["seq1~~catA", "seq2~~catB", "seq3~~catA"], []),
+    ("GGAACCTTCATACAGATCTAGAGG", [], [], ["seq1~~catA", "seq2~~catB", "seq3~~catA"]),
+    ("ACGTACGTACGT", [], [], [])]
+)
+def test_query_sequence(example_index, sequence, identical, contained_in, contains):
+    '''
+    Make sure identical, containing and contained records are found on
+    both strands
+    '''
+    result = example_index.query(sequence=sequence)
+    assert seqids(result['identical']) == identical
+    assert seqids(result['contained_in']) == contained_in
+    assert seqids(result['contains']) == contains
+
+
+def test_query_issues(example_index):
+    '''
+    Make sure the checks are run as if the query was added to the DB
+    '''
+    result = example_index.query(sequence="GTCTAAAGCAGTGATCTCCC", seqid="seq8~~catC")
+    assert result['category'] == "catC"
+    assert result['issues'] == ['Partially and/of completely overlapping sequences.']
+    result = example_index.query(sequence="GTCTAAAGCAGTGATCTCCC", seqid="seq8~~catF")
+    assert 'Partially and/of completely overlapping sequences with distinct categories.' in result['issues']
+    result = example_index.query(sequence="ACGTACGTACGT", seqid="seq7~~catE")
+    assert seqids(result['same_id']) == ["seq7~~catE"]
+    assert 'More than one sequence with same ID.' in result['issues']
+    assert example_index.query(sequence="ACGTACGTACGT", seqid="seq9~~catE")['issues'] == []
+
+
+def test_query_offsets(tmp_path):
+    '''
+    Make sure long queries are found where they are, and agree with a
+    brute force search
+    '''
+    rng = random.Random(1)
+    seqs = [''.join(rng.choice("ACGT") for _ in range(rng.randint(5, 120)))
+            for _ in range(50)]
+    seqs.append(seqs[3][10:70])
+    seqs.append(reverse_complement(seqs[4].encode()).decode()[5:90])
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(''.join(f">s{i}\n{seq}\n" for i, seq in enumerate(seqs)))
+    index = QueryIndex(fasta, k=8, step=4)
+    for i, query in enumerate(seqs):
+        result = index.query(sequence=query)
+        rc = reverse_complement(query.encode()).decode()
+        expected = sorted(f"s{j}" for j, seq in enumerate(seqs)
+                          if len(seq) > len(query) and (query in seq or rc in seq))
+        assert seqids(result['contained_in']) == expected
+        for record in result['contained_in']:
+            seq = seqs[int(record['seqid'][1:])]
+            hit = query if record['strand'] == '+' else rc
+            assert seq[record['offset']:record['offset'] + len(query)] == hit
+        expected = sorted(f"s{j}" for j, seq in enumerate(seqs)
+                          if len(seq) < len(query) and (seq in query or seq in rc))
+        assert seqids(result['contains']) == expected
+
+
+def test_server(tmp_path):
+    '''
+    Make sure the server answers queries, and picks up a new release on
+    reload
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(EXAMPLE.read_text())
+    holder = IndexHolder(fasta, delimiter="~~", field=-1)
+    server = make_server(holder, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(path, obj=None):
+        request = urllib.request.Request(f"{url}{path}", data=json.dumps(obj or {}).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    try:
+        with urllib.request.urlopen(f"{url}/status") as response:
+            assert json.load(response)['records'] == 8
+        result = post("/query", {'sequence': "TAATAAGGATAGTGCGAAAG"})
+        assert seqids(result['identical']) == ["seq7~~catE"]
+        with open(fasta, 'at') as fh:
+            fh.write("\n>seq9~~catF\nACGTACGTACGT\n")
+        assert post("/reload")['records'] == 9
+        with urllib.request.urlopen(f"{url}/query?seqid=seq9~~catF") as response:
+            assert seqids(json.load(response)['same_id']) == ["seq9~~catF"]
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            post("/query", {'sequence': 42})
+        assert exc.value.code == 400 and "error" in json.load(exc.value)
+        fasta.unlink()
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            post("/reload")
+        assert exc.value.code == 500 and json.load(exc.value)['status']['records'] == 9
+        assert seqids(post("/query", {'seqid': "seq9~~catF"})['same_id']) == ["seq9~~catF"]
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,91 @@
+'''
+Tests for the report
+'''
+
+import io
+import types
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("markdown_strings")
+
+from db_check.report import *  # noqa: E402
+
+
+def test_grouped_tables(tmp_path):
+    '''
+    Make sure one table is written per group, up to max_groups
+    '''
+    tab = pd.DataFrame({'clusterid': [0, 0, 1, 1, 2, 2],
+                        'seqid': ['a', 'b', 'c', 'd', 'e', 'f']})
+    side_file = tmp_path / "clusters.tsv"
+    stream = io.StringIO()
+    grouped_tables(tab, 'clusterid', "Cluster {}", "Title: Sequences in cluster {}", 4,
+                   stream=stream, max_groups=2, side_file=side_file)
+    report = stream.getvalue()
+    assert "Cluster 0" in report and "Cluster 1" in report
+    assert "Cluster 2" not in report
+    assert "1 more clusters were left out" in report
+    assert pd.read_csv(side_file, sep='\t').equals(tab)
+
+
+def test_grouped_tables_chunks(monkeypatch):
+    '''
+    Make sure rendering a chunk of groups at a time gives the same report
+    as rendering them all at once, when the columns are as wide throughout
+    '''
+    tab = pd.DataFrame({'clusterid': [0, 0, 0, 1, 2, 2, 3],
+                        'seqid': ['a', 'b', 'c', 'd', 'e', 'f', 'g']})
+    reports = []
+    for rows in (2, 1000):
+        monkeypatch.setattr("db_check.report.RENDER_ROWS", rows)
+        stream = io.StringIO()
+        grouped_tables(tab, 'clusterid', "Cluster {}", "Title: Sequences in cluster {}", 4,
+                       stream=stream, max_groups=3)
+        reports.append(stream.getvalue())
+    assert reports[0] == reports[1]
+    assert reports[0].count("| seqid") == 3 and "| g" not in reports[0]
+
+
+def test_near_duplicate_report(tmp_path):
+    '''
+    Make sure pairs of near-identical sequences are listed, up to
+    max_clusters, with pipes escaped
+    '''
+    tab = pd.DataFrame({'seqid_a': ['a|1', 'c'], 'clusterid_a': [0, 2],
+                        'seqid_b': ['b', 'd'], 'clusterid_b': [1, 3],
+                        'edits': [1, 2], 'strand': ['+', '-'],
+                        'identity': [0.99, 0.98]})
+    obj = types.SimpleNamespace(near_duplicates=tab)
+    side_file = tmp_path / "near_duplicates.tsv"
+    stream = io.StringIO()
+    near_duplicate_report(obj, stream=stream, max_clusters=1, side_file=side_file)
+    report = stream.getvalue()
+    assert "Near-identical sequences" in report
+    assert "a\\|1" in report and "| c " not in report
+    assert "1 more pairs were left out" in report
+    assert pd.read_csv(side_file, sep='\t').shape[0] == 2
+    stream = io.StringIO()
+    near_duplicate_report(types.SimpleNamespace(near_duplicates=None), stream=stream)
+    assert stream.getvalue() == ""
+
+
+def test_conflict_report(tmp_path):
+    '''
+    Make sure groups of tangled categories are listed, up to max_clusters,
+    with pipes escaped
+    '''
+    from db_check.conflicts import conflict_graph
+    tab = pd.DataFrame({'clusterid': [0, 0, 1, 1, 2, 2],
+                        'category': ['a|1', 'b', 'b', 'c', 'd', 'e']})
+    graph = conflict_graph(tab, tab.groupby('clusterid').category.nunique())
+    side_file = tmp_path / "conflict_components.tsv"
+    stream = io.StringIO()
+    conflict_report(types.SimpleNamespace(conflicts=graph), stream=stream, max_clusters=1,
+                    side_file=side_file)
+    report = stream.getvalue()
+    assert "Categories tangled together" in report
+    assert "a\\|1, b, c" in report and "d, e" not in report
+    assert "1 more groups were left out" in report
+    assert pd.read_csv(side_file, sep='\t').shape[0] == 2
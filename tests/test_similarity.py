@@ -0,0 +1,102 @@
+'''
+Tests for finding near-identical sequences
+'''
+
+import itertools
+import random
+
+import pytest
+
+from db_check.checklist import DBChecklist
+from db_check.native import cluster_db_native, reverse_complement
+from db_check.parsers import parse_categories
+from db_check.similarity import *
+from db_check.validation import CDHIT_MIN_LENGTH
+
+
+def random_seq(rng, length):
+    return ''.join(rng.choice("ACGT") for _ in range(length)).encode()
+
+
+@pytest.mark.parametrize("a, b, max_edits, expected", [
+    (b"ACGTACGT", b"ACGTACGT", 2, 0),
+    (b"ACGTACGT", b"ACGAACGT", 2, 1),
+    (b"ACGTACGT", b"ACGTCGT", 2, 1),
+    (b"ACGTACGT", b"ACGTTACGT", 2, 1),
+    (b"ACGTACGT", b"TGCATGCA", 2, None),
+    (b"ACGTACGT", b"ACG", 2, None)]
+)
+def test_edit_distance(a, b, max_edits, expected):
+    '''
+    Make sure the banded edit distance is right, and gives up past
+    max_edits
+    '''
+    assert edit_distance(a, b, max_edits) == expected
+    assert edit_distance(b, a, max_edits) == expected
+
+
+def test_find_near_duplicates():
+    '''
+    Make sure the pairs found agree with comparing all pairs
+    '''
+    rng = random.Random(0)
+    seqs = [random_seq(rng, rng.randint(200, 400)) for _ in range(100)]
+    for seq in seqs[:30]:
+        mutant = bytearray(seq)
+        for _ in range(rng.randint(1, 3)):
+            position = rng.randrange(len(mutant))
+            mutant[position] = ord(rng.choice("ACGT".replace(chr(mutant[position]), "")))
+        if rng.random() < 0.3:
+            del mutant[rng.randrange(len(mutant))]
+        if rng.random() < 0.5:
+            mutant = reverse_complement(bytes(mutant))
+        seqs.append(bytes(mutant))
+    found = {(i, j) for i, j, _, _ in find_near_duplicates(seqs, 0.99)}
+    expected = set()
+    for i, j in itertools.combinations(range(len(seqs)), 2):
+        result = compare(seqs[i], seqs[j], 0.99)
+        if result is not None and result[0] > 0:
+            expected.add((i, j))
+    assert len(expected) >= 25
+    assert found == expected
+
+
+def test_near_duplicates(tmp_path):
+    '''
+    Make sure near-identical sequences in distinct clusters are reported,
+    and flagged by the checks
+    '''
+    rng = random.Random(1)
+    seq = random_seq(rng, 300)
+    mutant = seq[:150] + (b"A" if seq[150:151] != b"A" else b"C") + seq[151:]
+    records = [("a~~x", seq), ("b~~y", mutant), ("c~~x", seq[10:200]),
+               ("d~~z", random_seq(rng, 300))]
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(''.join(f">{seqid}\n{s.decode()}\n" for seqid, s in records))
+    tab = parse_categories(cluster_db_native(fasta), delimiter="~~", field=-1)
+    pairs = near_duplicates(fasta, tab, 0.99)
+    assert pairs[['seqid_a', 'seqid_b', 'category_a', 'category_b', 'edits', 'identity']].values.tolist() == \
+        [["a~~x", "b~~y", "x", "y", 1, round(1 - 1 / 300, 4)]]
+    checklist = DBChecklist(tab, author="test", db_name="db", near_duplicates=pairs)
+    checklist.ticks()
+    assert 'Near-identical sequences in distinct clusters.' in checklist.issues
+    checklist = DBChecklist(tab, author="test", db_name="db")
+    checklist.ticks()
+    assert checklist.check_results['near_duplicates']['status'] == 'skipped'
+
+
+def test_near_duplicates_short_records(tmp_path):
+    '''
+    Make sure pairs with records missing from the cluster table, as short
+    records left out by CD-HIT are, are skipped
+    '''
+    rng = random.Random(2)
+    seq = random_seq(rng, 300)
+    mutant = seq[:150] + (b"A" if seq[150:151] != b"A" else b"C") + seq[151:]
+    records = [("a", seq), ("b", mutant), ("short1", b"ACGTTGCAAG"), ("short2", b"ACGTTGCAAC")]
+    fasta = tmp_path / "db.fasta"
+    fasta.write_text(''.join(f">{seqid}\n{s.decode()}\n" for seqid, s in records))
+    tab = cluster_db_native(fasta)
+    tab = tab[tab.length >= CDHIT_MIN_LENGTH]
+    pairs = near_duplicates(fasta, tab, 0.9)
+    assert pairs[['seqid_a', 'seqid_b', 'edits']].values.tolist() == [["a", "b", 1]]
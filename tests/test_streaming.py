@@ -0,0 +1,123 @@
+'''
+Tests for checking DBs in bounded memory
+'''
+
+import io
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "benchmarks"))
+
+import db_check.streaming  # noqa: E402
+from db_check.checklist import DBChecklist  # noqa: E402
+from db_check.outputs import summary  # noqa: E402
+from db_check.parsers import parse_categories, parse_clustering  # noqa: E402
+from db_check.streaming import *  # noqa: E402
+from synthetic import HEADER_FORMATS, synthetic_records, write_clstr  # noqa: E402
+
+
+@pytest.fixture
+def clstr(tmp_path):
+    records = synthetic_records(2000, min_length=30, max_length=60, duplicate_id_rate=0.05,
+                                identical_rate=0.1, containment_rate=0.1, header='tilde')
+    filename = tmp_path / "db.clstr"
+    write_clstr(records, filename)
+    return filename
+
+
+@pytest.mark.parametrize("values", [[], [3], [1, 1, 2, 5], [1] * 7 + [2, 2, 9]])
+def test_describe_counts(values):
+    '''
+    Make sure the counts are described as pandas would
+    '''
+    expected = pd.Series(values, dtype='float64', name='x').describe().to_frame().transpose()
+    counts = pd.Series(values, dtype='int64').value_counts().to_dict()
+    pd.testing.assert_frame_equal(describe_counts(counts, 'x'), expected)
+
+
+def test_iter_clustering(clstr):
+    '''
+    Make sure chunks hold whole clusters, and add up to the whole file
+    '''
+    chunks = list(iter_clustering(clstr, chunk_size=1000))
+    assert len(chunks) > 10
+    ids = [set(chunk.clusterid) for chunk in chunks]
+    assert all(not a & b for a, b in zip(ids, ids[1:]))
+    tab = pd.concat([chunk.astype({'seqid': str}) for chunk in chunks], ignore_index=True)
+    pd.testing.assert_frame_equal(tab, parse_clustering(clstr).astype({'seqid': str}))
+
+
+@pytest.fixture
+def checklists(clstr, monkeypatch):
+    '''
+    The checklists of the same DB, streamed and held in memory
+    '''
+    monkeypatch.setattr(db_check.streaming, "PARTITION_SIZE", 10000)
+    parse_args = HEADER_FORMATS['tilde'][1]
+    stats = stream_clusters(clstr, chunk_size=5000, **parse_args)
+    assert stats.partitions > 1
+    streamed = StreamingChecklist(stats, author="test", db_name="db")
+    full = DBChecklist(parse_categories(parse_clustering(clstr), **parse_args),
+                       author="test", db_name="db")
+    for obj in (streamed, full):
+        obj.ticks()
+    return streamed, full
+
+
+def test_stream_clusters(checklists):
+    '''
+    Make sure streaming gives the same summary and checks as holding all
+    the clusters in memory
+    '''
+    streamed, full = checklists
+    assert streamed.issues == full.issues
+    summaries = [summary(obj) for obj in (streamed, full)]
+    for result in summaries:
+        result.pop('checks')
+    for name in ('cluster_size_dist', 'categories_by_cluster_dist'):
+        summaries[0][name] = pytest.approx(summaries[0][name])
+    assert summaries[0] == summaries[1]
+    sizes = full.df.groupby('clusterid').clusterid.transform('size')
+    listed = full.df[(sizes > 1) | full.df.duplicated('seqid', keep=False)]
+    assert streamed.df.shape[0] == listed.shape[0] < full.df.shape[0]
+
+
+def test_stream_clusters_report(checklists):
+    '''
+    Make sure streaming gives the same report as holding all the clusters
+    in memory
+    '''
+    generate_report = pytest.importorskip("db_check.report").generate_report
+    reports = []
+    for obj in checklists:
+        stream = io.StringIO()
+        generate_report(obj, stream=stream)
+        reports.append(stream.getvalue())
+    assert reports[0] == reports[1]
+
+
+def test_stream_clusters_empty(tmp_path):
+    '''
+    Make sure an empty clustering gives an empty summary
+    '''
+    filename = tmp_path / "db.clstr"
+    filename.write_text("")
+    stats = stream_clusters(filename, regex=".*~~(.*)")
+    checklist = StreamingChecklist(stats, author="test", db_name="db")
+    assert checklist.total_entries == checklist.n_unique_sequences == 0
+    assert np.isnan(checklist.cluster_size_dist['mean'].iloc[0])
+    assert list(checklist.df.columns) == ['clusterid', 'seqid', 'length', 'is_centroid',
+                                          'match', 'category']
+
+
+def test_check_db_stream_options():
+    '''
+    Make sure streaming is refused with options that need all the clusters
+    '''
+    from db_check.pipeline import check_db
+    with pytest.raises(ValueError):
+        check_db("db.fasta", "test", engine="native", stream=True)
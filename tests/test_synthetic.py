@@ -0,0 +1,35 @@
+'''
+Tests for the synthetic DBs used by the benchmarks
+'''
+
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "benchmarks"))
+
+from synthetic import *  # noqa: E402
+from db_check.native import cluster_db_native  # noqa: E402
+from db_check.parsers import parse_categories, parse_clustering  # noqa: E402
+
+
+@pytest.mark.parametrize("header", list(HEADER_FORMATS))
+def test_synthetic_db(tmp_path, header):
+    '''
+    Make sure the .clstr file matches the records, and that the FASTA DB
+    clusters the same way
+    '''
+    records = synthetic_records(500, min_length=30, max_length=60, duplicate_id_rate=0.05,
+                                identical_rate=0.1, containment_rate=0.1, header=header)
+    write_clstr(records, tmp_path / "db.clstr")
+    write_fasta(records, tmp_path / "db.fasta")
+    tab = parse_categories(parse_clustering(tmp_path / "db.clstr"),
+                           **HEADER_FORMATS[header][1])
+    assert tab.shape[0] == 500
+    assert sorted(tab.seqid.astype(str)) == sorted(records.seqid)
+    assert sorted(tab.category.astype(str)) == sorted(records.category)
+    assert tab.clusterid.nunique() == records.is_centroid.sum()
+    assert tab.seqid.nunique() < 500
+    native = cluster_db_native(tmp_path / "db.fasta")
+    assert native.clusterid.nunique() == records.is_centroid.sum()
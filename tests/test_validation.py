@@ -0,0 +1,96 @@
+'''
+Tests for validating FASTA DBs before clustering
+'''
+
+import gzip
+import pathlib
+
+import pytest
+
+from db_check.checklist import DBChecklist
+from db_check.native import cluster_db_native
+from db_check.validation import *
+
+EXAMPLE = pathlib.Path(__file__).parent.parent / \
+    "db_check" / "examples" / "example_db.fasta"
+
+
+@pytest.mark.parametrize("content, kind, line, seqid", [
+    (b"ACGT\n>a\nACGTACGTACGT\n", 'before_first_header', 1, None),
+    (b">a\nACGTACGTACGT\n> desc\nACGTACGTACGT\n", 'empty_ids', 3, None),
+    (b">a...b\nACGTACGTACGT\n", 'mangled_ids', 1, "a...b"),
+    (b">a\n>b\nACGTACGTACGT\n", 'empty_records', 1, "a"),
+    (b">a\nACGTAC-GTACGT*\n", 'invalid_characters', 1, "a"),
+    (b">a\nACGT\n", 'short_records', 1, "a"),
+    (b">a\nACGTACGTACGT\n>a\nACGTACGTACGA\n", 'duplicate_ids', 3, "a"),
+    (b">a\nACGTACGTACGT\n\n>b\nACGTACGTACGA\n", 'blank_lines', 3, None),
+    (b">a\r\nACGTACGTACGT\r\n", 'crlf_line_endings', 1, None),
+    (b">a\r\nACGTACGTACGT\n", 'mixed_line_endings', 1, None),
+    (b">a\nACGTACGTACGT", 'no_final_newline', 2, None),
+    (b"", 'no_records', 0, None)]
+)
+def test_validate_fasta(tmp_path, content, kind, line, seqid):
+    '''
+    Make sure each kind of finding is found, and only that
+    '''
+    fasta = tmp_path / "db.fasta.gz"
+    fasta.write_bytes(gzip.compress(content))
+    result = validate_fasta(fasta)
+    assert list(result.counts) == [kind]
+    assert result.examples[kind][0][:2] == (line, seqid)
+    assert result.has_errors == (kind in ERRORS)
+
+
+def test_validate_fasta_ok():
+    '''
+    Make sure lower case, IUPAC codes and white space within lines are fine
+    '''
+    result = validate_fasta(EXAMPLE)
+    assert result.records == 8
+    assert set(result.counts) == {'duplicate_ids', 'no_final_newline'}
+
+
+def test_validate_fasta_fail_fast(tmp_path):
+    '''
+    Make sure validation stops at the first error with fail_fast
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">a\nACGTNRYacgt ACGT\n>b\nAC*GTACGTACGT\n>c\n>d\nACGTACGTACGT\n")
+    result = validate_fasta(fasta, fail_fast=True)
+    assert not result.complete
+    assert dict(result.counts) == {'invalid_characters': 1}
+    result = validate_fasta(fasta)
+    assert result.complete
+    assert dict(result.counts) == {'invalid_characters': 1, 'empty_records': 1}
+    assert result.table().finding.tolist() == ['empty_records', 'invalid_characters']
+
+
+def test_validation_checks(tmp_path):
+    '''
+    Make sure the findings are reported as checks of their own
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">a\nACGTACGTACGT\n>b\nGGGG\n")
+    validation = validate_fasta(fasta)
+    checklist = DBChecklist(cluster_db_native(fasta), author="test", db_name="db",
+                            validation=validation)
+    checklist.ticks()
+    assert checklist.check_results['fasta_short_records']['status'] == 'issue'
+    assert checklist.check_results['fasta_duplicate_ids']['status'] == 'passed'
+    assert checklist.issues == ["FASTA validation: " + validation.describe('short_records')]
+
+
+def test_duplicate_ids_reported_once(tmp_path):
+    '''
+    Make sure duplicated IDs found both in the cluster table and validating
+    the DB are only reported once
+    '''
+    fasta = tmp_path / "db.fasta"
+    fasta.write_bytes(b">a\nACGTACGTACGT\n>a\nGGGGCCCCAAAA\n")
+    validation = validate_fasta(fasta)
+    checklist = DBChecklist(cluster_db_native(fasta), author="test", db_name="db",
+                            validation=validation)
+    checklist.ticks()
+    assert checklist.check_results['duplicates']['status'] == 'issue'
+    assert checklist.check_results['fasta_duplicate_ids']['status'] == 'passed'
+    assert checklist.issues == ['More than one sequence with same ID.']